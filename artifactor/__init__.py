@@ -120,25 +120,271 @@ Inside Artifactor, by default, a pre_hook callback called ``start_test()`` is bo
 This is how the artifact_path is returned. This hook can be removed, by running a
 ``unregister_hook_callback`` with the name of the hook callback.
 
+The plugin hooks are not run one after another. Every plugin has its own work queue (see
+:py:mod:`artifactor.dispatch`) and an event only waits for the hooks that are sync points: all
+hooks of an event fired with ``grab_result`` or ``wait_for_task``, and the hooks listed in
+``sync_hooks`` of the plugin class or the plugin config. The global value updates of the other
+hooks are applied when they finish, their local values are dropped with a warning. Events with
+post-hook callbacks wait for all their hooks. Before a ``finish_session`` event, all queued work is
+waited for. Hooks listed in ``exclusive_hooks`` read the global values while no updates are being
+applied to them, other hooks can read copies of the records from ``iter_artifacts()``. The plugin
+config can set the number of events of a plugin processed at once::
+
+    plugins:
+        merkyl:
+            enabled: True
+            plugin: merkyl
+            concurrency: 4
+            sync_hooks:
+                - start_test
+
+Per plugin queue depth and latency numbers are returned by the ``dispatch_stats`` event and logged
+at the end of the session.
+
+The ``artifacts`` and ``old_artifacts`` global values are artifact stores (see
+:py:mod:`artifactor.store`), which behave like dicts of test ident to the test record. For runs
+with a lot of tests, they can be kept in sqlite instead of memory::
+
+    artifact_store: sqlite
+
+Plugins look the records up by the test ident, or use ``query()`` and ``counts()`` of the store
+to find tests of a slave or with a status. Results sent back to the clients (``grab_result``) do
+not include the stores.
+
 """
 import logging
 import os
+import Queue
 import re
 import sys
+import threading
+from concurrent import futures
+from copy import deepcopy
 
+import riggerlib
 from py.path import local
-from riggerlib import Rigger, RiggerBasePlugin, RiggerClient
+from riggerlib import Rigger, RiggerBasePlugin, RiggerClient, Task
+from riggerlib.tools import recursive_update
 
+from artifactor.dispatch import PluginQueue, ordering_key
+from artifactor.store import ArtifactStore, create_stores
 from utils.net import random_port
 from utils.path import log_path
 
 
 class Artifactor(Rigger):
     """A sub from Rigger"""
+    #: Events which wait for all the queued work before they are processed
+    BARRIER_HOOKS = {'finish_session'}
+    #: Marks events whose sender waits for the result
+    SYNC_FLAG = '_artifactor_sync'
+
+    def __init__(self, *args, **kwargs):
+        # Rigger starts the queue thread right away, it needs these
+        self.queues = {}
+        self._outstanding = 0
+        self._idle = threading.Condition()
+        self._lane = threading.local()
+        self._completions = futures.ThreadPoolExecutor(max_workers=16)
+        self._dropped_warned = set()
+        super(Artifactor, self).__init__(*args, **kwargs)
+        # Reentrant, plugin hooks holding it can fire hooks themselves
+        self.gdl = threading.RLock()
 
     def set_config(self, config):
         self.config = config
 
+    def setup_plugin_instances(self):
+        super(Artifactor, self).setup_plugin_instances()
+        for queue in self.queues.values():
+            queue.shutdown(wait=False)
+        self.queues = {
+            ident: PluginQueue(
+                ident, instance.data.get('concurrency', 1), on_done=self._work_done)
+            for ident, instance in self.instances.iteritems()}
+
+    def process_queue(self):
+        """Takes the events off the riggerlib queue and dispatches them.
+
+        Unlike in riggerlib, waiting for the sync points of an event and finishing its task is
+        done by the completion threads, so an event waiting for a slow plugin does not hold up
+        the events of the other slaves.
+        """
+        while not riggerlib._global_queue_shutdown:
+            try:
+                tid = riggerlib._global_queue.get(timeout=0.1)
+            except Queue.Empty:
+                continue
+            with riggerlib._queue_lock:
+                task = riggerlib._task_list[tid]
+                task.status = Task.RUNNING
+            try:
+                dispatched = self.dispatch_hook(
+                    task.json_dict['hook_name'], **task.json_dict['data'])
+            except Exception as e:
+                self.log_message(e)
+                dispatched = None
+            if dispatched is not None and dispatched[2]:
+                self._completions.submit(self._finish_task, tid, dispatched)
+            else:
+                self._finish_task(tid, dispatched)
+
+    def _finish_task(self, tid, dispatched):
+        with riggerlib._queue_lock:
+            task = riggerlib._task_list[tid]
+        try:
+            if dispatched is not None:
+                loc, glo = self.complete_hook(*dispatched)
+                combined_dict = {}
+                # The whole artifact stores would be serialized for the client on every event
+                combined_dict.update({
+                    key: value for key, value in glo.iteritems()
+                    if not isinstance(value, ArtifactStore)})
+                combined_dict.update(loc)
+                task.output = combined_dict
+        except Exception as e:
+            self.log_message(e)
+        with riggerlib._queue_lock:
+            riggerlib._global_queue.task_done()
+            task.status = Task.FINISHED
+            if not task.json_dict.get('grab_result', None):
+                del riggerlib._task_list[tid]
+
+    def _fire_internal_hook(self, json_dict):
+        if json_dict.get('grab_result') or json_dict.get('wait_for_task'):
+            json_dict.setdefault('data', {})[self.SYNC_FLAG] = True
+        return super(Artifactor, self)._fire_internal_hook(json_dict)
+
+    def fire_hook(self, hook_name, **kwargs):
+        if getattr(self._lane, 'active', False):
+            # Fired by a plugin hook, dispatch right away so that the queued work includes it
+            self.process_hook(hook_name, **kwargs)
+        else:
+            super(Artifactor, self).fire_hook(hook_name, **kwargs)
+
+    def _work_done(self):
+        with self._idle:
+            self._outstanding -= 1
+            if not self._outstanding:
+                self._idle.notify_all()
+
+    def wait_for_plugins(self):
+        """Waits until all the queued plugin work is done."""
+        with self._idle:
+            while self._outstanding:
+                self._idle.wait(1)
+
+    def dispatch_stats(self):
+        """Returns :py:class:`dict` of plugin ident to its queue stats."""
+        return {ident: queue.stats.as_dict() for ident, queue in self.queues.iteritems()}
+
+    def get_dispatch_stats(self):
+        """Convenience hook callback for the ``dispatch_stats`` event"""
+        return {'dispatch_stats': self.dispatch_stats()}, None
+
+    def _run_plugin_hook(self, cb, kwargs, exclusive):
+        self._lane.active = True
+        try:
+            if exclusive:
+                with self.gdl:
+                    kwargs_updates, globals_updates = self.process_callbacks([cb], kwargs)
+                    self.global_data = recursive_update(self.global_data, globals_updates)
+            else:
+                kwargs_updates, globals_updates = self.process_callbacks([cb], kwargs)
+                with self.gdl:
+                    self.global_data = recursive_update(self.global_data, globals_updates)
+            return kwargs_updates
+        except Exception:
+            self.handle_failure(sys.exc_info())
+            raise
+        finally:
+            self._lane.active = False
+
+    def process_hook(self, hook_name, **kwargs):
+        """Processes the event, waits only for the plugin hooks which are sync points.
+
+        Follows :py:meth:`riggerlib.Rigger.process_hook`, except that the plugin hooks are run by
+        the plugin queues.
+        """
+        dispatched = self.dispatch_hook(hook_name, **kwargs)
+        if dispatched is not None:
+            return self.complete_hook(*dispatched)
+
+    def dispatch_hook(self, hook_name, **kwargs):
+        """Runs the pre-hook callbacks and queues the plugin hooks of the event.
+
+        Returns: ``(hook_name, kwargs, futures of the sync points)`` for :py:meth:`complete_hook`
+        """
+        if not self.initialized:
+            return
+        nested = getattr(self._lane, 'active', False)
+        sync = kwargs.pop(self.SYNC_FLAG, False) and not nested
+        if hook_name in self.BARRIER_HOOKS and not nested:
+            self.wait_for_plugins()
+        kwargs.update({'config': self.config})
+
+        if self.pre_callbacks.get(hook_name):
+            kwargs_updates, globals_updates = self.process_callbacks(
+                self.pre_callbacks[hook_name].values(), kwargs)
+            with self.gdl:
+                self.global_data = recursive_update(self.global_data, globals_updates)
+            kwargs = recursive_update(kwargs, kwargs_updates)
+
+        key = ordering_key(kwargs)
+        # The post-hook callbacks get the local values of all the hooks
+        sync = sync or bool(self.post_callbacks.get(hook_name))
+        waited = []
+        for instance_name, instance in self.instances.iteritems():
+            callbacks = instance.obj.callbacks
+            if not (callbacks.get(hook_name) and instance.data.get('enabled', None)):
+                continue
+            obj = instance.obj
+            exclusive = hook_name in getattr(obj, 'exclusive_hooks', ())
+            with self._idle:
+                self._outstanding += 1
+            future = self.queues[instance_name].submit(
+                key, self._run_plugin_hook, callbacks[hook_name], dict(kwargs), exclusive)
+            if not nested and (sync or hook_name in getattr(obj, 'sync_hooks', ()) or
+                               hook_name in instance.data.get('sync_hooks', ())):
+                waited.append(future)
+            else:
+                future.add_done_callback(
+                    lambda future, ident=instance_name: self._check_dropped(
+                        ident, hook_name, future))
+        return hook_name, kwargs, waited
+
+    def _check_dropped(self, ident, hook_name, future):
+        """Warns about local values returned by a hook nobody waited for, once per hook."""
+        if future.exception() is not None or not future.result():
+            return  # Failures are logged by handle_failure
+        if (ident, hook_name) not in self._dropped_warned:
+            self._dropped_warned.add((ident, hook_name))
+            self.logger.warning(
+                'Local values returned by the %s hook of %s are dropped, the event does not wait '
+                'for it; add the hook to sync_hooks to pass them on', hook_name, ident)
+
+    def complete_hook(self, hook_name, kwargs, waited):
+        """Waits for the sync points of the event and runs its post-hook callbacks."""
+        for future in waited:
+            try:
+                kwargs = recursive_update(kwargs, future.result() or {})
+            except Exception as e:
+                if not self.squash_exceptions:
+                    raise
+                self.log_message(e)
+
+        if self.post_callbacks.get(hook_name):
+            kwargs_updates, globals_updates = self.process_callbacks(
+                self.post_callbacks[hook_name].values(), kwargs)
+            with self.gdl:
+                self.global_data = recursive_update(self.global_data, globals_updates)
+            kwargs = recursive_update(kwargs, kwargs_updates)
+
+        if hook_name in self.BARRIER_HOOKS and not getattr(self._lane, 'active', False):
+            self.wait_for_plugins()
+            self.logger.info('Plugin dispatch stats: %s', self.dispatch_stats())
+        return kwargs, self.global_data
+
     def parse_config(self):
         """
         Reads the config data and sets up values
@@ -160,12 +406,13 @@ class Artifactor(Rigger):
         self.config['zmq_socket_address'] = 'tcp://127.0.0.1:{}'.format(random_port())
         self.setup_plugin_instances()
         self.start_server()
+        artifacts, old_artifacts = create_stores(self.config, self.log_dir)
         self.global_data = {
             'artifactor_config': self.config,
             'log_dir': self.log_dir.strpath,
             'artifact_dir': self.artifact_dir.strpath,
-            'artifacts': dict(),
-            'old_artifacts': dict()
+            'artifacts': artifacts,
+            'old_artifacts': old_artifacts
         }
 
     def handle_failure(self, exc):
@@ -181,6 +428,22 @@ class ArtifactorClient(RiggerClient):
 
 class ArtifactorBasePlugin(RiggerBasePlugin):
     """A sub from RiggerBasePlugin"""
+    #: Hooks which the event waits for, so their local value updates are passed on
+    sync_hooks = ()
+    #: Hooks which read the global values while no updates are applied to them
+    exclusive_hooks = ()
+
+    def iter_artifacts(self, artifacts):
+        """Yields ``(test ident, copy of the record)`` of all the tests in the artifact store.
+
+        Every record is copied while no global updates are applied, one at a time, so a hook which
+        is not exclusive can read the artifacts without holding up the others for long and without
+        loading the whole store into memory.
+        """
+        for test_ident, test in artifacts.iteritems():
+            with self._rigger_instance.gdl:
+                test = deepcopy(test)
+            yield test_ident, test
 
     @property
     def store(self):
@@ -203,6 +466,8 @@ def initialize(artifactor):
                                       name="merge_artifacts")
     artifactor.register_hook_callback('finish_session', 'pre', merge_artifacts,
                                       name="merge_artifacts")
+    artifactor.register_hook_callback('dispatch_stats', 'pre', artifactor.get_dispatch_stats,
+                                      name="dispatch_stats")
     artifactor.initialized = True
 
 
@@ -217,9 +482,11 @@ def merge_artifacts(old_artifacts, artifacts):
     """
     This is extremely important and merges the old_Artifacts from a composite-uncollect build
     with the new artifacts for this run
+
+    The store of the global value is updated in place; returning it as a local value would
+    copy all the records into the event.
     """
     old_artifacts.update(artifacts)
-    return {'old_artifacts': old_artifacts}, None
 
 
 def parse_setup_dir(test_name, test_location, artifactor_config, artifact_dir, run_id):
@@ -0,0 +1,96 @@
+"""
+Concurrent dispatch of the plugin hooks for Artifactor
+
+Every plugin instance gets its own :py:class:`PluginQueue`, so a slow plugin only holds up its own
+events. A queue has a number of lanes (``concurrency`` in the plugin config, default 1), each of
+them runs its events one by one in the order they came in. All the events of one test (or of one
+slave for events which are not tied to a test) go to the same lane, so a plugin always sees them in
+order.
+"""
+import threading
+import time
+from concurrent import futures
+
+
+def ordering_key(kwargs):
+    """Returns the key of the events which have to be processed in order."""
+    if kwargs.get('test_location') or kwargs.get('test_name'):
+        return kwargs.get('test_location'), kwargs.get('test_name')
+    return kwargs.get('slaveid')
+
+
+class PluginStats(object):
+    """Queue depth and latency numbers of one plugin."""
+    def __init__(self):
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.depth = 0
+        self.max_depth = 0
+        self.wait_time = 0.0
+        self.run_time = 0.0
+        self.max_latency = 0.0
+
+    def as_dict(self):
+        completed = self.completed or 1
+        return {
+            'submitted': self.submitted,
+            'completed': self.completed,
+            'failed': self.failed,
+            'depth': self.depth,
+            'max_depth': self.max_depth,
+            'avg_wait': self.wait_time / completed,
+            'avg_run': self.run_time / completed,
+            'max_latency': self.max_latency,
+        }
+
+
+class PluginQueue(object):
+    """Work queue of a plugin instance.
+
+    Args:
+        ident: Ident of the plugin instance
+        concurrency: Number of lanes
+        on_done: Called with no arguments after every finished item
+    """
+    def __init__(self, ident, concurrency=1, on_done=None):
+        self.ident = ident
+        self.lanes = [
+            futures.ThreadPoolExecutor(max_workers=1) for _ in range(max(int(concurrency), 1))]
+        self.stats = PluginStats()
+        self.on_done = on_done
+        self._lock = threading.Lock()
+
+    def submit(self, key, fn, *args, **kwargs):
+        """Queues fn on the lane of the key, returns a :py:class:`concurrent.futures.Future`."""
+        queued_at = time.time()
+        with self._lock:
+            self.stats.submitted += 1
+            self.stats.depth += 1
+            self.stats.max_depth = max(self.stats.max_depth, self.stats.depth)
+        lane = self.lanes[hash(key) % len(self.lanes)]
+        return lane.submit(self._run, queued_at, fn, *args, **kwargs)
+
+    def _run(self, queued_at, fn, *args, **kwargs):
+        started = time.time()
+        failed = True
+        try:
+            result = fn(*args, **kwargs)
+            failed = False
+            return result
+        finally:
+            finished = time.time()
+            with self._lock:
+                stats = self.stats
+                stats.depth -= 1
+                stats.completed += 1
+                stats.failed += failed
+                stats.wait_time += started - queued_at
+                stats.run_time += finished - started
+                stats.max_latency = max(stats.max_latency, finished - queued_at)
+            if self.on_done is not None:
+                self.on_done()
+
+    def shutdown(self, wait=True):
+        for lane in self.lanes:
+            lane.shutdown(wait=wait)
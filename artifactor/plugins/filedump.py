@@ -9,14 +9,74 @@ artifactor:
         filedump:
             enabled: True
             plugin: filedump
+            writers: 4
+
+Files are written by a pool of ``writers`` background threads, so the ``filedump`` hook returns
+immediately. Writes to the same file are kept in order. The file types read back by other plugins
+during the run (``SYNC_FILE_TYPES``) are written synchronously. All the writes are finished and
+flushed to disk in ``finish_session``.
+
+Secrets passed to the ``sanitize`` hook are masked in a single pass while the traceback-like files
+are written. Files written before the secrets were known are rewritten in one pass by ``sanitize``.
 """
 
 from artifactor import ArtifactorBasePlugin
 import base64
+import logging
 import os
 import re
+from concurrent import futures
+from threading import Lock
 
 from utils import normalize_text, safe_string
+from utils.redact import Redactor
+
+# Artifacts which can contain secrets
+SANITIZED_FILE_TYPES = {"traceback", "short_tb", "rbac", "soft_traceback", "soft_short_tb"}
+# Artifacts read by other plugins (reporter) during the run
+SYNC_FILE_TYPES = {"short_tb", "qa_contact"}
+CHUNK_SIZE = 64 * 1024
+
+logger = logging.getLogger('artifactor.filedump')
+
+
+def _write_file(os_filename, mode, contents, redactor=None):
+    """Writes the contents, masking the secrets if a redactor is given.
+
+    The file is written under a temporary name and renamed when complete, so other readers never
+    see a half written file.
+    """
+    target = "{}.tmp".format(os_filename)
+    with open(target, mode.replace('a', 'w')) as f:
+        if redactor is None:
+            f.write(contents)
+        else:
+            stream = redactor.stream()
+            for i in range(0, len(contents), CHUNK_SIZE):
+                f.write(stream.feed(contents[i:i + CHUNK_SIZE]).encode('utf-8'))
+            f.write(stream.close().encode('utf-8'))
+    os.rename(target, os_filename)
+
+
+def _redact_file(os_filename, redactor):
+    """Masks the secrets in an existing file in one streaming pass."""
+    if not os.path.isfile(os_filename):
+        return
+    target = "{}.tmp".format(os_filename)
+    stream = redactor.stream()
+    with open(os_filename, 'rb') as src, open(target, 'wb') as dst:
+        for chunk in iter(lambda: src.read(CHUNK_SIZE), b''):
+            dst.write(stream.feed(chunk).encode('utf-8'))
+        dst.write(stream.close().encode('utf-8'))
+    os.rename(target, os_filename)
+
+
+def _fsync_file(os_filename):
+    fd = os.open(os_filename, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
 
 
 class Filedump(ArtifactorBasePlugin):
@@ -26,9 +86,41 @@ class Filedump(ArtifactorBasePlugin):
         self.register_plugin_hook('sanitize', self.sanitize)
         self.register_plugin_hook('pre_start_test', self.start_test)
         self.register_plugin_hook('finish_test', self.finish_test)
+        self.register_plugin_hook('finish_session', self.finish_session)
 
     def configure(self):
         self.configured = True
+        self.writers = [
+            futures.ThreadPoolExecutor(max_workers=1)
+            for _ in range(int(self.data.get('writers', 4)))]
+        self.lock = Lock()
+        # os_filename: future of the last write
+        self.pending = {}
+        # os_filename: words it was sanitized with
+        self.sanitized = {}
+        # os_filename written since the last finish_session
+        self.unsynced = set()
+        self.words = None
+        self.redactor = None
+        self.errors = []
+
+    def _submit(self, os_filename, fn, *args):
+        """Queues the write, writes to one file always go to the same writer thread."""
+        with self.lock:
+            writer = self.writers[hash(os_filename) % len(self.writers)]
+            future = writer.submit(fn, os_filename, *args)
+            self.pending[os_filename] = future
+            self.unsynced.add(os_filename)
+        future.add_done_callback(lambda f: self._written(os_filename, f))
+        return future
+
+    def _written(self, os_filename, future):
+        with self.lock:
+            if self.pending.get(os_filename) is future:
+                del self.pending[os_filename]
+        if future.exception() is not None:
+            self.errors.append((os_filename, future.exception()))
+            logger.error("Could not write %s: %s", os_filename, future.exception())
 
     def start_test(self, artifact_path, test_name, test_location, slaveid):
         if not slaveid:
@@ -77,33 +169,50 @@ class Filedump(ArtifactorBasePlugin):
             "group_id": group_id,
         })
         if not dont_write:
-            if os.path.isfile(os_filename):
-                os.remove(os_filename)
-            with open(os_filename, mode) as f:
-                if contents_base64:
-                    contents = base64.b64decode(contents)
-                f.write(contents)
+            if contents_base64:
+                contents = base64.b64decode(contents)
+            redactor = None
+            if file_type in SANITIZED_FILE_TYPES and self.redactor is not None:
+                redactor = self.redactor
+                self.sanitized[os_filename] = redactor.words
+            else:
+                self.sanitized.pop(os_filename, None)
+            future = self._submit(os_filename, _write_file, mode, contents, redactor)
+            if file_type in SYNC_FILE_TYPES:
+                futures.wait([future])
 
         return None, {'artifacts': {test_ident: {'files': artifacts}}}
 
     @ArtifactorBasePlugin.check_configured
     def sanitize(self, test_location, test_name, artifacts, words):
+        if self.redactor is None or words != self.words:
+            self.words = words
+            self.redactor = Redactor(words)
         test_ident = "{}/{}".format(test_location, test_name)
-        filename = None
         try:
-            for f in artifacts[test_ident]['files']:
-                if f["file_type"] not in {
-                        "traceback", "short_tb", "rbac", "soft_traceback",
-                        "soft_short_tb"}:
-                    continue
-                filename = f["os_filename"]
-                with open(filename) as f:
-                    data = f.read()
-                for word in words:
-                    if not isinstance(word, basestring):
-                        word = str(word)
-                    data = data.replace(word, "*" * len(word))
-                with open(filename, "w") as f:
-                    f.write(data)
+            files = artifacts[test_ident]['files']
         except KeyError:
-            pass
+            return
+        for f in files:
+            if f["file_type"] not in SANITIZED_FILE_TYPES:
+                continue
+            filename = f["os_filename"]
+            if self.sanitized.get(filename) == self.redactor.words:
+                # Already masked while it was being written
+                continue
+            # Queued behind any pending write of the file
+            self._submit(filename, _redact_file, self.redactor)
+            self.sanitized[filename] = self.redactor.words
+
+    @ArtifactorBasePlugin.check_configured
+    def finish_session(self):
+        """Durability point, all the files are completely written and synced to disk."""
+        with self.lock:
+            written = [writer.submit(lambda: None) for writer in self.writers]
+            filenames, self.unsynced = self.unsynced, set()
+        futures.wait(written)
+        for filename in filenames:
+            if os.path.isfile(filename):
+                _fsync_file(filename)
+        if self.errors:
+            logger.error("%d artifact files could not be written", len(self.errors))
@@ -66,14 +66,24 @@ class Logger(ArtifactorBasePlugin):
         self.store[slaveid].in_progress = False
 
     @ArtifactorBasePlugin.check_configured
-    def log_message(self, log_record, slaveid):
-        # json transport fallout: args must be a dict or a tuple, json makes a tuple into a list
-        args = log_record['args']
-        log_record['args'] = tuple(args) if isinstance(args, list) else args
-        record = makeLogRecord(log_record)
+    def log_message(self, slaveid, log_record=None, log_records=None):
+        """Writes log records to the log file of the test running on the slave
+
+        Accepts a single ``log_record`` or a batch of them in ``log_records``, in which case the
+        records are written in the order they were sent.
+        """
         if not slaveid:
             slaveid = "Master"
-        if slaveid in self.store:
-            handler = self.store[slaveid].handler
-            if handler and record.levelno >= handler.level:
+        if slaveid not in self.store:
+            return
+        handler = self.store[slaveid].handler
+        if not handler:
+            return
+        records = log_records if log_records is not None else [log_record]
+        for log_record in records:
+            # json transport fallout: args must be a dict or a tuple, json makes a tuple into a list
+            args = log_record['args']
+            log_record['args'] = tuple(args) if isinstance(args, list) else args
+            record = makeLogRecord(log_record)
+            if record.levelno >= handler.level:
                 handler.handle(record)
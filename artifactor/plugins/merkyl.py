@@ -10,16 +10,25 @@ artifactor:
             enabled: False
             plugin: merkyl
             port: 8192
+            workers: 8
             log_files:
                 - /var/www/miq/vmdb/log/evm.log
                 - /var/www/miq/vmdb/log/production.log
                 - /var/www/miq/vmdb/log/automation.log
+
+One HTTP session is kept per appliance, the logs are fetched in parallel and only the part of the
+log which was not fetched yet is transferred (``Range`` header, merkyl servers which do not support
+it just return the whole log). Time spent talking to merkyl is reported per test.
 """
 
-from artifactor import ArtifactorBasePlugin
 import os.path
+import time
+from concurrent import futures
+
 import requests
 
+from artifactor import ArtifactorBasePlugin
+
 
 class Merkyl(ArtifactorBasePlugin):
 
@@ -30,6 +39,12 @@ class Merkyl(ArtifactorBasePlugin):
             self.port = port
             self.in_progress = False
             self.extra_files = set()
+            self.contents = {}
+            self.overhead = 0.0
+
+        def reset(self):
+            self.contents = {}
+            self.overhead = 0.0
 
     def plugin_initialize(self):
         self.register_plugin_hook('setup_merkyl', self.start_session)
@@ -42,9 +57,53 @@ class Merkyl(ArtifactorBasePlugin):
     def configure(self):
         self.files = self.data.get('log_files', [])
         self.port = self.data.get('port', '8192')
+        self.workers = int(self.data.get('workers', 8))
+        self.executor = futures.ThreadPoolExecutor(max_workers=self.workers)
+        self.sessions = {}
         self.tests = {}
         self.configured = True
 
+    def _session(self, ip):
+        if ip not in self.sessions:
+            session = requests.Session()
+            adapter = requests.adapters.HTTPAdapter(
+                pool_connections=1, pool_maxsize=self.workers)
+            session.mount('http://', adapter)
+            self.sessions[ip] = session
+        return self.sessions[ip]
+
+    def _get(self, ip, path, **kwargs):
+        url = "http://{}:{}/{}".format(ip, self.port, path.lstrip('/'))
+        return self._session(ip).get(url, timeout=15, **kwargs)
+
+    def _map(self, func, items):
+        """Calls func for all the items in parallel, returns the results in order."""
+        items = list(items)
+        if len(items) < 2:
+            return [func(item) for item in items]
+        return list(self.executor.map(func, items))
+
+    def _fetch(self, test, filename):
+        """Fetches the new part of the log and returns the whole content gathered in the test."""
+        _, tail = os.path.split(filename)
+        content = test.contents.get(tail, '')
+        headers = {'Range': 'bytes={}-'.format(len(content))} if content else {}
+        doc = self._get(test.ip, 'get/{}'.format(tail), headers=headers)
+        if doc.status_code == 206:
+            content += doc.content
+        else:
+            content = doc.content
+        test.contents[tail] = content
+        return tail, content
+
+    def _timed(self, test, func, *args):
+        start = time.time()
+        try:
+            return func(*args)
+        finally:
+            if test is not None:
+                test.overhead += time.time() - start
+
     @ArtifactorBasePlugin.check_configured
     def start_test(self, test_name, test_location, ip):
         test_ident = "{}/{}".format(test_location, test_name)
@@ -54,51 +113,41 @@ class Merkyl(ArtifactorBasePlugin):
                 return None
         else:
             self.tests[test_ident] = self.Test(test_ident, ip, self.port)
-        url = "http://{}:{}/resetall".format(ip, self.port)
-        requests.get(url, timeout=15)
+        test = self.tests[test_ident]
+        test.reset()
+        self._timed(test, self._get, ip, 'resetall')
 
-        self.tests[test_ident].in_progress = True
+        test.in_progress = True
 
     @ArtifactorBasePlugin.check_configured
     def get_log(self, test_name, test_location, filename):
         test_ident = "{}/{}".format(test_location, test_name)
-        ip = self.tests[test_ident].ip
-
-        base, tail = os.path.split(filename)
-        url = "http://{}:{}/get/{}".format(ip, self.port, tail)
-        doc = requests.get(url, timeout=15)
-        content = doc.content
+        test = self.tests[test_ident]
+        _, content = self._timed(test, self._fetch, test, filename)
         return {'merkyl_content': content}, None
 
     @ArtifactorBasePlugin.check_configured
     def add_log(self, test_name, test_location, filename):
         test_ident = "{}/{}".format(test_location, test_name)
-        ip = self.tests[test_ident].ip
+        test = self.tests[test_ident]
 
         if filename not in self.files:
-            if filename not in self.tests[test_ident].extra_files:
-                self.tests[test_ident].extra_files.add(filename)
-                url = "http://{}:{}/setup{}".format(ip, self.port, filename)
-                requests.get(url, timeout=15)
+            if filename not in test.extra_files:
+                test.extra_files.add(filename)
+                self._timed(test, self._get, test.ip, 'setup{}'.format(filename))
 
     @ArtifactorBasePlugin.check_configured
     def finish_test(self, artifact_path, test_name, test_location, ip, slaveid):
         test_ident = "{}/{}".format(test_location, test_name)
-        artifacts = []
-        for filename in self.files:
-            _, tail = os.path.split(filename)
-            url = "http://{}:{}/get/{}".format(ip, self.port, tail)
-            doc = requests.get(url, timeout=15)
-            artifacts.append((tail, doc.content))
-
-        for filename in self.tests[test_ident].extra_files:
-            _, tail = os.path.split(filename)
-            url = "http://{}:{}/get/{}".format(ip, self.port, tail)
-            doc = requests.get(url, timeout=15)
-            artifacts.append((tail, doc.content))
-
-            url = "http://{}:{}/delete/{}".format(ip, self.port, tail)
-            requests.get(url, timeout=15)
+        test = self.tests[test_ident]
+        extra_files = sorted(test.extra_files)
+        artifacts = self._timed(
+            test, self._map, lambda filename: self._fetch(test, filename),
+            list(self.files) + extra_files)
+        self._timed(
+            test, self._map,
+            lambda filename: self._get(ip, 'delete/{}'.format(os.path.split(filename)[1])),
+            extra_files)
 
         del self.tests[test_ident]
         for filename, contents in artifacts:
@@ -106,19 +155,25 @@ class Merkyl(ArtifactorBasePlugin):
                 description="Merkyl: {}".format(filename), slaveid=slaveid,
                 contents=contents, file_type="log", display_type="danger",
                 display_glyph="align-justify", group_id="merkyl")
+        timing = "Merkyl overhead: {:.3f}s for {} file(s) ({} bytes)".format(
+            test.overhead, len(artifacts), sum(len(contents) for _, contents in artifacts))
+        self.fire_hook('filedump', test_location=test_location, test_name=test_name,
+            description="Merkyl: timing", slaveid=slaveid, contents=timing,
+            file_type="merkyl_timing", display_type="primary",
+            display_glyph="time", group_id="merkyl")
         return None, None
 
     @ArtifactorBasePlugin.check_configured
     def start_session(self, ip):
         """Session started"""
-        for file_name in self.files:
-            url = "http://{}:{}/setup{}".format(ip, self.port, file_name)
-            requests.get(url, timeout=15)
+        self._map(lambda file_name: self._get(ip, 'setup{}'.format(file_name)), self.files)
 
     @ArtifactorBasePlugin.check_configured
     def finish_session(self, ip):
         """Session finished"""
-        for filename in self.files:
-            base, tail = os.path.split(filename)
-            url = "http://{}:{}/delete/{}".format(ip, self.port, tail)
-            requests.get(url, timeout=15)
+        self._map(
+            lambda filename: self._get(ip, 'delete/{}'.format(os.path.split(filename)[1])),
+            self.files)
+        session = self.sessions.pop(ip, None)
+        if session is not None:
+            session.close()
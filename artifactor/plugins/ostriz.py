@@ -20,6 +20,7 @@ def overall_test_status(statuses):
 
 
 class Ostriz(ArtifactorBasePlugin):
+    exclusive_hooks = ('ostriz_send',)
 
     def plugin_initialize(self):
         self.register_plugin_hook('ostriz_send', self.ostriz_send)
@@ -34,7 +35,8 @@ class Ostriz(ArtifactorBasePlugin):
             version, build, stream, jenkins=None, env_params=None):
         env_params = env_params or {}
         test_ident = "{}/{}".format(test_location, test_name)
-        json_data = artifacts[test_ident]
+        # A copy, the record in the store is not to be changed
+        json_data = dict(artifacts[test_ident])
         json_data['name'] = test_ident
         json_data['run'] = run_id
         json_data['slaveid'] = slaveid
@@ -46,8 +48,7 @@ class Ostriz(ArtifactorBasePlugin):
         json_data['jenkins'] = jenkins or None
         # Either None or a list of Polarion Test Case IDs
         json_data['polarion'] = polarion_ids
-        if not json_data['params']:
-            json_data['params'] = {}
+        json_data['params'] = dict(json_data['params'] or {})
         json_data['params'].update(env_params)
         requests.post(self.url, data=json.dumps(json_data))
         return None, None
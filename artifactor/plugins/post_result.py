@@ -31,6 +31,8 @@ test_counts = defaultdict(int, {
 
 
 class PostResult(ArtifactorBasePlugin):
+    exclusive_hooks = ('finish_session',)
+
     def plugin_initialize(self):
         self.register_plugin_hook('finish_session', self.post_result)
         if test_report.check():
@@ -42,25 +44,25 @@ class PostResult(ArtifactorBasePlugin):
     @ArtifactorBasePlugin.check_configured
     def post_result(self, old_artifacts, log_dir):
         report = {}
-        report['tests'] = old_artifacts
-
-        def _inc_test_count(test):
-            error = ""
-            if 'statuses' in test:
-                test_counts[test['statuses']['overall']] += 1
-            else:
-                error += str(test)
-            with log_path.join('no_status.log').open('a') as f:
-                f.write(error)
-
-        map(_inc_test_count, old_artifacts.values())
+        test_counts.update(old_artifacts.counts())
         report['test_counts'] = test_counts
-        report['test_counts']['total'] = sum(test_counts.values())
+        report['test_counts']['total'] = sum(
+            count for status, count in test_counts.items() if status != 'total')
 
         from fixtures.ui_coverage import ui_coverage_percent
         if ui_coverage_percent:
             report['ui_coverage_percent'] = ui_coverage_percent
 
+        # The tests are written one by one, so they never have to be all in memory at once
         import json
-        with test_report.open('w') as art_out:
-            json.dump(report, art_out, indent=2)
+        with test_report.open('w') as art_out, log_path.join('no_status.log').open('a') as f:
+            art_out.write('{"tests": {')
+            for i, (test_ident, test) in enumerate(old_artifacts.iteritems()):
+                if 'statuses' not in test:
+                    f.write(str(test))
+                art_out.write('{}\n{}: {}'.format(
+                    ',' if i else '', json.dumps(test_ident), json.dumps(test)))
+            art_out.write('}')
+            for key, value in report.iteritems():
+                art_out.write(',\n{}: {}'.format(json.dumps(key), json.dumps(value, indent=2)))
+            art_out.write('}\n')
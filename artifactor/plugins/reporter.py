@@ -11,14 +11,23 @@ artifactor:
             enabled: True
             plugin: reporter
             only_failed: False #Only show faled tests in the report
+            render_processes: 1 #Processes rendering the report pages, default 1 (no pool)
+
+Every finished test is processed and its part of the report page is rendered right away. The
+results are appended to ``report_index.jsonl`` and ``report_index.fragments`` in the artifact dir
+and only their offsets are kept in memory, so building the report, which happens after every test
+phase, only has to process the tests in progress and assemble the summary.
 """
 import csv
 import datetime
 import difflib
+import json
 import math
+import multiprocessing
 import os
 import re
 import shutil
+import threading
 import time
 from copy import deepcopy
 
@@ -64,58 +73,258 @@ def overall_test_status(statuses):
     return "passed"
 
 
-class ReporterBase(object):
-    def _run_report(self, old_artifacts, artifact_dir, version=None):
-        template_data = self.process_data(old_artifacts, artifact_dir, version)
+_template_env = None
+
+
+def get_template_env():
+    """Returns the Jinja environment, shared so that the compiled templates are reused."""
+    global _template_env
+    if _template_env is None:
+        _template_env = Environment(loader=FileSystemLoader(template_path.strpath))
+    return _template_env
+
+
+def _write_report(args):
+    """Renders one report page, module level so it can be run in a worker process."""
+    report, filename, log_dir, template = args
+    data = get_template_env().get_template(template).render(**report)
+    with open(os.path.join(log_dir, '{}.html'.format(filename)), "w") as f:
+        f.write(data)
+
+
+# Fields read from the qa_contact and short_tb files,
+# {(os_filename, file_type): ((mtime, size), value)}
+_file_fields = {}
+
+
+def read_file_field(file_dict):
+    """Returns the parsed contents of a qa_contact or short_tb file, cached until it changes."""
+    filename = file_dict["os_filename"]
+    cache_key = (filename, file_dict["file_type"])
+    stat = os.stat(filename)
+    key = (stat.st_mtime, stat.st_size)
+    if cache_key in _file_fields and _file_fields[cache_key][0] == key:
+        return _file_fields[cache_key][1]
+    if file_dict["file_type"] == "qa_contact":
+        with open(filename, 'rb') as qafile:
+            value = list(csv.reader(qafile, delimiter=',', quotechar='"'))
+    else:
+        with open(filename, 'r') as short_tb:
+            value = short_tb.read()
+    _file_fields[cache_key] = (key, value)
+    return value
+
+
+class ReportFragment(object):
+    """Rendered part of a report page, read back from the disk only when the page is rendered."""
+    def __init__(self, path, offset, length):
+        self.path = path
+        self.offset = offset
+        self.length = length
+
+    def __unicode__(self):
+        with open(self.path, 'rb') as f:
+            f.seek(self.offset)
+            return f.read(self.length).decode('utf-8')
+
+    __html__ = __unicode__
+
+
+class ReportIndex(object):
+    """Index of the processed finished tests, backed by an append-only JSON lines file.
+
+    Only the signature and the file offset of every entry are kept in memory, the test data is
+    read back when the report is built. The rendered parts of the page are appended to a separate
+    file and streamed into the page as :py:class:`ReportFragment`.
+
+    A cached entry is used only while the signature of the test artifacts matches, so artifacts
+    arriving after the test was indexed make the test to be processed again.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.fragments_path = '{}.fragments'.format(os.path.splitext(path)[0])
+        self.entries = {}
+        self._lock = threading.Lock()
+        if os.path.exists(path):
+            with open(path, 'rb') as f:
+                while True:
+                    offset = f.tell()
+                    line = f.readline()
+                    if not line:
+                        break
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue  # Partially written line of an aborted run
+                    self.entries[entry['name']] = (entry['signature'], offset)
+
+    @staticmethod
+    def signature(test):
+        statuses = sorted(
+            (when, tuple(status)) for when, status in test.get('statuses', {}).iteritems()
+            if when != 'overall')
+        return repr((test.get('finish_time'), len(test.get('files', [])), statuses,
+                     test.get('skipped')))
+
+    def get(self, name, test):
+        """Returns the cached template data of the test, None when missing or outdated."""
+        entry = self.entries.get(name)
+        if entry is None or entry[0] != self.signature(test):
+            return None
+        with open(self.path, 'rb') as f:
+            f.seek(entry[1])
+            test_data = json.loads(f.readline())['test']
+        if test_data.get('fragment'):
+            test_data['fragment'] = ReportFragment(self.fragments_path, *test_data['fragment'])
+        return test_data
+
+    def add(self, name, test, test_data, fragment=None):
+        test_data = dict(test_data)
+        with self._lock:
+            if fragment is not None:
+                with open(self.fragments_path, 'ab') as f:
+                    f.seek(0, os.SEEK_END)
+                    data = fragment.encode('utf-8')
+                    test_data['fragment'] = (f.tell(), len(data))
+                    f.write(data)
+            entry = {'name': name, 'signature': self.signature(test), 'test': test_data}
+            with open(self.path, 'ab') as f:
+                f.seek(0, os.SEEK_END)
+                offset = f.tell()
+                f.write(json.dumps(entry, default=str) + '\n')
+            self.entries[name] = (entry['signature'], offset)
+
+    def clear(self):
+        with self._lock:
+            self.entries = {}
+            for path in (self.path, self.fragments_path):
+                if os.path.exists(path):
+                    os.remove(path)
 
-        if hasattr(self, 'only_failed') and self.only_failed:
-            template_data['tests'] = [x for x in template_data['tests']
-                                  if x['outcomes']['overall'] not in ['passed']]
 
-        self.render_report(template_data, 'report', artifact_dir, 'test_report.html')
+class ReporterBase(object):
+    render_processes = 1
+    index = None
+
+    def _run_report(self, old_artifacts, artifact_dir, version=None):
+        self._run_reports(old_artifacts, artifact_dir, version, provider_reports=False)
 
     def _run_provider_report(self, old_artifacts, artifact_dir, version=None):
-        for mgmt in cfme_data['management_systems'].keys():
-            template_data = self.process_data(old_artifacts, artifact_dir, version,
-                name_filter=mgmt)
+        self._run_reports(old_artifacts, artifact_dir, version, main_report=False)
 
-            self.render_report(template_data, "report_{}".format(mgmt), artifact_dir,
-                'test_report_provider.html')
+    def _run_reports(self, old_artifacts, artifact_dir, version=None, main_report=True,
+                     provider_reports=True):
+        """Builds the main and the per provider reports from a single pass over the artifacts.
 
-    def render_report(self, report, filename, log_dir, template):
-        template_env = Environment(
-            loader=FileSystemLoader(template_path.strpath)
-        )
-        data = template_env.get_template(template).render(**report)
+        The tests are processed once and bucketed by provider, the pages are then rendered in
+        ``render_processes`` worker processes.
+        """
+        summary = self.process_tests(old_artifacts, artifact_dir)
+        pages = []
+        if main_report:
+            tests = summary['tests']
+            if getattr(self, 'only_failed', False):
+                tests = [x for x in tests if x['outcomes']['overall'] not in ['passed']]
+            pages.append((self.build_template_data(summary, tests, version), 'report',
+                artifact_dir, 'test_report.html'))
+        if provider_reports:
+            buckets = self.bucket_by_provider(
+                summary['tests'], cfme_data['management_systems'].keys())
+            for mgmt, tests in buckets.iteritems():
+                pages.append((self.build_template_data(summary, tests, version),
+                    "report_{}".format(mgmt), artifact_dir, 'test_report_provider.html'))
+        self.render_reports(pages, artifact_dir)
+
+    def render_reports(self, pages, log_dir):
+        processes = min(self.render_processes, len(pages))
+        if processes > 1:
+            pool = multiprocessing.Pool(processes)
+            try:
+                pool.map(_write_report, pages)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            for page in pages:
+                _write_report(page)
+        self.copy_dist(log_dir)
 
-        with open(os.path.join(log_dir, '{}.html'.format(filename)), "w") as f:
-            f.write(data)
+    def copy_dist(self, log_dir):
         try:
             shutil.copytree(template_path.join('dist').strpath, os.path.join(log_dir, 'dist'))
         except OSError:
             pass
 
+    def render_report(self, report, filename, log_dir, template):
+        _write_report((report, filename, log_dir, template))
+        self.copy_dist(log_dir)
+
+    def bucket_by_provider(self, tests, providers):
+        """Returns :py:class:`dict` of provider name to the tests parametrized with it."""
+        patterns = [(mgmt, re.compile(r'{}[-\]]+'.format(re.escape(mgmt)))) for mgmt in providers]
+        buckets = {mgmt: [] for mgmt in providers}
+        for test in tests:
+            for mgmt, pattern in patterns:
+                if pattern.search(test['name']):
+                    buckets[mgmt].append(test)
+        return buckets
+
     def process_data(self, artifacts, log_dir, version, name_filter=None):
-        tb_errors = []
-        blocker_skip_count = 0
-        provider_skip_count = 0
-        template_data = {'tests': [], 'qa': []}
-        template_data['version'] = version
+        summary = self.process_tests(artifacts, log_dir)
+        tests = summary['tests']
+        if name_filter:
+            tests = self.bucket_by_provider(tests, [name_filter])[name_filter]
+        return self.build_template_data(summary, tests, version)
+
+    def process_tests(self, artifacts, log_dir):
+        """Processes all the tests, the counts and the qa contacts of the artifacts."""
+        summary = {
+            'tests': [],
+            'qa': [],
+            'counts': {
+                'passed': 0,
+                'failed': 0,
+                'skipped': 0,
+                'error': 0,
+                'xfailed': 0,
+                'xpassed': 0},
+            'current_counts': {
+                'passed': 0,
+                'failed': 0,
+                'skipped': 0,
+                'error': 0,
+                'xfailed': 0,
+                'xpassed': 0},
+            'blocker_skip_count': 0,
+            'provider_skip_count': 0}
         log_dir = local(log_dir).strpath + "/"
-        counts = {
-            'passed': 0,
-            'failed': 0,
-            'skipped': 0,
-            'error': 0,
-            'xfailed': 0,
-            'xpassed': 0}
-        current_counts = {
-            'passed': 0,
-            'failed': 0,
-            'skipped': 0,
-            'error': 0,
-            'xfailed': 0,
-            'xpassed': 0}
+        # Iterate through the tests and process the counts and durations
+        for test_name, test in self.iter_tests(artifacts):
+            if not test.get('statuses'):
+                continue
+            test_data = self.index.get(test_name, test) if self.index is not None else None
+            if test_data is None:
+                test_data = self.process_test(test_name, test, log_dir)
+            overall_status = test_data['outcomes']['overall']
+            summary['counts'][overall_status] += 1
+            if not test.get('old', False):
+                summary['current_counts'][overall_status] += 1
+            if 'skip_provider' in test_data:
+                summary['provider_skip_count'] += 1
+            if 'skip_blocker' in test_data:
+                summary['blocker_skip_count'] += 1
+            for qacontact in test_data['qa_contact']:
+                if qacontact[0] not in summary['qa']:
+                    summary['qa'].append(qacontact[0])
+            summary['tests'].append(test_data)
+        return summary
+
+    def iter_tests(self, artifacts):
+        """Yields ``(test ident, test)`` of the artifacts, the tests may be modified."""
+        return artifacts.iteritems()
+
+    def process_test(self, test_name, test, log_dir):
+        """Builds the template data of one test, ``log_dir`` has to end with a slash."""
         colors = {
             'passed': 'success',
             'failed': 'warning',
@@ -123,115 +332,113 @@ class ReporterBase(object):
             'xpassed': 'danger',
             'xfailed': 'success',
             'skipped': 'info'}
-        # Iterate through the tests and process the counts and durations
-        for test_name, test in artifacts.iteritems():
-            if not test.get('statuses'):
-                continue
-            overall_status = overall_test_status(test['statuses'])
-            counts[overall_status] += 1
-            if not test.get('old', False):
-                current_counts[overall_status] += 1
-            color = colors[overall_status]
-            # This was removed previously but is needed as the overall is not generated
-            # until the test finishes. So this is here as a shim.
-            test['statuses']['overall'] = overall_status
-            test_data = {'name': test_name, 'outcomes': test['statuses'],
-                         'slaveid': test.get('slaveid', "Unknown"), 'color': color}
-            if 'composite' in test:
-                test_data['composite'] = test['composite']
-
-            if 'skipped' in test:
-                if test['skipped'].get('type') == 'provider':
-                    provider_skip_count += 1
-                    test_data['skip_provider'] = test['skipped'].get('reason')
-                if test['skipped'].get('type') == 'blocker':
-                    blocker_skip_count += 1
-                    test_data['skip_blocker'] = test['skipped'].get('reason')
-
-            if 'skip_blocker' in test_data:
-                # Fix the inconveniently long list of repeated blockers until we sort out sets
-                # in riggerlib somehow.
-                test_data['skip_blocker'] = sorted(set(test_data['skip_blocker']))
-
-            if test.get('old', False):
-                test_data['old'] = True
-
-            if test.get('start_time'):
-                if test.get('finish_time'):
-                    test_data['in_progress'] = False
-                    test_data['duration'] = test['finish_time'] - test['start_time']
-                else:
-                    test_data['duration'] = time.time() - test['start_time']
-                    test_data['in_progress'] = True
-
-            # Set up destinations for the files
-            test_data["file_groups"] = []
-            test_data['qa_contact'] = []
-            processed_groups = {}
-            order = 0
-            for file_dict in test.get('files', []):
-                group = file_dict["group_id"]
-                if group not in processed_groups:
-                    processed_groups[group] = (order, [])
-                    order += 1
-                processed_groups[group][-1].append(file_dict)
-            # Current structure:
-            # {groupid: (group_order, [{filedict1}, {filedict2}])}
-            # Sorting by group_order
-            processed_groups = sorted(processed_groups.iteritems(), key=lambda kv: kv[1][0])
-            # And now make it [(groupid, [{filedict1}, {filedict2}, ...])]
-            processed_groups = [(group_name, files) for group_name, (_, files) in processed_groups]
-            for group_name, file_dicts in processed_groups:
-                group_file_list = []
-                for file_dict in file_dicts:
-                    if file_dict["file_type"] == "qa_contact":
-                        with open(file_dict["os_filename"], 'rb') as qafile:
-                            qareader = csv.reader(qafile, delimiter=',', quotechar='"')
-                            for qacontact in qareader:
-                                test_data['qa_contact'].append(qacontact)
-                                if qacontact[0] not in template_data['qa']:
-                                    template_data['qa'].append(qacontact[0])
-                        continue  # Do not store, handled a different way :)
-                    elif file_dict["file_type"] == "short_tb":
-                        with open(file_dict["os_filename"], 'r') as short_tb:
-                            test_data["short_tb"] = short_tb.read()
-                        continue
-                    file_dict["filename"] = file_dict["os_filename"].replace(log_dir, "")
-                    group_file_list.append(file_dict)
-
-                test_data["file_groups"].append((group_name, group_file_list))
-            # Snd remove groups that are left empty because of eg. traceback or qa contact
-            test_data["file_groups"] = filter(
-                lambda group: len(group[1]) > 0, test_data["file_groups"])
-            if "short_tb" in test_data and test_data["short_tb"]:
-                urls = [url for url in URL.findall(test_data["short_tb"])]
-                if urls:
-                    test_data["urls"] = urls
-            template_data['tests'].append(test_data)
-        template_data['top10'] = self.top10(tb_errors)
-        template_data['counts'] = counts
-        template_data['current_counts'] = current_counts
-        template_data['blocker_skip_count'] = blocker_skip_count
-        template_data['provider_skip_count'] = provider_skip_count
-
-        if name_filter:
-            template_data['tests'] = [x for x in template_data['tests']
-                                      if re.findall('{}[-\]]+'.format(name_filter), x['name'])]
+        overall_status = overall_test_status(test['statuses'])
+        color = colors[overall_status]
+        # This was removed previously but is needed as the overall is not generated
+        # until the test finishes. So this is here as a shim.
+        test['statuses']['overall'] = overall_status
+        test_data = {'name': test_name, 'outcomes': test['statuses'],
+                     'slaveid': test.get('slaveid', "Unknown"), 'color': color}
+        if 'composite' in test:
+            test_data['composite'] = test['composite']
+
+        if 'skipped' in test:
+            if test['skipped'].get('type') == 'provider':
+                test_data['skip_provider'] = test['skipped'].get('reason')
+            if test['skipped'].get('type') == 'blocker':
+                test_data['skip_blocker'] = test['skipped'].get('reason')
+
+        if 'skip_blocker' in test_data:
+            # Fix the inconveniently long list of repeated blockers until we sort out sets
+            # in riggerlib somehow.
+            test_data['skip_blocker'] = sorted(set(test_data['skip_blocker']))
+
+        if test.get('old', False):
+            test_data['old'] = True
+
+        if test.get('start_time'):
+            if test.get('finish_time'):
+                test_data['in_progress'] = False
+                test_data['duration'] = test['finish_time'] - test['start_time']
+            else:
+                test_data['duration'] = time.time() - test['start_time']
+                test_data['in_progress'] = True
+
+        # Set up destinations for the files
+        test_data["file_groups"] = []
+        test_data['qa_contact'] = []
+        processed_groups = {}
+        order = 0
+        for file_dict in test.get('files', []):
+            group = file_dict["group_id"]
+            if group not in processed_groups:
+                processed_groups[group] = (order, [])
+                order += 1
+            processed_groups[group][-1].append(file_dict)
+        # Current structure:
+        # {groupid: (group_order, [{filedict1}, {filedict2}])}
+        # Sorting by group_order
+        processed_groups = sorted(processed_groups.iteritems(), key=lambda kv: kv[1][0])
+        # And now make it [(groupid, [{filedict1}, {filedict2}, ...])]
+        processed_groups = [(group_name, files) for group_name, (_, files) in processed_groups]
+        for group_name, file_dicts in processed_groups:
+            group_file_list = []
+            for file_dict in file_dicts:
+                if file_dict["file_type"] == "qa_contact":
+                    test_data['qa_contact'].extend(read_file_field(file_dict))
+                    continue  # Do not store, handled a different way :)
+                elif file_dict["file_type"] == "short_tb":
+                    test_data["short_tb"] = read_file_field(file_dict)
+                    continue
+                file_dict["filename"] = file_dict["os_filename"].replace(log_dir, "")
+                group_file_list.append(file_dict)
+
+            test_data["file_groups"].append((group_name, group_file_list))
+        # Snd remove groups that are left empty because of eg. traceback or qa contact
+        test_data["file_groups"] = filter(
+            lambda group: len(group[1]) > 0, test_data["file_groups"])
+        if "short_tb" in test_data and test_data["short_tb"]:
+            urls = [url for url in URL.findall(test_data["short_tb"])]
+            if urls:
+                test_data["urls"] = urls
+        return test_data
+
+    def render_test(self, test_data):
+        """Renders the part of the report page showing the test."""
+        if test_data.get('duration'):
+            test_data = dict(test_data, duration=str(
+                datetime.timedelta(seconds=math.ceil(test_data['duration']))))
+        return get_template_env().get_template('test_report_test.html').render(test=test_data)
+
+    def build_template_data(self, summary, tests, version):
+        """Builds the data for a report page out of the processed tests.
+
+        The test dicts are not modified, so the same processed tests can be used for all pages.
+        """
+        template_data = {
+            'tests': tests,
+            'qa': summary['qa'],
+            'version': version,
+            'top10': self.top10([]),
+            'counts': summary['counts'],
+            'current_counts': summary['current_counts'],
+            'blocker_skip_count': summary['blocker_skip_count'],
+            'provider_skip_count': summary['provider_skip_count']}
 
         # Create the tree dict that is used for js tree
         # Note template_data['tests'] != tests
-        tests = deepcopy(_tests_tpl)
-        tests['_sub']['tests'] = deepcopy(_tests_tpl)
+        tree = deepcopy(_tests_tpl)
+        tree['_sub']['tests'] = deepcopy(_tests_tpl)
 
-        for test in template_data['tests']:
-            self.build_dict(test['name'].replace('cfme/', ''), tests, test)
+        for test in tests:
+            self.build_dict(test['name'].replace('cfme/', ''), tree, test)
 
-        template_data['ndata'] = self.build_li(tests)
+        template_data['ndata'] = self.build_li(tree)
 
-        for test in template_data['tests']:
-            if test.get('duration'):
-                test['duration'] = str(datetime.timedelta(
-                    seconds=math.ceil(test['duration'])))
+        template_data['tests'] = [
+            dict(test, duration=str(datetime.timedelta(seconds=math.ceil(test['duration']))))
+            if test.get('duration') else test
+            for test in tests]
 
         return template_data
 
@@ -337,10 +544,14 @@ class ReporterBase(object):
 
 
 class Reporter(ArtifactorBasePlugin, ReporterBase):
+    # The reports are rendered from copies of the records, only the hooks updating the artifacts
+    # are exclusive
+    exclusive_hooks = ('report_test', 'finish_test')
+
     def plugin_initialize(self):
         self.register_plugin_hook('report_test', self.report_test)
-        self.register_plugin_hook('finish_session', self.run_report)
-        self.register_plugin_hook('finish_session', self.run_provider_report)
+        self.register_plugin_hook('start_session', self.start_session)
+        self.register_plugin_hook('finish_session', self.run_reports)
         self.register_plugin_hook('build_report', self.run_report)
         self.register_plugin_hook('start_test', self.start_test)
         self.register_plugin_hook('skip_test', self.skip_test)
@@ -350,8 +561,20 @@ class Reporter(ArtifactorBasePlugin, ReporterBase):
 
     def configure(self):
         self.only_failed = self.data.get('only_failed', False)
+        # The pool is forked from the threaded artifactor server, so it is only used on request
+        self.render_processes = int(self.data.get('render_processes', self.render_processes))
         self.configured = True
 
+    def get_index(self, artifact_dir):
+        path = os.path.join(artifact_dir, 'report_index.jsonl')
+        if self.index is None or self.index.path != path:
+            self.index = ReportIndex(path)
+        return self.index
+
+    @ArtifactorBasePlugin.check_configured
+    def start_session(self, artifact_dir):
+        self.get_index(artifact_dir).clear()
+
     @ArtifactorBasePlugin.check_configured
     def composite_pump(self, old_artifacts):
         return None, {'old_artifacts': old_artifacts}
@@ -385,10 +608,28 @@ class Reporter(ArtifactorBasePlugin, ReporterBase):
         }}}
 
     @ArtifactorBasePlugin.check_configured
-    def report_test(self, artifacts, test_location, test_name, test_xfail, test_when, test_outcome):
+    def report_test(self, artifacts, artifact_dir, test_location, test_name, test_xfail, test_when,
+                    test_outcome):
         test_ident = "{}/{}".format(test_location, test_name)
-        return None, {'artifacts': {test_ident: {'statuses': {
-            test_when: (test_outcome, test_xfail)}}}}
+        status = (test_outcome, test_xfail)
+        if test_when == 'teardown' and test_ident in artifacts:
+            # The teardown report is the last one of the test, index it with the status included
+            test = dict(artifacts[test_ident])
+            test['statuses'] = dict(test.get('statuses', {}), teardown=status)
+            self.index_test(test_ident, test, artifact_dir)
+        return None, {'artifacts': {test_ident: {'statuses': {test_when: status}}}}
+
+    def iter_tests(self, artifacts):
+        return self.iter_artifacts(artifacts)
+
+    def index_test(self, test_ident, test, artifact_dir):
+        try:
+            test_data = self.process_test(test_ident, test, local(artifact_dir).strpath + "/")
+            self.get_index(artifact_dir).add(
+                test_ident, test, test_data, self.render_test(test_data))
+        except Exception as e:
+            # The test just gets processed with the rest when building the report
+            print("Could not index {} for the report: {}".format(test_ident, e))
 
     @ArtifactorBasePlugin.check_configured
     def session_info(self, version=None, build=None, stream=None):
@@ -396,8 +637,15 @@ class Reporter(ArtifactorBasePlugin, ReporterBase):
 
     @ArtifactorBasePlugin.check_configured
     def run_report(self, old_artifacts, artifact_dir, version=None):
+        self.get_index(artifact_dir)
         self._run_report(old_artifacts, artifact_dir, version)
 
+    @ArtifactorBasePlugin.check_configured
+    def run_reports(self, old_artifacts, artifact_dir, version=None):
+        self.get_index(artifact_dir)
+        self._run_reports(old_artifacts, artifact_dir, version)
+
     @ArtifactorBasePlugin.check_configured
     def run_provider_report(self, old_artifacts, artifact_dir, version=None):
+        self.get_index(artifact_dir)
         self._run_provider_report(old_artifacts, artifact_dir, version)
@@ -9,13 +9,23 @@ artifactor:
         video:
             enabled: True
             plugin: video
-            quality: 10
             display: ":99"
+            segment_time: 10
+            segments: 90
+            keep: failed #failed, all
+
+The display is recorded for the whole session into a ring buffer of segments (see
+:py:class:`utils.video.SegmentedRecorder`). When a test finishes, the clip of its time window is
+cut out of the buffer in the background, by default only for the tests which failed. Whether the
+test failed is sent with ``finish_test`` by the pytest plugin.
 """
 
-from artifactor import ArtifactorBasePlugin
 import os
-from utils.video import Recorder
+import time
+from concurrent import futures
+
+from artifactor import ArtifactorBasePlugin
+from utils.video import SegmentedRecorder
 
 
 class Video(ArtifactorBasePlugin):
@@ -24,9 +34,10 @@ class Video(ArtifactorBasePlugin):
         def __init__(self, ident):
             self.ident = ident
             self.in_progress = False
-            self.recorder = None
+            self.start = None
 
     def plugin_initialize(self):
+        self.register_plugin_hook('start_session', self.start_session)
         self.register_plugin_hook('start_test', self.start_test)
         self.register_plugin_hook('finish_test', self.finish_test)
         self.register_plugin_hook('finish_session', self.finish_session)
@@ -34,11 +45,30 @@ class Video(ArtifactorBasePlugin):
     def configure(self):
         self.configured = True
         self.tests = {}
-        self.quality = self.data.get('quality', '10')
         self.display = self.data.get('display', ':0')
+        self.segment_time = int(self.data.get('segment_time', 10))
+        self.segments = int(self.data.get('segments', 90))
+        self.keep = self.data.get('keep', 'failed')
+        self.recorder = None
+        self.clipper = futures.ThreadPoolExecutor(max_workers=1)
+        self.clips = []
+
+    def _start_recorder(self, log_dir):
+        if self.recorder is None:
+            self.recorder = SegmentedRecorder(
+                os.path.join(log_dir, 'video-segments', self.ident), display=self.display,
+                segment_time=self.segment_time, segments=self.segments)
+        self.recorder.start()
+
+    @ArtifactorBasePlugin.check_configured
+    def start_session(self, log_dir):
+        try:
+            self._start_recorder(log_dir)
+        except Exception as e:
+            print(e)
 
     @ArtifactorBasePlugin.check_configured
-    def start_test(self, artifact_path, test_name, test_location, slaveid):
+    def start_test(self, artifact_path, test_name, test_location, slaveid, log_dir):
         test_ident = "{}/{}".format(test_location, test_name)
         if test_ident in self.tests:
             if self.tests[test_ident].in_progress:
@@ -46,39 +76,39 @@ class Video(ArtifactorBasePlugin):
                 return None
         else:
             self.tests[test_ident] = self.Test(test_ident)
-            self.tests[test_ident].in_progress = True
-        artifacts = []
-        os_filename = self.ident + ".ogv"
-        os_filename = os.path.join(artifact_path, os_filename)
-        if os.path.isfile(os_filename):
-            os.remove(os_filename)
-        artifacts.append(os_filename)
         try:
-            self.tests[test_ident].recorder = Recorder(os_filename, display=self.display,
-                                                       quality=self.quality)
-            self.tests[test_ident].recorder.start()
+            self._start_recorder(log_dir)
         except Exception as e:
             print(e)
+        self.tests[test_ident].start = time.time()
         self.tests[test_ident].in_progress = True
-        for filename in artifacts:
-            self.fire_hook('filedump', test_location=test_location, test_name=test_name,
-                description="Video recording", file_type="video",
-                contents="", display_glyph="camera", dont_write=True, os_filename=filename,
-                           group_id="misc-artifacts", slaveid=slaveid)
 
     @ArtifactorBasePlugin.check_configured
-    def finish_test(self, artifact_path, test_name, test_location):
-        """Finish test"""
+    def finish_test(self, artifact_path, test_name, test_location, slaveid, test_failed=False):
+        """Finish test, ``test_failed`` tells whether the setup or the call failed."""
         test_ident = "{}/{}".format(test_location, test_name)
-        try:
-            self.tests[test_ident].recorder.stop()
-        except Exception as e:
-            print(e)
-        del self.tests[test_ident]
+        test = self.tests.pop(test_ident, None)
+        if test is None or test.start is None or self.recorder is None:
+            return
+        if self.keep != 'all' and not test_failed:
+            return
+        os_filename = os.path.join(artifact_path, self.ident + ".mp4")
+        if os.path.isfile(os_filename):
+            os.remove(os_filename)
+        self.clips = [clip for clip in self.clips if not clip.done()]
+        self.clips.append(self.clipper.submit(
+            self.recorder.clip, test.start, time.time(), os_filename))
+        self.fire_hook('filedump', test_location=test_location, test_name=test_name,
+            description="Video recording", file_type="video",
+            contents="", display_glyph="camera", dont_write=True, os_filename=os_filename,
+                       group_id="misc-artifacts", slaveid=slaveid)
 
+    @ArtifactorBasePlugin.check_configured
     def finish_session(self):
         try:
-            for test in self.tests:
-                test.recorder.stop()
+            futures.wait(self.clips)
+            self.clips = []
+            if self.recorder is not None:
+                self.recorder.stop()
         except Exception as e:
             print(e)
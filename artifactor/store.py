@@ -0,0 +1,284 @@
+"""
+Artifact stores for Artifactor
+
+The ``artifacts`` and ``old_artifacts`` global values hold a record per test, keyed by the test
+ident (``test_location/test_name``). They are kept by an artifact store, chosen with
+``artifact_store`` in the Artifactor config:
+
+* ``memory`` (default) keeps the records in a dict, as fast as it gets, but the memory grows with
+  the number of tests.
+* ``sqlite`` keeps the records in an sqlite database in the log dir and only the recently used
+  ones in memory (``artifact_store_cache`` records, default 256), for runs with a lot of tests.
+
+::
+
+    artifactor:
+        artifact_store: sqlite
+        artifact_store_cache: 256
+
+Both behave like a dict of the records, so global value updates from the hooks are merged into
+them by riggerlib as before. The stores also keep the slave and the overall status of every test
+indexed, :py:meth:`ArtifactStore.query` and :py:meth:`ArtifactStore.counts` use them instead of
+going through all the records.
+"""
+import json
+import sqlite3
+import threading
+from collections import MutableMapping, OrderedDict, defaultdict
+
+
+def record_status(test):
+    """Returns the overall status of the test record, ``None`` if the test did not finish."""
+    return test.get('statuses', {}).get('overall')
+
+
+class ArtifactStore(MutableMapping):
+    """Base of the artifact stores, a mapping of test ident to the test record."""
+
+    def query(self, slaveid=None, status=None):
+        """Yields ``(test ident, test)`` of the tests run by the slave and/or with the status."""
+        raise NotImplementedError
+
+    def counts(self):
+        """Returns :py:class:`dict` of overall status to the number of tests with it."""
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class MemoryStore(ArtifactStore):
+    """Keeps the test records in a dict."""
+    def __init__(self):
+        self.tests = {}
+        self.slaves = defaultdict(set)
+        self.statuses = defaultdict(set)
+        self._indexed = {}
+        self._lock = threading.RLock()
+
+    def __getitem__(self, test_ident):
+        return self.tests[test_ident]
+
+    def __setitem__(self, test_ident, test):
+        with self._lock:
+            self._unindex(test_ident)
+            self.tests[test_ident] = test
+            slaveid, status = test.get('slaveid'), record_status(test)
+            self.slaves[slaveid].add(test_ident)
+            self.statuses[status].add(test_ident)
+            self._indexed[test_ident] = slaveid, status
+
+    def __delitem__(self, test_ident):
+        with self._lock:
+            del self.tests[test_ident]
+            self._unindex(test_ident)
+
+    def _unindex(self, test_ident):
+        if test_ident in self._indexed:
+            slaveid, status = self._indexed.pop(test_ident)
+            self.slaves[slaveid].discard(test_ident)
+            self.statuses[status].discard(test_ident)
+
+    def __iter__(self):
+        return iter(list(self.tests))
+
+    def __len__(self):
+        return len(self.tests)
+
+    def __contains__(self, test_ident):
+        return test_ident in self.tests
+
+    def query(self, slaveid=None, status=None):
+        with self._lock:
+            if slaveid is not None and status is not None:
+                idents = self.slaves[slaveid] & self.statuses[status]
+            elif slaveid is not None:
+                idents = set(self.slaves[slaveid])
+            elif status is not None:
+                idents = set(self.statuses[status])
+            else:
+                idents = set(self.tests)
+        for test_ident in sorted(idents):
+            yield test_ident, self.tests[test_ident]
+
+    def counts(self):
+        with self._lock:
+            return {status: len(idents) for status, idents in self.statuses.iteritems()
+                    if status is not None and idents}
+
+
+class SqliteStore(ArtifactStore):
+    """Keeps the test records in an sqlite table, the recently used ones are cached.
+
+    The cache is write-through, every change is written to the database right away. Records
+    handed out stay valid as long as they are in the cache, changes made to them directly (not
+    by setting them back into the store) are not written.
+
+    Args:
+        path: Database file, ``:memory:`` for an in memory database
+        table: Table of the records, more stores can share one database
+        cache_size: Number of records kept in memory
+        connection: Connection of another store to share, see :py:meth:`share`
+        lock: Lock of the store the connection is shared with
+    """
+    #: Number of records read at once while iterating
+    batch_size = 500
+
+    def __init__(self, path, table='artifacts', cache_size=256, connection=None, lock=None):
+        self.path = path
+        self.table = table
+        self.cache_size = cache_size
+        self.cache = OrderedDict()
+        self._lock = lock or threading.RLock()
+        # The hooks are run by the plugin queue threads, access is serialized by the lock
+        self.connection = connection or sqlite3.connect(path, check_same_thread=False)
+        with self._lock:
+            if connection is None:
+                # Scratch data for the session, durability is not needed
+                self.connection.execute('PRAGMA synchronous = OFF')
+                self.connection.execute('PRAGMA journal_mode = MEMORY')
+            self.connection.execute(
+                'CREATE TABLE IF NOT EXISTS {} (ident TEXT PRIMARY KEY, slaveid TEXT, '
+                'status TEXT, data TEXT)'.format(table))
+            self.connection.execute(
+                'CREATE INDEX IF NOT EXISTS {0}_slaveid ON {0} (slaveid)'.format(table))
+            self.connection.execute(
+                'CREATE INDEX IF NOT EXISTS {0}_status ON {0} (status)'.format(table))
+            self.connection.commit()
+
+    def _cached(self, test_ident, test):
+        self.cache.pop(test_ident, None)
+        self.cache[test_ident] = test
+        while len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+        return test
+
+    def __getitem__(self, test_ident):
+        with self._lock:
+            if test_ident in self.cache:
+                return self._cached(test_ident, self.cache[test_ident])
+            row = self.connection.execute(
+                'SELECT data FROM {} WHERE ident = ?'.format(self.table),
+                (test_ident,)).fetchone()
+            if row is None:
+                raise KeyError(test_ident)
+            return self._cached(test_ident, json.loads(row[0]))
+
+    def __setitem__(self, test_ident, test):
+        data = json.dumps(test)
+        with self._lock:
+            self.connection.execute(
+                'INSERT OR REPLACE INTO {} (ident, slaveid, status, data) '
+                'VALUES (?, ?, ?, ?)'.format(self.table),
+                (test_ident, test.get('slaveid'), record_status(test), data))
+            self.connection.commit()
+            self._cached(test_ident, test)
+
+    def __delitem__(self, test_ident):
+        with self._lock:
+            cursor = self.connection.execute(
+                'DELETE FROM {} WHERE ident = ?'.format(self.table), (test_ident,))
+            self.connection.commit()
+            self.cache.pop(test_ident, None)
+            if not cursor.rowcount:
+                raise KeyError(test_ident)
+
+    def __contains__(self, test_ident):
+        with self._lock:
+            if test_ident in self.cache:
+                return True
+            return self.connection.execute(
+                'SELECT 1 FROM {} WHERE ident = ?'.format(self.table),
+                (test_ident,)).fetchone() is not None
+
+    def __len__(self):
+        with self._lock:
+            return self.connection.execute(
+                'SELECT COUNT(*) FROM {}'.format(self.table)).fetchone()[0]
+
+    def __iter__(self):
+        for row in self._select(columns='ident'):
+            yield row[0]
+
+    def iteritems(self):
+        for test_ident, data in self._select():
+            yield test_ident, json.loads(data)
+
+    def _select(self, columns='ident, data', where='', params=()):
+        """Yields the rows in batches, the lock is not held between them."""
+        last = None
+        while True:
+            conditions = [where] if where else []
+            if last is not None:
+                conditions.append('ident > ?')
+            query = 'SELECT {} FROM {} {} ORDER BY ident LIMIT {}'.format(
+                columns, self.table,
+                'WHERE ' + ' AND '.join(conditions) if conditions else '', self.batch_size)
+            with self._lock:
+                rows = self.connection.execute(
+                    query, tuple(params) + ((last,) if last is not None else ())).fetchall()
+            for row in rows:
+                yield row
+            if len(rows) < self.batch_size:
+                return
+            last = rows[-1][0]
+
+    def query(self, slaveid=None, status=None):
+        conditions, params = [], []
+        if slaveid is not None:
+            conditions.append('slaveid = ?')
+            params.append(slaveid)
+        if status is not None:
+            conditions.append('status = ?')
+            params.append(status)
+        for test_ident, data in self._select(where=' AND '.join(conditions), params=params):
+            yield test_ident, json.loads(data)
+
+    def counts(self):
+        with self._lock:
+            return dict(self.connection.execute(
+                'SELECT status, COUNT(*) FROM {} WHERE status IS NOT NULL '
+                'GROUP BY status'.format(self.table)).fetchall())
+
+    def update(self, *args, **kwargs):
+        other = args[0] if args else None
+        if (isinstance(other, SqliteStore) and other.connection is self.connection and
+                not kwargs):
+            # Copy between tables of one database without decoding the records
+            with self._lock:
+                self.connection.execute(
+                    'INSERT OR REPLACE INTO {} SELECT * FROM {}'.format(self.table, other.table))
+                self.connection.commit()
+                self.cache.clear()
+        else:
+            super(SqliteStore, self).update(*args, **kwargs)
+
+    def share(self, table):
+        """Returns a store of another table in the same database."""
+        return SqliteStore(self.path, table, self.cache_size, self.connection, self._lock)
+
+    def close(self):
+        with self._lock:
+            self.connection.close()
+
+
+def create_stores(config, log_dir):
+    """Creates the stores of ``artifacts`` and ``old_artifacts`` from the Artifactor config.
+
+    Args:
+        config: The Artifactor config
+        log_dir: :py:class:`py.path.local` of the log dir, for the database of ``sqlite``
+    Returns: ``(artifacts store, old_artifacts store)``
+    """
+    kind = config.get('artifact_store', 'memory')
+    if kind == 'memory':
+        return MemoryStore(), MemoryStore()
+    elif kind == 'sqlite':
+        database = log_dir.join('artifacts.sqlite')
+        if database.check():
+            database.remove()
+        artifacts = SqliteStore(
+            database.strpath, cache_size=config.get('artifact_store_cache', 256))
+        return artifacts, artifacts.share('old_artifacts')
+    else:
+        raise ValueError('Unknown artifact store {!r}'.format(kind))
@@ -89,6 +89,7 @@ class CloudProvider(Pretty, CloudInfraProvider):
 @navigator.register(CloudProvider, 'All')
 class All(CFMENavigateStep):
     VIEW = CloudProvidersView
+    URL = 'ems_cloud/show_list'
     prerequisite = NavigateToAttribute('appliance.server', 'LoggedIn')
 
     def step(self):
@@ -125,8 +126,13 @@ class Discover(CFMENavigateStep):
 @navigator.register(CloudProvider, 'Details')
 class Details(CFMENavigateStep):
     VIEW = CloudProviderDetailsView
+    URL = 'ems_cloud/show/{id}'
     prerequisite = NavigateToSibling('All')
 
+    def url_kwargs(self):
+        return {'id': self.cached_id(
+            lambda: self.appliance.rest_api.collections.providers.get(name=self.obj.name).id)}
+
     def step(self):
         self.prerequisite_view.entities.get_entity(by_name=self.obj.name).click()
 
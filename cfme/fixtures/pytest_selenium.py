@@ -33,8 +33,6 @@ from selenium.webdriver.remote.webelement import WebElement
 from selenium.webdriver.support.select import Select as SeleniumSelect
 from multimethods import singledispatch, multidispatch
 
-import base64
-
 from cfme import exceptions, js
 from fixtures.pytest_store import store
 from utils import version
@@ -44,6 +42,7 @@ from utils.log import logger
 from utils.wait import wait_for
 from utils.pretty import Pretty
 from utils.deprecation import removed_in_fw30
+from utils.screenshots import ScreenshotPipeline
 
 from threading import local
 _thread_local = local()
@@ -52,7 +51,8 @@ _thread_local.ajax_timeout = 30
 class_selector = re.compile(r"^(?:[a-zA-Z][a-zA-Z0-9]*)?(?:[#.][a-zA-Z0-9_-]+)+$")
 removed = removed_in_fw30(message="it is replaced by the browser endpoint api")
 
-urls = []
+# Screenshots of the pages visited with --page-screenshots, stored in the background
+page_screenshots = ScreenshotPipeline(log_path.join('page_screenshots'))
 
 
 # Monkeypatching WebElement
@@ -381,16 +381,11 @@ def wait_for_ajax():
     url = browser().current_url
     url = url.replace(base_url(), '')
     url = url.replace("/", '_')
-    if url not in urls:
+    if page_screenshots.mark_seen(url):
         logger.info('Taking picture of page: %s', url)
         ss, sse = take_screenshot()
         if ss:
-            ss_path = log_path.join('page_screenshots')
-            if not ss_path.exists():
-                ss_path.mkdir()
-            with ss_path.join("{}.png".format(url)).open('wb') as f:
-                f.write(base64.b64decode(ss))
-        urls.append(url)
+            page_screenshots.submit(url, ss)
 
 
 @removed
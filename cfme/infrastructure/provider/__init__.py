@@ -212,6 +212,7 @@ class InfraProvider(Pretty, CloudInfraProvider, Fillable):
 @navigator.register(InfraProvider, 'All')
 class All(CFMENavigateStep):
     VIEW = InfraProvidersView
+    URL = 'ems_infra/show_list'
     prerequisite = NavigateToObject(Server, 'LoggedIn')
 
     def step(self):
@@ -251,8 +252,13 @@ class Discover(CFMENavigateStep):
 @navigator.register(InfraProvider, 'Details')
 class Details(CFMENavigateStep):
     VIEW = InfraProviderDetailsView
+    URL = 'ems_infra/show/{id}'
     prerequisite = NavigateToSibling('All')
 
+    def url_kwargs(self):
+        return {'id': self.cached_id(
+            lambda: self.appliance.rest_api.collections.providers.get(name=self.obj.name).id)}
+
     def step(self):
         self.prerequisite_view.entities.get_entity(by_name=self.obj.name).click()
 
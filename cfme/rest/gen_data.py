@@ -1,4 +1,7 @@
 # -*- coding: utf-8 -*-
+import time
+from urllib import quote
+
 import fauxfactory
 
 from cfme.automate.service_dialogs import ServiceDialog
@@ -10,7 +13,7 @@ from cfme.services.catalogs.service_catalogs import ServiceCatalogs
 from cfme.services import requests
 from fixtures.provider import setup_one_by_class_or_skip
 from utils.virtual_machines import deploy_template
-from utils.wait import wait_for
+from utils.wait import wait_for, TimedOutError
 from utils.log import logger
 from utils import version
 
@@ -421,22 +424,23 @@ def _creating_skeleton(request, rest_api, col_name, col_data, col_action='create
     entities = action(*col_data)
     action_status = rest_api.response.status_code
     search_str = '%{}%' if substr_search else '{}'
+    values_by_attr = {}
     for entity in col_data:
         if entity.get('name'):
-            wait_for(lambda: collection.find_by(
-                name=search_str.format(entity.get('name'))) or False, num_sec=180, delay=10)
+            values_by_attr.setdefault('name', []).append(entity['name'])
         elif entity.get('description'):
-            wait_for(lambda: collection.find_by(
-                description=search_str.format(entity.get('description'))) or False,
-                num_sec=180, delay=10)
+            values_by_attr.setdefault('description', []).append(entity['description'])
         else:
             raise NotImplementedError
+    for attr, values in values_by_attr.items():
+        wait_for_entities(rest_api, collection, attr, values, search_str=search_str)
 
     @request.addfinalizer
     def _finished():
-        collection.reload()
         ids = [e.id for e in entities]
-        delete_entities = [e for e in collection if e.id in ids]
+        existing = _filter_collection(rest_api, collection, 'id', ids)
+        existing_ids = [resource['id'] for resource in existing]
+        delete_entities = [e for e in entities if e.id in existing_ids]
         if delete_entities:
             collection.action.delete(*delete_entities)
 
@@ -445,6 +449,65 @@ def _creating_skeleton(request, rest_api, col_name, col_data, col_action='create
     return entities
 
 
+def _filter_collection(rest_api, collection, attr, values, search_str='{}'):
+    """Returns resources of the collection matching any of the values in a single query.
+
+    The values are OR-ed together using the REST API ``filter[]`` syntax.
+    """
+    if not values:
+        return []
+    filters = []
+    for index, value in enumerate(values):
+        if isinstance(value, str):
+            value = value.decode('utf-8')
+        condition = u'{}={}'.format(attr, unicode(search_str).format(value))
+        if index:
+            condition = u'or {}'.format(condition)
+        filters.append('filter[]={}'.format(quote(condition.encode('utf-8'))))
+    url = '{}?expand=resources&attributes={}&{}'.format(
+        collection._href, attr, '&'.join(filters))
+    return rest_api.get(url).get('resources', [])
+
+
+def wait_for_entities(rest_api, collection, attr, values, search_str='{}', num_sec=180,
+        delay=0.5, max_delay=10):
+    """Waits until all the entities with given ``attr`` values exist in the collection.
+
+    Only the entities that did not show up yet are queried, all of them in one request per poll.
+    The polling interval starts at ``delay`` and doubles up to ``max_delay``.
+
+    Args:
+        rest_api: REST API object
+        collection: collection to poll
+        attr: attribute to search by (e.g. ``name``)
+        values: values of the attribute
+        search_str: format string applied to each value, use ``'%{}%'`` for substring search
+        num_sec: timeout in seconds
+        delay: initial polling interval in seconds
+        max_delay: maximum polling interval in seconds
+    """
+    pending = set(values)
+    substr_search = search_str != '{}'
+    start = time.time()
+    while True:
+        found = [resource.get(attr) for resource in
+            _filter_collection(rest_api, collection, attr, sorted(pending), search_str)]
+        for value in list(pending):
+            if any(
+                    item is not None and (value in item if substr_search else value == item)
+                    for item in found):
+                pending.discard(value)
+        if not pending:
+            logger.info('All %d %s entities found in %.1fs',
+                len(values), collection.name, time.time() - start)
+            return
+        if time.time() - start + delay > num_sec:
+            raise TimedOutError('Could not find {} {} entities with {} {!r} in {} seconds'.format(
+                len(pending), collection.name, attr, sorted(pending), num_sec))
+        time.sleep(delay)
+        delay = min(delay * 2, max_delay)
+
+
 def mark_vm_as_template(rest_api, provider, vm_name):
     """
         Function marks vm as template via mgmt and returns template Entity
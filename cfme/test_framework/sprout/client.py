@@ -1,6 +1,9 @@
 # -*- coding: utf-8 -*-
 import json
 import os
+import random
+import time
+
 import requests
 
 from utils.version import get_stream
@@ -19,6 +22,33 @@ class AuthException(SproutException):
     pass
 
 
+class PollBackoff(object):
+    """Sleeps between the polls of a status, longer while the status does not change.
+
+    The delay doubles (up to ``longest``) with every poll returning the same status and is reset
+    when the status changes. The delays are randomized, so that many clients polling at once do not
+    hit Sprout at the same moments.
+    """
+    def __init__(self, first=1, longest=30):
+        self.first = first
+        self.longest = longest
+        self.delay = first
+        self.last = None
+
+    def wait(self):
+        """Sleeps before the next poll, the first one is done right away."""
+        if self.last is not None:
+            time.sleep(random.uniform(self.delay / 2.0, self.delay))
+
+    def update(self, status):
+        """Sets the delay before the next poll by the status the last one returned."""
+        if status != self.last:
+            self.delay = self.first
+        else:
+            self.delay = min(self.delay * 2, self.longest)
+        self.last = status
+
+
 class APIMethodCall(object):
     def __init__(self, client, method_name):
         self._client = client
@@ -29,6 +59,12 @@ class APIMethodCall(object):
 
 
 class SproutClient(object):
+    #: Total time to keep retrying a call while Sprout is unavailable (being updated), in seconds
+    retry_timeout = 60
+    #: First and longest delay between the retries, the delays are randomized
+    retry_delay = 1
+    retry_max_delay = 10
+
     def __init__(
             self, protocol="http", host="localhost", port=8000, entry="appliances/api", auth=None):
         self._proto = protocol
@@ -36,34 +72,72 @@ class SproutClient(object):
         self._port = port
         self._entry = entry
         self._auth = auth
+        # Keeps the connection alive between the calls
+        self._session = requests.Session()
 
     @property
     def api_entry(self):
         return "{}://{}:{}/{}".format(self._proto, self._host, self._port, self._entry)
 
     def _post(self, **data):
-        return requests.post(self.api_entry, data=json.dumps(data))
+        return self._session.post(self.api_entry, data=json.dumps(data))
 
     def _call_post(self, **data):
-        """Protect from the Sprout being updated (error 502,503)"""
-        result = wait_for(
-            lambda: self._post(**data),
-            num_sec=60,
-            fail_condition=lambda r: r.status_code in {502, 503},
-            delay=2,
-        )
-        return result.out.json()
-
-    def call_method(self, name, *args, **kwargs):
-        req_data = {
+        """Protect from the Sprout being updated (error 502,503)
+
+        Retries with exponential backoff and full jitter, so that many clients retrying at once
+        do not hit Sprout at the same moments.
+        """
+        deadline = time.time() + self.retry_timeout
+        attempt = 0
+        while True:
+            try:
+                response = self._post(**data)
+            except requests.exceptions.ConnectionError:
+                if time.time() >= deadline:
+                    raise
+            else:
+                if response.status_code not in {502, 503}:
+                    try:
+                        return response.json()
+                    except ValueError:
+                        raise SproutException('Invalid response from Sprout (HTTP {}): {}'.format(
+                            response.status_code, response.text[:200]))
+                if time.time() >= deadline:
+                    raise SproutException('Sprout is unavailable (HTTP {}) for {} seconds'.format(
+                        response.status_code, self.retry_timeout))
+            delay = random.uniform(0, min(self.retry_max_delay, self.retry_delay * 2 ** attempt))
+            attempt += 1
+            time.sleep(min(delay, max(deadline - time.time(), 0)))
+
+    def _call_data(self, name, args, kwargs):
+        logger.info("SPROUT: Called {} with {} {}".format(name, args, kwargs))
+        return {
             "method": name,
             "args": args,
             "kwargs": kwargs,
         }
-        logger.info("SPROUT: Called {} with {} {}".format(name, args, kwargs))
+
+    def call_method(self, name, *args, **kwargs):
+        req_data = self._call_data(name, args, kwargs)
         if self._auth is not None:
             req_data["auth"] = self._auth
-        result = self._call_post(**req_data)
+        return self._result(self._call_post(**req_data))
+
+    def call_batch(self, calls):
+        """Calls more methods in one request.
+
+        Args:
+            calls: List of ``(method name, args, kwargs)``
+        Returns: List of the results of the calls, raises on the first call that failed.
+        """
+        req_data = {"batch": [self._call_data(name, args, kwargs) for name, args, kwargs in calls]}
+        if self._auth is not None:
+            req_data["auth"] = self._auth
+        return [
+            self._result(result) for result in self._result(self._call_post(**req_data))]
+
+    def _result(self, result):
         try:
             if result["status"] == "exception":
                 raise SproutException(
@@ -110,15 +184,29 @@ class SproutClient(object):
             'request_appliances', preconfigured=preconfigured, version=version,
             group=stream, provider=provider, lease_time=lease_time, ram=ram, cpu=cpu, count=count
         )
-        wait_for(
-            lambda: self.call_method('request_check', str(request_id))['finished'], num_sec=300,
+        data = self.wait_request(request_id, 'finished', num_sec=300,
             message='provision {} appliance(s) from sprout'.format(count))
-        data = self.call_method('request_check', str(request_id))
         logger.debug(data)
         appliances = []
         for appliance in data['appliances']:
             appliances.append(IPAppliance(appliance['ip_address']))
         return appliances, request_id
 
+    def wait_request(self, request_id, key, **kwargs):
+        """Waits for the key of the pool status to be true, returns the status.
+
+        The pool is checked less often while its status does not change (see
+        :py:class:`PollBackoff`). The keyword arguments are passed to ``wait_for``.
+        """
+        backoff = PollBackoff()
+
+        def _check():
+            backoff.wait()
+            backoff.update(self.call_method('request_check', str(request_id)))
+            return backoff.last[key]
+        kwargs.setdefault('delay', 0)
+        wait_for(_check, **kwargs)
+        return backoff.last
+
     def destroy_pool(self, pool_id):
         self.call_method('destroy_pool', id=pool_id)
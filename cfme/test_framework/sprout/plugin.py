@@ -9,7 +9,7 @@ from utils.appliance import IPAppliance, stack as appliance_stack
 # todo: use own logger after logfix merge
 from utils.log import logger as log
 from utils.path import project_path
-from .client import SproutClient, SproutException
+from .client import PollBackoff, SproutClient, SproutException
 from utils.wait import wait_for
 
 
@@ -128,6 +128,7 @@ class SproutManager(object):
     pool = attr.ib(init=False, default=None)
     lease_time = attr.ib(init=False, default=None, repr=False)
     timer = attr.ib(init=False, default=None, repr=False)
+    backoff = attr.ib(init=False, default=attr.Factory(PollBackoff), repr=False)
 
     def request_appliances(self, provision_request):
         self.request_pool(provision_request)
@@ -136,7 +137,7 @@ class SproutManager(object):
             result = wait_for(
                 self.check_fullfilled,
                 num_sec=provision_request.provision_timeout * 60,
-                delay=5,
+                delay=0,
                 message="requesting appliances was fulfilled"
             )
         except Exception:
@@ -186,6 +187,7 @@ class SproutManager(object):
         return self.client.request_check(self.pool)
 
     def check_fullfilled(self):
+        self.backoff.wait()
         try:
             result = self.request_check()
         except SproutException as e:
@@ -195,6 +197,7 @@ class SproutManager(object):
             pytest.exit(1)
 
         log.debug("fulfilled at %f %%", result['progress'])
+        self.backoff.update(result)
         return result["fulfilled"]
 
     def clean_jenkins_job(self, jenkins_job):
@@ -1,4 +1,4 @@
-from bottle import request, route, run, template
+from bottle import request, response, route, run, template
 import os
 import subprocess
 import tempfile
@@ -42,8 +42,9 @@ class Log(object):
         self.stop()
         self.start()
 
-    def get(self):
+    def get(self, offset=0):
         with open(self.f.name, "rb") as infile:
+            infile.seek(offset)
             return infile.read()
 
     def size(self):
@@ -128,6 +129,19 @@ def lister():
 
 @route('/get/<name>')
 def get(name):
+    """Returns the log, or only the part from the offset given by a ``Range: bytes=<offset>-``
+    header."""
+    range_header = request.headers.get('Range', '')
+    if range_header.startswith('bytes=') and range_header.endswith('-'):
+        try:
+            offset = int(range_header[len('bytes='):-1])
+        except ValueError:
+            return Loggers[name].get()
+        data = Loggers[name].get(offset)
+        response.status = 206
+        response.set_header(
+            'Content-Range', 'bytes {}-{}/*'.format(offset, offset + len(data) - 1))
+        return data
     return Loggers[name].get()
 
 
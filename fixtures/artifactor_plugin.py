@@ -9,6 +9,7 @@
         server_address: 127.0.0.1
         server_port: 21212
         server_enabled: True
+        artifact_store: memory #memory, sqlite
         plugins:
 
 ``log_dir`` is the destination for all artifacts
@@ -18,6 +19,9 @@
 ``reuse_dir`` if this is False and Artifactor comes across a dir that has
 already been used, it will die
 
+``artifact_store`` keeps the test records in memory or, for large runs, in sqlite (see
+:py:mod:`artifactor.store`)
+
 
 """
 import atexit
@@ -33,7 +37,7 @@ from threading import RLock
 from utils.appliance import get_or_create_current_appliance
 from utils.blockers import BZ, Blocker
 from utils.conf import env, credentials
-from utils.log import logger
+from utils.log import artifactor_handler, logger
 from utils.net import random_port, net_check
 from utils.wait import wait_for
 from utils import version
@@ -134,7 +138,7 @@ def pytest_configure(config):
         art_client.ready = True
     else:
         config._art_proc = None
-    from utils.log import artifactor_handler
+    # The handler ships the log records from its own thread, the client keeps a socket per thread
     artifactor_handler.artifactor = art_client
     if store.slave_manager:
         artifactor_handler.slaveid = store.slaveid
@@ -203,6 +207,8 @@ def pytest_runtest_protocol(item):
                 blockers.append(Blocker.parse(blocker).url)
     else:
         blockers = []
+    # Ship the logs of the previous test before its log file gets replaced
+    artifactor_handler.flush()
     fire_art_test_hook(
         item, 'pre_start_test',
         slaveid=store.slaveid, ip=ip)
@@ -213,13 +219,24 @@ def pytest_runtest_protocol(item):
     yield
 
 
+@pytest.mark.hookwrapper
+def pytest_runtest_makereport(item, call):
+    outcome = yield
+    report = outcome.get_result()
+    if report.failed and not hasattr(report, 'wasxfail'):
+        # Sent with finish_test, the reported statuses are processed in the background
+        item._art_failed = True
+
+
 def pytest_runtest_teardown(item, nextitem):
     name, location = get_test_idents(item)
     app = get_or_create_current_appliance()
     ip = app.address
+    artifactor_handler.flush()
     fire_art_test_hook(
         item, 'finish_test',
-        slaveid=store.slaveid, ip=ip, wait_for_task=True)
+        slaveid=store.slaveid, ip=ip, test_failed=getattr(item, '_art_failed', False),
+        wait_for_task=True)
     fire_art_test_hook(item, 'sanitize', words=words)
     jenkins_data = {
         'build_url': os.environ.get('BUILD_URL'),
@@ -282,6 +299,7 @@ def shutdown(config):
     with lock:
         proc = config._art_proc
         if proc:
+            artifactor_handler.close()
             if not store.slave_manager:
                 write_line('collecting artifacts')
                 fire_art_hook(config, 'finish_session')
@@ -4,6 +4,7 @@ from py.error import ENOENT
 import utils.browser
 from cfme.fixtures.pytest_selenium import ensure_browser_open, take_screenshot
 from fixtures.artifactor_plugin import fire_art_test_hook
+from fixtures.pytest_store import store
 from utils.datafile import template_env
 from utils.path import log_path
 from utils import browser as browser_module, safe_string
@@ -113,6 +114,18 @@ def pytest_sessionfinish(session, exitstatus):
         failed_tests_report = failed_tests_template.render(**failed_test_tracking)
         outfile.write(failed_tests_report)
 
+    # Per-destination navigation timings, the most time consuming first
+    from utils.appliance.implementations.ui import navigation_stats
+    nav_stats = navigation_stats.summary()
+    if nav_stats:
+        # Every slave navigates on its own, so each of them writes its own file
+        if store.slaveid:
+            stats_file = 'navigation_stats-{}.txt'.format(store.slaveid)
+        else:
+            stats_file = 'navigation_stats.txt'
+        log_path.join(stats_file).write('\n'.join(nav_stats) + '\n')
+        logger.info('Most time consuming navigation destinations:\n%s', '\n'.join(nav_stats[:10]))
+
 
 @pytest.fixture(scope='session')
 def browser():
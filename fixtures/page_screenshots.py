@@ -3,3 +3,17 @@ def pytest_addoption(parser):
     parser.getgroup('cfme')
     parser.addoption("--page-screenshots", action="store_true", default=False,
         help="take screenshots for each page visited")
+    parser.addoption("--page-screenshot-thumbnails", action="store_true", default=False,
+        help="also store downscaled page screenshots for reports (needs PIL)")
+
+
+def pytest_configure(config):
+    if config.getvalue('page_screenshot_thumbnails'):
+        from cfme.fixtures.pytest_selenium import page_screenshots
+        page_screenshots.thumbnail_size = (320, 200)
+
+
+def pytest_unconfigure(config):
+    if config.getvalue('page_screenshots'):
+        from cfme.fixtures.pytest_selenium import page_screenshots
+        page_screenshots.flush()
@@ -34,15 +34,22 @@ Pre-testing (``pytest_configure`` hook):
 4. TOUCH ALL THE THINGS (run ``thing_toucher.rb`` with the rails runner).
    Fork this process off and come back to it later
 
-Post-testing (``pytest_unconfigure`` hook):
+Post-testing (``pytest_sessionfinish`` hook), on every appliance (each slave does its own, so
+the appliances are collected concurrently):
 
 1. Poll ``thing_toucher`` to make sure it completed; block if needed.
 2. Stop EVM, but nicely this time so the coverage atexit hooks run:
    ``systemctl stop evmserverd``
-3. Run ``coverage_merger.rb`` with the rails runner, which compiles all the individual process
-   reports and runs coverage again, additionally creating an rcov report
-4. Pull the coverage dir back for parsing and archiving
-5. For fun: Read the results from ``coverage/.last_run.json`` and print it to the test terminal/log
+3. Compress the coverage dir on the appliance and pull the archive back to
+   ``log/coverage/raw/[address].tgz``
+4. Merge the results of all the appliance processes into a partial result
+   ``log/coverage/partial/[address].jsonl`` (see :py:mod:`utils.simplecov`), right when that
+   appliance is done, not waiting for the others
+
+Post-testing, on master/standalone:
+
+1. Combine the raw archives into ``coverage-results.tgz``
+2. k-way merge the partial results into ``log/coverage/merged/.resultset.json``
 
 Post-testing (e.g. ci environment):
 1. Use the generated rcov report with the ruby stats plugin to get a coverage graph
@@ -50,6 +57,7 @@ Post-testing (e.g. ci environment):
 
 """
 import subprocess
+import tarfile
 from threading import Thread
 
 import pytest
@@ -60,7 +68,7 @@ from fixtures.pytest_store import store
 from utils import conf, version
 from utils.log import create_sublogger
 from utils.path import conf_path, log_path, scripts_data_path
-from utils.quote import quote
+from utils.simplecov import merge_archive, merge_streams, read_partial, write_resultset
 from utils.wait import wait_for, TimedOutError
 
 # paths to all of the coverage-related files
@@ -81,6 +89,11 @@ coverage_merger = coverage_data.join('coverage_merger.rb')
 thing_toucher = coverage_data.join('thing_toucher.rb')
 coverage_output_dir = log_path.join('coverage')
 coverage_results_archive = coverage_output_dir.join('coverage-results.tgz')
+#: raw coverage dir archives pulled from the appliances, one per appliance
+coverage_raw_dir = coverage_output_dir.join('raw')
+#: results of the processes of one appliance merged together, one per appliance
+coverage_partial_dir = coverage_output_dir.join('partial')
+coverage_merged_dir = coverage_output_dir.join('merged')
 coverage_appliance_conf = conf_path.join('.ui-coverage')
 
 # This is set in sessionfinish, and should be reliably readable
@@ -150,19 +163,21 @@ class CoverageManager(object):
         self._stop_touching_all_the_things()
         self._collect_reports()
         self.ipapp.restart_evm_service(rude=False)
+        try:
+            self._merge_appliance_reports()
+        except Exception as exc:
+            self.log.error('Error merging coverage reports of %s', self.ipapp.address)
+            self.log.exception(exc)
 
     def merge(self):
         self.print_message('merging reports')
         try:
             self._retrieve_coverage_reports()
-            # If the appliance runs out of memory, these can take *days* to complete,
-            # so for now we'll just collect the raw coverage data and figure the merging
-            # out later
-            # Edit, 10-Feb-2016:
-            # Currently, the reports are merged using the {stream}-reports job
-            # which utilizes the 'jjb/scripts/stream_reporter.sh' script instead
-            # self._merge_coverage_reports()
-            # self._retrieve_merged_reports()
+            # Merging with coverage_merger.rb on the appliance can take *days* if it runs out of
+            # memory, so the partial results pulled from every appliance are merged here instead.
+            # The html/rcov reports are still made by the {stream}-reports job
+            # ('jjb/scripts/stream_reporter.sh') from the raw archive.
+            self._merge_partial_reports()
         except Exception as exc:
             self.log.error('Error merging coverage reports')
             self.log.exception(exc)
@@ -235,29 +250,68 @@ class CoverageManager(object):
             self.print_message("thing_toucher.rb timed out after 10mins; killing the process")
             self.ipapp.ssh_client.run_command("pkill -f thing_toucher")
 
+    @property
+    def raw_archive(self):
+        return coverage_raw_dir.join('{}.tgz'.format(self.ipapp.address))
+
+    @property
+    def partial_report(self):
+        return coverage_partial_dir.join('{}.jsonl'.format(self.ipapp.address))
+
     def _collect_reports(self):
-        # restart evm to stop the proccesses and let the simplecov exit hook run
+        # stop evm to stop the proccesses and let the simplecov exit hook run
         self.ipapp.ssh_client.run_command('systemctl stop evmserverd')
-        # collect back to the collection appliance if parallelized
-        if store.current_appliance != self.collection_appliance:
-            self.print_message('sending reports to {}'.format(self.collection_appliance.address))
-            result = self.ipapp.ssh_client.run_command(
-                'sshpass -p {passwd} '
-                'scp -o StrictHostKeyChecking=no '
-                '-r /var/www/miq/vmdb/coverage/* '
-                '{addr}:/var/www/miq/vmdb/coverage/'.format(
-                    addr=self.collection_appliance.address,
-                    passwd=quote(self.ipapp.ssh_client._connect_kwargs['password'])),
-                timeout=1800)
-            if not result:
-                self.print_message('There was an error sending reports: ' + str(result))
+        # Every appliance is pulled by its own slave, compressed, in one file; with many process
+        # results this is much faster than copying the coverage dir file by file
+        self.print_message('pulling reports from {}'.format(self.ipapp.address))
+        remote_archive = '/tmp/ui-coverage-raw.tgz'
+        result = self.ipapp.ssh_client.run_command(
+            'cd {}; tar czf {} coverage/'.format(rails_root.strpath, remote_archive),
+            timeout=1800)
+        if not result:
+            self.print_message('There was an error compressing reports: ' + str(result))
+            return
+        coverage_raw_dir.ensure(dir=True)
+        self.ipapp.ssh_client.get_file(remote_archive, self.raw_archive.strpath)
+
+    def _merge_appliance_reports(self):
+        # Merge the results of all the processes of this appliance as soon as it is pulled,
+        # so that only the partial results of the appliances are left to merge at the end
+        if not self.raw_archive.check():
+            return
+        coverage_partial_dir.ensure(dir=True)
+        resultsets, files = merge_archive(self.raw_archive.strpath, self.partial_report.strpath)
+        self.log.info('merged %d process results of %d files from %s',
+            resultsets, files, self.ipapp.address)
 
     def _retrieve_coverage_reports(self):
-        # Before merging, archive and collect all the raw coverage results
-        ssh_client = self.collection_appliance.ssh_client
-        ssh_client.run_command('cd /var/www/miq/vmdb/;'
-            'tar czf /tmp/ui-coverage-raw.tgz coverage/')
-        ssh_client.get_file('/tmp/ui-coverage-raw.tgz', coverage_results_archive.strpath)
+        # Combine the raw coverage results of all the appliances into one archive, laid out like
+        # the appliance coverage dir ("coverage/[ipaddress]/[pid]/")
+        if not coverage_raw_dir.check(dir=True):
+            self.print_message('no coverage results were pulled')
+            return
+        with tarfile.open(coverage_results_archive.strpath, 'w:gz') as results:
+            for raw_archive in coverage_raw_dir.listdir('*.tgz', sort=True):
+                with tarfile.open(raw_archive.strpath, 'r|gz') as raw:
+                    for member in raw:
+                        results.addfile(
+                            member, raw.extractfile(member) if member.isfile() else None)
+
+    def _merge_partial_reports(self):
+        if coverage_partial_dir.check(dir=True):
+            partial_reports = coverage_partial_dir.listdir('*.jsonl', sort=True)
+        else:
+            partial_reports = []
+        if not partial_reports:
+            self.print_message('no coverage results to merge')
+            return
+        coverage_merged_dir.ensure(dir=True)
+        write_resultset(
+            coverage_merged_dir.join('.resultset.json').strpath,
+            merge_streams(*[read_partial(report.strpath) for report in partial_reports]),
+            'CFME')
+        self.print_message('merged coverage results of {} appliances'.format(
+            len(partial_reports)))
 
     def _upload_coverage_merger(self):
         ssh_client = self.collection_appliance.ssh_client
@@ -304,7 +358,7 @@ class UiCoveragePlugin(object):
             manager().install()
 
     def pytest_sessionfinish(self, exitstatus):
-        # Now master/standalone needs to move all the reports to an appliance for the source report
+        # Every slave/standalone pulls and merges the reports of its own appliance
         if store.parallelizer_role != 'master':
             manager().collect()
 
@@ -312,7 +366,7 @@ class UiCoveragePlugin(object):
         if store.parallelizer_role == 'slave':
             return
 
-        # on master/standalone, merge all the collected reports and bring them back
+        # on master/standalone, merge the partial results of all the appliances
         manager().merge()
 
 # TODO
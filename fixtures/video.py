@@ -8,20 +8,31 @@ Yaml example:
                enabled: True
                dir: video
                display: ":99"
-               quality: 10
+               segment_time: 10
+               segments: 90
+               keep: failed  # or all
+
+The display is recorded for the whole session into a ring buffer of segments. After a test, the
+clip of its time window is cut out of the buffer in the background, by default only when the
+test failed.
 """
 
 import os
 import os.path
-import pytest
 import re
+import time
+
+import pytest
+from concurrent import futures
 
 from utils.conf import env
 from utils.path import log_path
-from utils.video import Recorder
+from utils.video import SegmentedRecorder
 
 vid_options = env.get('logging', {}).get('video')
 recorder = None
+clipper = futures.ThreadPoolExecutor(max_workers=1)
+clips = []
 
 
 def get_path_and_file_name(node):
@@ -37,25 +48,54 @@ def get_path_and_file_name(node):
     return node.parent.name, vid_name
 
 
+def get_recorder():
+    global recorder
+    if recorder is None:
+        recorder = SegmentedRecorder(
+            log_path.join(vid_options['dir'], 'segments').strpath,
+            display=vid_options.get('display'),
+            segment_time=vid_options.get('segment_time', 10),
+            segments=vid_options.get('segments', 90))
+    recorder.start()
+    return recorder
+
+
 @pytest.mark.hookwrapper
 def pytest_runtest_setup(item):
-    global recorder
     if vid_options and vid_options['enabled']:
-        vid_log_path = log_path.join(vid_options['dir'])
-        vid_dir, vid_name = get_path_and_file_name(item)
-        full_vid_path = vid_log_path.join(vid_dir)
-        try:
-            os.makedirs(full_vid_path.strpath)
-        except OSError:
-            pass
-        vid_name = vid_name + ".ogv"
-        recorder = Recorder(full_vid_path.join(vid_name).strpath)
-        recorder.start()
+        get_recorder()
+        item._video_start = time.time()
     yield
 
 
+@pytest.mark.hookwrapper
+def pytest_runtest_makereport(item, call):
+    outcome = yield
+    start = getattr(item, '_video_start', None)
+    if start is None:
+        return
+    report = outcome.get_result()
+    if report.failed and not hasattr(report, 'wasxfail'):
+        item._video_failed = True
+    if call.when != 'teardown':
+        return
+    if vid_options.get('keep', 'failed') != 'all' and not getattr(item, '_video_failed', False):
+        return
+    vid_dir, vid_name = get_path_and_file_name(item)
+    full_vid_path = log_path.join(vid_options['dir'], vid_dir)
+    try:
+        os.makedirs(full_vid_path.strpath)
+    except OSError:
+        pass
+    global clips
+    clips = [clip for clip in clips if not clip.done()]
+    clips.append(clipper.submit(
+        recorder.clip, start, time.time(), full_vid_path.join(vid_name + ".mp4").strpath))
+
+
 def stop_recording():
     global recorder
+    futures.wait(clips)
     if recorder is not None:
         try:
             recorder.stop()
@@ -63,12 +103,6 @@ def stop_recording():
             recorder = None
 
 
-@pytest.mark.hookwrapper
-def pytest_runtest_teardown(item, nextitem):
-    yield
-    stop_recording()
-
-
 @pytest.mark.hookwrapper
 def pytest_unconfigure(config):
     yield
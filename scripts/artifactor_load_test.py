@@ -0,0 +1,151 @@
+#!/usr/bin/env python2
+"""Load test of the Artifactor plugin dispatch with simulated slaves.
+
+Every slave runs its tests one after another, firing ``start_test``, a couple of ``filedump``-like
+events and ``finish_test`` with ``wait_for_task`` like the pytest plugin does. A slow plugin stands
+for merkyl talking to the appliance. The run is done once with the serial riggerlib dispatch and
+once with the plugin queues, each in its own process, and the throughput is compared.
+
+Usage:
+
+    scripts/artifactor_load_test.py --slaves 8 --tests 10 --delay 0.05
+"""
+import argparse
+import json
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+
+import riggerlib
+from riggerlib import Rigger
+
+from artifactor import Artifactor, ArtifactorBasePlugin, ArtifactorClient, initialize
+from utils.net import random_port
+
+STEPS = 3
+
+
+class SlowPlugin(ArtifactorBasePlugin):
+    """Takes ``delay`` seconds for every test event, like a plugin doing HTTP requests."""
+    def plugin_initialize(self):
+        self.register_plugin_hook('start_test', self.start_test)
+        self.register_plugin_hook('test_step', self.test_step)
+        self.register_plugin_hook('finish_test', self.finish_test)
+
+    def configure(self, delay):
+        self.delay = delay
+        self.events = defaultdict(list)
+        self.configured = True
+
+    def _event(self, name, test_location, test_name):
+        time.sleep(self.delay)
+        self.events["{}/{}".format(test_location, test_name)].append(name)
+
+    @ArtifactorBasePlugin.check_configured
+    def start_test(self, test_location, test_name):
+        self._event('start', test_location, test_name)
+
+    @ArtifactorBasePlugin.check_configured
+    def test_step(self, test_location, test_name, step):
+        self._event('step{}'.format(step), test_location, test_name)
+
+    @ArtifactorBasePlugin.check_configured
+    def finish_test(self, test_location, test_name):
+        self._event('finish', test_location, test_name)
+
+
+class SerialArtifactor(Artifactor):
+    """Artifactor with the plain riggerlib dispatch, as the baseline"""
+    process_queue = Rigger.process_queue
+    process_hook = Rigger.process_hook
+    fire_hook = Rigger.fire_hook
+    _fire_internal_hook = Rigger._fire_internal_hook
+
+
+def run_slave(port, slave, tests):
+    client = ArtifactorClient('127.0.0.1', port)
+    client.ready = True
+    slaveid = 'gw{}'.format(slave)
+    for test in range(tests):
+        idents = {'test_location': 'load/test_{}.py'.format(slave),
+                  'test_name': 'test_{}'.format(test)}
+        client.fire_hook('start_test', slaveid=slaveid, **idents)
+        for step in range(STEPS):
+            client.fire_hook('test_step', slaveid=slaveid, step=step, **idents)
+        client.fire_hook('finish_test', slaveid=slaveid, wait_for_task=True, **idents)
+
+
+def run(mode, slaves, tests, delay):
+    port = random_port()
+    log_dir = tempfile.mkdtemp()
+    art = (SerialArtifactor if mode == 'serial' else Artifactor)(None)
+    art.set_config({
+        'log_dir': log_dir,
+        'artifact_dir': log_dir,
+        'reuse_dir': True,
+        'server_enabled': True,
+        'server_port': port,
+        'plugins': {'slow': {'enabled': True, 'plugin': 'slow', 'concurrency': slaves}}})
+    art.register_plugin(SlowPlugin, 'slow')
+    initialize(art)
+    art.configure_plugin('slow', delay=delay)
+    art.fire_hook('start_session', run_id='load')
+
+    start = time.time()
+    threads = [
+        threading.Thread(target=run_slave, args=(port, slave, tests)) for slave in range(slaves)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    art.wait_for_plugins()
+    elapsed = time.time() - start
+
+    expected = ['start'] + ['step{}'.format(step) for step in range(STEPS)] + ['finish']
+    events = art.get_instance_obj('slow').events
+    result = {
+        'mode': mode,
+        'elapsed': elapsed,
+        'events_per_second': slaves * tests * len(expected) / elapsed,
+        'ordered': len(events) == slaves * tests and all(
+            test_events == expected for test_events in events.values()),
+    }
+    print(json.dumps(result))
+    shutil.rmtree(log_dir, ignore_errors=True)
+    riggerlib.shutdown()
+
+
+def main():
+    parser = argparse.ArgumentParser(epilog=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--slaves', type=int, default=8, help='Number of simulated slaves')
+    parser.add_argument('--tests', type=int, default=10, help='Number of tests per slave')
+    parser.add_argument('--delay', type=float, default=0.05,
+                        help='Seconds the slow plugin takes per event')
+    parser.add_argument('--mode', choices=['serial', 'concurrent'], default=None,
+                        help='Run only one mode in this process')
+    args = parser.parse_args()
+
+    if args.mode:
+        run(args.mode, args.slaves, args.tests, args.delay)
+        return
+
+    results = {}
+    for mode in ('serial', 'concurrent'):
+        # riggerlib keeps its queues in module globals, so every mode needs a fresh process
+        output = subprocess.check_output(
+            [sys.executable, __file__, '--mode', mode, '--slaves', str(args.slaves),
+             '--tests', str(args.tests), '--delay', str(args.delay)])
+        results[mode] = json.loads(output.strip().splitlines()[-1])
+        print('{mode}: {elapsed:.2f}s, {events_per_second:.1f} events/s, '
+              'ordered per test: {ordered}'.format(**results[mode]))
+    print('Speedup: {:.1f}x'.format(
+        results['concurrent']['events_per_second'] / results['serial']['events_per_second']))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,148 @@
+#!/usr/bin/env python2
+"""Benchmark of the Artifactor artifact stores with a large number of tests.
+
+Every test goes through the events that update the artifacts of a test in a real run: the
+reporter's ``start_test``, a few ``filedump`` files, a ``report_test`` per phase and
+``finish_test``, which reads the record of the test back. The plugin hooks are sync points, so the
+measured hook latency includes merging the update into the store. Every store is run in its own
+process, the peak memory (max RSS) of the process and the hook latency are compared.
+
+Usage:
+
+    scripts/artifactor_store_benchmark.py --tests 20000 --files 5
+"""
+import argparse
+import json
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import riggerlib
+
+from artifactor import Artifactor, ArtifactorBasePlugin, initialize
+from utils.net import random_port
+
+PHASES = ('setup', 'call', 'teardown')
+
+
+class RecordPlugin(ArtifactorBasePlugin):
+    """Returns the artifact updates the reporter and filedump plugins do."""
+    sync_hooks = ('start_test', 'filedump', 'report_test', 'finish_test')
+
+    def plugin_initialize(self):
+        self.register_plugin_hook('start_test', self.start_test)
+        self.register_plugin_hook('filedump', self.filedump)
+        self.register_plugin_hook('report_test', self.report_test)
+        self.register_plugin_hook('finish_test', self.finish_test)
+
+    def configure(self):
+        self.configured = True
+
+    @ArtifactorBasePlugin.check_configured
+    def start_test(self, test_location, test_name, slaveid):
+        return None, {'artifacts': {'{}/{}'.format(test_location, test_name): {
+            'start_time': time.time(), 'slaveid': slaveid, 'params': {'provider': 'rhos'},
+            'test_module': test_location, 'test_name': test_name, 'issues': []}}}
+
+    @ArtifactorBasePlugin.check_configured
+    def filedump(self, test_location, test_name, description):
+        return None, {'artifacts': {'{}/{}'.format(test_location, test_name): {'files': [{
+            'file_type': 'log', 'display_type': 'primary', 'display_glyph': None,
+            'description': description, 'group_id': 'pytest',
+            'os_filename': '/tmp/{}/{}/{}.log'.format(test_location, test_name, description)}]}}}
+
+    @ArtifactorBasePlugin.check_configured
+    def report_test(self, test_location, test_name, test_when):
+        return None, {'artifacts': {'{}/{}'.format(test_location, test_name): {
+            'statuses': {test_when: ['passed', False]}}}}
+
+    @ArtifactorBasePlugin.check_configured
+    def finish_test(self, artifacts, test_location, test_name, slaveid):
+        test_ident = '{}/{}'.format(test_location, test_name)
+        assert len(artifacts[test_ident]['statuses']) == len(PHASES)
+        return None, {'artifacts': {test_ident: {
+            'finish_time': time.time(), 'statuses': {'overall': 'passed'}}}}
+
+
+def run(store, tests, files):
+    log_dir = tempfile.mkdtemp()
+    art = Artifactor(None)
+    art.set_config({
+        'log_dir': log_dir,
+        'artifact_dir': log_dir,
+        'artifact_store': store,
+        'reuse_dir': True,
+        'server_enabled': True,
+        'server_port': random_port(),
+        'plugins': {'record': {'enabled': True, 'plugin': 'record'}}})
+    art.register_plugin(RecordPlugin, 'record')
+    initialize(art)
+    art.configure_plugin('record')
+    art.process_hook('start_session', run_id='bench')
+
+    latencies = []
+
+    def hook(name, **kwargs):
+        start = time.time()
+        art.process_hook(name, **kwargs)
+        latencies.append(time.time() - start)
+
+    start = time.time()
+    for test in range(tests):
+        idents = {'test_location': 'cfme/tests/test_{}.py'.format(test % 100),
+                  'test_name': 'test_{}'.format(test), 'slaveid': 'gw{}'.format(test % 8)}
+        hook('start_test', **idents)
+        for phase in PHASES:
+            for i in range(files):
+                hook('filedump', description='{}-{}'.format(phase, i), **idents)
+            hook('report_test', test_when=phase, **idents)
+        hook('finish_test', **idents)
+    art.wait_for_plugins()
+    elapsed = time.time() - start
+
+    artifacts = art.global_data['artifacts']
+    latencies.sort()
+    result = {
+        'store': store,
+        'elapsed': elapsed,
+        'tests': len(artifacts),
+        'passed': artifacts.counts().get('passed', 0),
+        'avg_latency_ms': 1000 * sum(latencies) / len(latencies),
+        'p99_latency_ms': 1000 * latencies[int(len(latencies) * 0.99)],
+        'max_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0,
+    }
+    print(json.dumps(result))
+    artifacts.close()
+    shutil.rmtree(log_dir, ignore_errors=True)
+    riggerlib.shutdown()
+
+
+def main():
+    parser = argparse.ArgumentParser(epilog=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--tests', type=int, default=10000, help='Number of tests')
+    parser.add_argument('--files', type=int, default=5, help='Files dumped per test phase')
+    parser.add_argument('--store', choices=['memory', 'sqlite'], default=None,
+                        help='Run only one store in this process')
+    args = parser.parse_args()
+
+    if args.store:
+        run(args.store, args.tests, args.files)
+        return
+
+    for store in ('memory', 'sqlite'):
+        # A fresh process for every store, so the max RSS is its own
+        output = subprocess.check_output(
+            [sys.executable, __file__, '--store', store, '--tests', str(args.tests),
+             '--files', str(args.files)])
+        result = json.loads(output.strip().splitlines()[-1])
+        print('{store}: {tests} tests ({passed} passed) in {elapsed:.1f}s, '
+              'hook latency avg {avg_latency_ms:.2f}ms p99 {p99_latency_ms:.2f}ms, '
+              'max RSS {max_rss_mb:.1f}MB'.format(**result))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -16,6 +16,7 @@ from appliances.models import (
 from appliances.tasks import (
     appliance_power_on, appliance_power_off, appliance_suspend, appliance_rename,
     connect_direct_lun, disconnect_direct_lun, mark_appliance_ready, wait_appliance_ready)
+from sprout import lease
 from sprout.log import create_logger
 
 
@@ -23,30 +24,42 @@ def json_response(data):
     return HttpResponse(json.dumps(data), content_type="application/json")
 
 
-def json_exception(e):
-    return json_response({
+def exception_result(e):
+    return {
         "status": "exception",
         "result": {
             "class": type(e).__name__,
             "message": str(e)
         }
-    })
+    }
 
 
-def json_autherror(message):
-    return json_response({
+def autherror_result(message):
+    return {
         "status": "autherror",
         "result": {
             "message": str(message)
         }
-    })
+    }
 
 
-def json_success(result):
-    return json_response({
+def success_result(result):
+    return {
         "status": "success",
         "result": result
-    })
+    }
+
+
+def json_exception(e):
+    return json_response(exception_result(e))
+
+
+def json_autherror(message):
+    return json_response(autherror_result(message))
+
+
+def json_success(result):
+    return json_response(success_result(result))
 
 
 class JSONMethod(object):
@@ -101,6 +114,12 @@ class JSONApi(object):
         return render(request, 'appliances/apidoc.html', {})
 
     def __call__(self, request):
+        """Calls a method, or more of them when the request contains ``batch``.
+
+        A batch request is ``{"batch": [{"method": ..., "args": ..., "kwargs": ...}, ...]}`` with
+        an optional ``auth`` shared by the calls. The calls are executed in order, the result is
+        the list of their responses, each of them the same as if the method was called alone.
+        """
         if request.method != 'POST':
             return json_success({
                 "available_methods": sorted(
@@ -109,6 +128,16 @@ class JSONApi(object):
             })
         try:
             data = json.loads(request.body)
+        except ValueError as e:
+            return json_exception(e)
+        caller = _Caller(data.get("auth"), get_ip(request))
+        if "batch" in data:
+            return json_success([self._call(call, caller) for call in data["batch"]])
+        return json_response(self._call(data, caller))
+
+    def _call(self, data, caller):
+        method = None
+        try:
             method_name = data["method"]
             args = data["args"]
             kwargs = data["kwargs"]
@@ -116,31 +145,50 @@ class JSONApi(object):
                 method = self._methods[method_name]
             except KeyError:
                 raise NameError("Method {} not found!".format(method_name))
-            ipaddr = get_ip(request)
             create_logger(method).info(
-                "Calling with parameters {!r}{!r} from {!r}".format(tuple(args), kwargs, ipaddr))
+                "Calling with parameters {!r}{!r} from {!r}".format(
+                    tuple(args), kwargs, caller.ipaddr))
             if method.auth:
-                if "auth" in data:
-                    username, password = data["auth"]
-                    try:
-                        user = User.objects.get(username=username)
-                    except ObjectDoesNotExist:
-                        return json_autherror("User {} does not exist!".format(username))
-                    if not user.check_password(password):
-                        return json_autherror("Wrong password for user {}!".format(username))
-                    create_logger(method).info(
-                        "Called by user {}/{}".format(user.id, user.username))
-                    return json_success(method(user, *args, **kwargs))
-                else:
-                    return json_autherror("Method {} needs authentication!".format(method_name))
+                if caller.auth is None:
+                    return autherror_result("Method {} needs authentication!".format(method_name))
+                user, error = caller.authenticate()
+                if user is None:
+                    return autherror_result(error)
+                create_logger(method).info(
+                    "Called by user {}/{}".format(user.id, user.username))
+                return success_result(method(user, *args, **kwargs))
             else:
-                return json_success(method(*args, **kwargs))
+                return success_result(method(*args, **kwargs))
         except Exception as e:
-            create_logger(method).error(
+            create_logger(method or self).error(
                 "Exception raised during call: {}: {}".format(type(e).__name__, str(e)))
-            return json_exception(e)
-        else:
-            create_logger(method).info("Call finished")
+            return exception_result(e)
+        finally:
+            if method is not None:
+                create_logger(method).info("Call finished")
+
+
+class _Caller(object):
+    """Who calls the API, the user is authenticated once for all the calls of a request."""
+    def __init__(self, auth, ipaddr):
+        self.auth = auth
+        self.ipaddr = ipaddr
+        self._authenticated = None
+
+    def authenticate(self):
+        """Returns ``(user, None)``, or ``(None, error message)`` if the auth is wrong."""
+        if self._authenticated is None:
+            username, password = self.auth
+            try:
+                user = User.objects.get(username=username)
+            except ObjectDoesNotExist:
+                self._authenticated = None, "User {} does not exist!".format(username)
+            else:
+                if not user.check_password(password):
+                    self._authenticated = None, "Wrong password for user {}!".format(username)
+                else:
+                    self._authenticated = user, None
+        return self._authenticated
 
 
 jsonapi = JSONApi()
@@ -241,9 +289,7 @@ def request_appliances(
         container, ram, cpu).id
 
 
-@jsonapi.authenticated_method
-def request_check(user, request_id):
-    """Return status of the appliance pool"""
+def pool_status(user, request_id):
     request = AppliancePool.objects.get(id=request_id)
     if user != request.owner and not user.is_staff:
         raise Exception("This pool belongs to a different user!")
@@ -261,6 +307,12 @@ def request_check(user, request_id):
     }
 
 
+@jsonapi.authenticated_method
+def request_check(user, request_id):
+    """Return status of the appliance pool"""
+    return pool_status(user, request_id)
+
+
 @jsonapi.authenticated_method
 def prolong_appliance_lease(user, id, minutes=60):
     """Prolongs the appliance's lease time by specified amount of minutes from current time."""
@@ -288,6 +340,16 @@ def destroy_pool(user, id):
     pool.kill()
 
 
+@jsonapi.method
+def task_metrics():
+    """Returns the counters of the singleton tasks.
+
+    Per task name: published, deduplicated, started, run and skipped tasks, the time spent
+    waiting for the lease, the queue depth and the skip rate.
+    """
+    return lease.task_metrics.all()
+
+
 @jsonapi.method
 def pool_exists(id):
     """Check whether pool does exist"""
@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+"""Measures the read and update throughput of the object metadata.
+
+Compares the old way (YAML parsed on every read, the whole document rewritten under the critical
+section) with the JSON metadata (parsed once per instance, single keys updated in place) on
+temporary groups, which are deleted afterwards. The column only takes JSON on PostgreSQL, so the
+YAML documents are kept in memory, while the rows are still locked, read and written as before::
+
+    ./manage.py benchmark_metadata --objects 50 --reads 200 --updates 20
+"""
+import json
+import time
+
+import yaml
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from appliances.models import Group
+
+PREFIX = 'benchmark-metadata-'
+DOCUMENT = {
+    'templates': ['cfme-{}-template'.format(i) for i in range(100)],
+    'template_name_length': 64,
+    'provider_data': {'ipaddress': '10.0.0.1', 'type': 'openstack', 'tenant': 'qe'},
+}
+
+# YAML text of the objects' metadata by primary key, what object_meta_data held before
+yaml_documents = {}
+
+
+def yaml_read(obj):
+    return yaml.load(yaml_documents[obj.pk])
+
+
+def yaml_update(obj, key, value):
+    with transaction.atomic():
+        with obj.metadata_lock:
+            o = type(obj).objects.get(pk=obj.pk)
+            metadata = yaml.load(yaml_documents[o.pk])
+            metadata[key] = value
+            yaml_documents[o.pk] = yaml.dump(metadata)
+            o.object_meta_data = json.dumps(metadata)
+            o.save()
+    obj.reload()
+
+
+def json_read(obj):
+    return obj.metadata
+
+
+def json_update(obj, key, value):
+    obj.set_metadata(key, value)
+
+
+class Command(BaseCommand):
+    help = 'Benchmarks the read and update throughput of the object metadata.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--objects', type=int, default=50, help='Number of objects')
+        parser.add_argument('--reads', type=int, default=200, help='Metadata reads per object')
+        parser.add_argument('--updates', type=int, default=20, help='Key updates per object')
+
+    def handle(self, *args, **options):
+        groups = []
+        for i in range(options['objects']):
+            group = Group(id='{}{}'.format(PREFIX, i))
+            group.object_meta_data = json.dumps(DOCUMENT)
+            group.save()
+            groups.append(group)
+        try:
+            for name, read, update in [
+                    ('yaml', yaml_read, yaml_update),
+                    ('json', json_read, json_update)]:
+                for group in groups:
+                    yaml_documents[group.pk] = yaml.dump(DOCUMENT)
+                    group.object_meta_data = json.dumps(DOCUMENT)
+                    group.save()
+                    group.reload()
+                reads = self.measure(
+                    groups, options['reads'], lambda group, i: read(group)['templates'])
+                updates = self.measure(
+                    groups, options['updates'], lambda group, i: update(group, 'counter', i))
+                self.stdout.write('{}: {:.0f} reads/s, {:.0f} updates/s'.format(
+                    name, reads, updates))
+        finally:
+            Group.objects.filter(id__startswith=PREFIX).delete()
+
+    @staticmethod
+    def measure(groups, repeat, fn):
+        start = time.time()
+        for group in groups:
+            for i in range(repeat):
+                fn(group, i)
+        return len(groups) * repeat / (time.time() - start)
@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import json
+
+import yaml
+from django.db import migrations
+
+import appliances.models
+
+METADATA_MODELS = [
+    'Appliance', 'AppliancePool', 'DelayedProvisionTask', 'Group', 'GroupShepherd', 'Provider',
+    'Template']
+
+
+def metadata_rows(apps, schema_editor):
+    for model_name in METADATA_MODELS:
+        model = apps.get_model('appliances', model_name)
+        objects = model.objects.using(schema_editor.connection.alias)
+        for pk, raw in list(objects.values_list('pk', 'object_meta_data')):
+            yield objects.filter(pk=pk), raw
+
+
+def yaml_to_json(apps, schema_editor):
+    for row, raw in metadata_rows(apps, schema_editor):
+        try:
+            json.loads(raw)
+        except ValueError:
+            # Values YAML has and JSON has not (dates) are stored as strings
+            row.update(object_meta_data=json.dumps(yaml.load(raw) or {}, default=str))
+
+
+def json_to_yaml(apps, schema_editor):
+    for row, raw in metadata_rows(apps, schema_editor):
+        row.update(object_meta_data=yaml.dump(raw if isinstance(raw, dict) else json.loads(raw)))
+
+
+def alter_metadata_field(model_name):
+    return migrations.AlterField(
+        model_name=model_name,
+        name='object_meta_data',
+        field=appliances.models.MetadataField(default='{}'),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('appliances', '0039_auto_20170403_0918'),
+    ]
+
+    # The rows have to be valid JSON before the column is turned into jsonb on PostgreSQL, and
+    # back to text before they are turned back into YAML
+    operations = [migrations.RunPython(yaml_to_json, json_to_yaml)] + [
+        alter_metadata_field(model_name.lower()) for model_name in METADATA_MODELS]
@@ -0,0 +1,31 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('appliances', '0040_metadata_json'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserUsage',
+            fields=[
+                ('id', models.AutoField(
+                    auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('num_appliances', models.IntegerField(default=0)),
+                ('num_pools', models.IntegerField(default=0)),
+                ('refreshed_on', models.DateTimeField(default=django.utils.timezone.now)),
+                ('user', models.OneToOneField(
+                    on_delete=django.db.models.deletion.CASCADE, related_name='usage',
+                    to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+    ]
@@ -1,5 +1,6 @@
 # -*- coding: utf-8 -*-
 import base64
+import json
 import re
 import yaml
 
@@ -14,15 +15,17 @@ from cached_property import cached_property
 from celery import chain
 from contextlib import contextmanager
 from datetime import timedelta, date
+from uuid import uuid4
 from django.contrib.auth.models import User, Group as DjangoGroup
+from django.core.cache import cache
 from django.core.exceptions import ObjectDoesNotExist
-from django.db import models, transaction
-from django.db.models import Q
-from django.db.models.signals import pre_save
+from django.db import connection, models, transaction
+from django.db.models import Case, Count, F, Q, Value, When
+from django.db.models.signals import post_delete, post_init, post_save, pre_save
 from django.dispatch import receiver
 from django.utils import timezone
 
-from sprout import critical_section, redis
+from sprout import critical_section, redis, redis_client
 from sprout.log import create_logger
 
 from utils.appliance import Appliance as CFMEAppliance, IPAppliance
@@ -57,10 +60,36 @@ def apply_if_not_none(o, meth, *args, **kwargs):
     return getattr(o, meth)(*args, **kwargs)
 
 
+def parse_metadata(raw):
+    """Parses the stored metadata. Rows not migrated to JSON yet are still read as YAML."""
+    if isinstance(raw, dict):
+        return raw
+    try:
+        return json.loads(raw)
+    except ValueError:
+        return yaml.load(raw)
+
+
+class MetadataField(models.TextField):
+    """Metadata stored as JSON, in a ``jsonb`` column on PostgreSQL and as text elsewhere.
+
+    The value is the JSON text, or a dict when the database driver already decoded the ``jsonb``.
+    """
+    def db_type(self, connection):
+        if connection.vendor == 'postgresql':
+            return 'jsonb'
+        return super(MetadataField, self).db_type(connection)
+
+    def get_prep_value(self, value):
+        if isinstance(value, dict):
+            return json.dumps(value)
+        return super(MetadataField, self).get_prep_value(value)
+
+
 class MetadataMixin(models.Model):
     class Meta:
         abstract = True
-    object_meta_data = models.TextField(default=yaml.dump({}))
+    object_meta_data = MetadataField(default=json.dumps({}))
     created_on = models.DateTimeField(default=timezone.now, editable=False)
     modified_on = models.DateTimeField(default=timezone.now)
 
@@ -71,6 +100,36 @@ class MetadataMixin(models.Model):
             self.modified_on = timezone.now()
         return super(MetadataMixin, self).save(*args, **kwargs)
 
+    @classmethod
+    def bulk_save(cls, objects, fields, batch_size=100):
+        """Saves the fields of many objects with one UPDATE per batch, in one transaction.
+
+        Every row gets its own values through a ``CASE`` on the primary key, ``modified_on`` is
+        set the same way :py:meth:`save` does it. No ``pre_save``/``post_save`` signals are sent,
+        the caller has to do what their receivers would (e.g. waking up the delayed provisioning
+        tasks).
+
+        Returns: Number of rows updated.
+        """
+        objects = list(objects)
+        fields = list(fields)
+        now = timezone.now()
+        updated = 0
+        with transaction.atomic():
+            for i in range(0, len(objects), batch_size):
+                batch = objects[i:i + batch_size]
+                values = {'modified_on': now}
+                for name in fields:
+                    field = cls._meta.get_field(name)
+                    values[name] = Case(
+                        *[When(pk=obj.pk, then=Value(getattr(obj, name), output_field=field))
+                          for obj in batch],
+                        output_field=field)
+                updated += cls.objects.filter(pk__in=[obj.pk for obj in batch]).update(**values)
+        for obj in objects:
+            obj.modified_on = now
+        return updated
+
     @property
     def age(self):
         return timezone.now() - self.created_on
@@ -85,21 +144,48 @@ class MetadataMixin(models.Model):
         with critical_section("metadata-({})[{}]".format(type(self).__name__, str(self.pk))):
             yield
 
+    @property
+    @contextmanager
+    def _metadata_row_lock(self):
+        """Locks the row for the metadata change, the critical section only if the DB cannot."""
+        if connection.features.has_select_for_update:
+            list(type(self).objects.select_for_update().filter(pk=self.pk).values_list('pk'))
+            yield
+        else:
+            with self.metadata_lock:
+                yield
+
     @property
     def metadata(self):
-        return yaml.load(self.object_meta_data)
+        """The parsed metadata, cached until ``object_meta_data`` changes. Do not modify it, use
+        :py:meth:`set_metadata`, :py:meth:`delete_metadata` or :py:attr:`edit_metadata`."""
+        raw = self.object_meta_data
+        cached = self.__dict__.get('_metadata_cache')
+        if cached is None or cached[0] is not raw:
+            cached = self._metadata_cache = (raw, parse_metadata(raw))
+        return cached[1]
 
     @metadata.setter
     def metadata(self, value):
         if not isinstance(value, dict):
             raise TypeError("You can store only dict in metadata!")
-        self.object_meta_data = yaml.dump(value)
+        self.object_meta_data = json.dumps(value)
+
+    def _store_metadata(self, metadata):
+        """Writes just the metadata column of the row and updates this instance."""
+        modified_on = timezone.now()
+        raw = json.dumps(metadata)
+        type(self).objects.filter(pk=self.pk).update(
+            object_meta_data=raw, modified_on=modified_on)
+        self.object_meta_data = raw
+        self.modified_on = modified_on
+        self._metadata_cache = (raw, metadata)
 
     @property
     @contextmanager
     def edit_metadata(self):
         with transaction.atomic():
-            with self.metadata_lock:
+            with self._metadata_row_lock:
                 o = type(self).objects.get(pk=self.pk)
                 metadata = o.metadata
                 yield metadata
@@ -107,6 +193,50 @@ class MetadataMixin(models.Model):
                 o.save()
         self.reload()
 
+    def set_metadata(self, key, value):
+        """Atomically sets a single key of the metadata, without rewriting the others."""
+        self._update_metadata_key(key, value)
+
+    def delete_metadata(self, key):
+        """Atomically removes a single key of the metadata, if present."""
+        self._update_metadata_key(key, delete=True)
+
+    def _update_metadata_key(self, key, value=None, delete=False):
+        if connection.vendor == 'postgresql':
+            # The update is done by PostgreSQL on the jsonb document, in a single statement
+            table = connection.ops.quote_name(self._meta.db_table)
+            pk_column = connection.ops.quote_name(self._meta.pk.column)
+            modified_on = timezone.now()
+            with connection.cursor() as cursor:
+                if delete:
+                    cursor.execute(
+                        'UPDATE {} SET object_meta_data = object_meta_data - %s, modified_on = %s '
+                        'WHERE {} = %s RETURNING object_meta_data'.format(table, pk_column),
+                        [key, modified_on, self.pk])
+                else:
+                    cursor.execute(
+                        'UPDATE {} SET object_meta_data = jsonb_set(object_meta_data, %s, '
+                        '%s::jsonb), modified_on = %s WHERE {} = %s '
+                        'RETURNING object_meta_data'.format(table, pk_column),
+                        [[key], json.dumps(value), modified_on, self.pk])
+                row = cursor.fetchone()
+            if row is not None:
+                self.object_meta_data = row[0]
+                self.modified_on = modified_on
+            return
+        with transaction.atomic():
+            with self._metadata_row_lock:
+                metadata = parse_metadata(
+                    type(self).objects.filter(pk=self.pk).values_list(
+                        'object_meta_data', flat=True).get())
+                if delete:
+                    if key not in metadata:
+                        return
+                    del metadata[key]
+                else:
+                    metadata[key] = value
+                self._store_metadata(metadata)
+
     @property
     def logger(self):
         return create_logger(self)
@@ -127,6 +257,57 @@ class DelayedProvisionTask(MetadataMixin):
             self.id, self.pool.id, self.lease_time,
             self.provider_to_avoid.id if self.provider_to_avoid is not None else "---")
 
+    #: Set while there are delayed tasks, wake-ups without any are not worth a task
+    PENDING_KEY = 'delayed-provision-pending'
+    #: Set by every wake-up, a running processing goes again if it is set meanwhile
+    WAKE_KEY = 'delayed-provision-wake'
+
+    @classmethod
+    def wake(cls, pending=False):
+        """Has the delayed tasks processed, because the capacity they wait for might have changed.
+
+        Does nothing if there are no delayed tasks, unless ``pending`` says a new one was created.
+        Waking up more times while the processing is queued publishes it only once.
+        """
+        if pending:
+            redis_client.set(cls.PENDING_KEY, 1)
+        elif not redis_client.exists(cls.PENDING_KEY):
+            return
+        from appliances.tasks import process_delayed_provision_tasks
+        redis_client.set(cls.WAKE_KEY, 1)
+        process_delayed_provision_tasks.delay()
+
+    @classmethod
+    def wake_on_commit(cls, pending=False):
+        """:py:meth:`wake` once the current transaction commits and the changes are visible."""
+        transaction.on_commit(lambda: cls.wake(pending))
+
+
+@receiver(post_save, sender=DelayedProvisionTask)
+def delayed_provision_task_created(sender, instance, created, **kwargs):
+    if created:
+        DelayedProvisionTask.wake_on_commit(pending=True)
+
+
+class ProviderQuerySet(models.QuerySet):
+    def with_load(self):
+        """Annotates the providers with the numbers their load is computed from.
+
+        All of them are counted by a single query, the load properties of the returned providers
+        use them instead of querying on their own.
+        """
+        appliance = 'provider_templates__appliance'
+        provisioning = Q(**{
+            appliance + '__ready': False, appliance + '__marked_for_deletion': False,
+            appliance + '__ip_address': None})
+        return self.annotate(
+            load_provisioning=Count(
+                Case(When(provisioning, then=appliance + '__id')), distinct=True),
+            load_managing=Count(appliance + '__id', distinct=True),
+            load_preparing=Count(
+                Case(When(provider_templates__ready=False, then='provider_templates__id')),
+                distinct=True))
+
 
 class Provider(MetadataMixin):
     id = models.CharField(max_length=32, primary_key=True, help_text="Provider's key in YAML.")
@@ -160,6 +341,8 @@ class Provider(MetadataMixin):
     custom_memory_limit = models.IntegerField(null=True, blank=True)
     custom_cpu_limit = models.IntegerField(null=True, blank=True)
 
+    objects = ProviderQuerySet.as_manager()
+
     class Meta:
         ordering = ['id']
 
@@ -196,13 +379,17 @@ class Provider(MetadataMixin):
 
     @property
     def num_currently_provisioning(self):
-        return len(
-            Appliance.objects.filter(
-                ready=False, marked_for_deletion=False, template__provider=self, ip_address=None))
+        if hasattr(self, 'load_provisioning'):
+            return self.load_provisioning
+        return Appliance.objects.filter(
+            ready=False, marked_for_deletion=False, template__provider=self,
+            ip_address=None).count()
 
     @property
     def num_templates_preparing(self):
-        return len(Template.objects.filter(provider=self, ready=False))
+        if hasattr(self, 'load_preparing'):
+            return self.load_preparing
+        return Template.objects.filter(provider=self, ready=False).count()
 
     @property
     def remaining_configuring_slots(self):
@@ -222,7 +409,9 @@ class Provider(MetadataMixin):
 
     @property
     def num_currently_managing(self):
-        return len(Appliance.objects.filter(template__provider=self))
+        if hasattr(self, 'load_managing'):
+            return self.load_managing
+        return Appliance.objects.filter(template__provider=self).count()
 
     @property
     def currently_managed_appliances(self):
@@ -246,6 +435,12 @@ class Provider(MetadataMixin):
     def free(self):
         return self.remaining_provisioning_slots > 0
 
+    @property
+    def capacity_state(self):
+        """What the number of appliances the provider can take depends on, besides the load."""
+        return (
+            self.working, self.disabled, self.num_simultaneous_provisioning, self.appliance_limit)
+
     @property
     def provisioning_load(self):
         if self.num_simultaneous_provisioning == 0:
@@ -288,8 +483,7 @@ class Provider(MetadataMixin):
 
     @templates.setter
     def templates(self, value):
-        with self.edit_metadata as metadata:
-            metadata["templates"] = value
+        self.set_metadata("templates", value)
 
     @property
     def template_name_length(self):
@@ -297,8 +491,7 @@ class Provider(MetadataMixin):
 
     @template_name_length.setter
     def template_name_length(self, value):
-        with self.edit_metadata as metadata:
-            metadata["template_name_length"] = value
+        self.set_metadata("template_name_length", value)
 
     @property
     def appliances_manage_this_provider(self):
@@ -306,8 +499,7 @@ class Provider(MetadataMixin):
 
     @appliances_manage_this_provider.setter
     def appliances_manage_this_provider(self, value):
-        with self.edit_metadata as metadata:
-            metadata["appliances_manage_this_provider"] = value
+        self.set_metadata("appliances_manage_this_provider", value)
 
     @property
     def g_appliances_manage_this_provider(self):
@@ -317,20 +509,50 @@ class Provider(MetadataMixin):
             except ObjectDoesNotExist:
                 continue
 
+    @staticmethod
+    def usage_counts(**filters):
+        """Counts the appliances of every user on every provider by a single grouped query.
+
+        Args:
+            **filters: Filters of the counted appliances
+        Returns: :py:class:`list` of ``(provider id, user id, number of appliances)``
+        """
+        return list(
+            Appliance.objects.filter(appliance_pool__owner__isnull=False, **filters)
+            .values_list('template__provider', 'appliance_pool__owner')
+            .annotate(Count('id')).order_by())
+
+    @staticmethod
+    def users_by_count(counts, users=None):
+        """Turns :py:class:`dict` of user id to count to ``(user, count)`` sorted by the count.
+
+        The users are loaded unless given as :py:class:`dict` of user id to user.
+        """
+        if users is None:
+            users = User.objects.in_bulk(list(counts))
+        result = [(users[user_id], count) for user_id, count in counts.items()]
+        result.sort(key=lambda item: item[1], reverse=True)
+        return result
+
+    @classmethod
+    def prefetch_user_usage(cls, providers):
+        """Counts the :py:attr:`user_usage` of all the providers at once, returns the providers."""
+        providers = list(providers)
+        counts = {provider.id: {} for provider in providers}
+        for provider_id, user_id, count in cls.usage_counts(
+                template__provider__in=[provider.id for provider in providers]):
+            counts[provider_id][user_id] = count
+        users = User.objects.in_bulk(
+            {user_id for provider_counts in counts.values() for user_id in provider_counts})
+        for provider in providers:
+            provider._user_usage = cls.users_by_count(counts[provider.id], users)
+        return providers
+
     @property
     def user_usage(self):
-        per_user_usage = {}
-        for appliance in Appliance.objects.filter(template__provider=self):
-            if appliance.owner is None:
-                continue
-            owner = appliance.owner
-            if owner not in per_user_usage:
-                per_user_usage[owner] = 1
-            else:
-                per_user_usage[owner] += 1
-        per_user_usage = per_user_usage.items()
-        per_user_usage.sort(key=lambda item: item[1], reverse=True)
-        return per_user_usage
+        if getattr(self, '_user_usage', None) is None:
+            self.prefetch_user_usage([self])
+        return self._user_usage
 
     @property
     def free_shepherd_appliances(self):
@@ -339,19 +561,15 @@ class Provider(MetadataMixin):
 
     @classmethod
     def complete_user_usage(cls, user_perspective=None):
-        result = {}
         if user_perspective is None or user_perspective.is_superuser or user_perspective.is_staff:
             perspective_filter = {}
         else:
             perspective_filter = {'user_groups__in': user_perspective.groups.all()}
-        for provider in cls.objects.filter(hidden=False, **perspective_filter):
-            for user, count in provider.user_usage:
-                if user not in result:
-                    result[user] = 0
-                result[user] += count
-        result = result.items()
-        result.sort(key=lambda item: item[1], reverse=True)
-        return result
+        providers = cls.objects.filter(hidden=False, **perspective_filter).values('id')
+        result = {}
+        for _, user_id, count in cls.usage_counts(template__provider__in=providers):
+            result[user_id] = result.get(user_id, 0) + count
+        return cls.users_by_count(result)
 
     def cleanup(self):
         """Put any cleanup tasks that might help the application stability here"""
@@ -394,6 +612,28 @@ def disable_if_hidden(sender, instance, **kwargs):
         instance.disabled = True
 
 
+class ProviderLoad(object):
+    """Snapshot of the load of all providers, taken by a single query.
+
+    Meant to live as long as a request or a task, so that ranking many templates by their
+    providers' load is a lookup instead of a few queries per template. Appliances started while
+    the snapshot is in use are accounted for by :py:meth:`provisioning_started`.
+    """
+    def __init__(self):
+        self.providers = {provider.id: provider for provider in Provider.objects.with_load()}
+
+    def __getitem__(self, provider_id):
+        if provider_id not in self.providers:
+            # Added after the snapshot was taken
+            self.providers[provider_id] = Provider.objects.with_load().get(id=provider_id)
+        return self.providers[provider_id]
+
+    def provisioning_started(self, provider_id):
+        provider = self[provider_id]
+        provider.load_provisioning += 1
+        provider.load_managing += 1
+
+
 class Group(MetadataMixin):
     id = models.CharField(max_length=32, primary_key=True,
         help_text="Group name as trackerbot says. (eg. upstream, downstream-53z, ...)")
@@ -483,18 +723,19 @@ class GroupShepherd(MetadataMixin):
             template__template_group=self.template_group,
             template__provider__user_groups=self.user_group)
 
-    def get_fulfillment_percentage(self, preconfigured):
+    def get_fulfillment_percentage(self, preconfigured, appliances_in_shepherd=None):
         """Return percentage of fulfillment of the group shepherd.
 
         Values between 0-100, can be over 100 if there are more than required.
 
         Args:
             preconfigured: Whether to check the pure ones or configured ones.
+            appliances_in_shepherd: Number of the appliances in the shepherd if already known.
         """
-        appliances_in_shepherd = len(
-            self.appliances.filter(
+        if appliances_in_shepherd is None:
+            appliances_in_shepherd = self.appliances.filter(
                 template__preconfigured=preconfigured, appliance_pool=None,
-                marked_for_deletion=False))
+                marked_for_deletion=False).count()
         wanted_pool_size = (
             self.template_pool_size if preconfigured else self.unconfigured_template_pool_size)
         if wanted_pool_size == 0:
@@ -603,14 +844,11 @@ class Template(MetadataMixin):
 
     @temporary_name.setter
     def temporary_name(self, name):
-        with self.edit_metadata as metadata:
-            metadata["temporary_name"] = name
+        self.set_metadata("temporary_name", name)
 
     @temporary_name.deleter
     def temporary_name(self):
-        with self.edit_metadata as metadata:
-            if "temporary_name" in metadata:
-                del metadata["temporary_name"]
+        self.delete_metadata("temporary_name")
 
     @classmethod
     def get_versions(cls, *filters, **kwfilters):
@@ -640,11 +878,34 @@ class Template(MetadataMixin):
     def ga_version(cls, version):
         return bool(cls.objects.filter(version=version, ga_released=True))
 
+    #: Cache key of :py:meth:`cache_version`
+    CACHE_VERSION_KEY = 'templates-version'
+
+    @classmethod
+    def cache_version(cls):
+        """Changes whenever a template is saved or deleted, for the keys of cached pages."""
+        version = cache.get(cls.CACHE_VERSION_KEY)
+        if version is None:
+            cache.add(cls.CACHE_VERSION_KEY, uuid4().hex, None)
+            version = cache.get(cls.CACHE_VERSION_KEY)
+        return version
+
+    @classmethod
+    def changed(cls):
+        """Changes the :py:meth:`cache_version`, call after updating templates by a queryset."""
+        cache.set(cls.CACHE_VERSION_KEY, uuid4().hex, None)
+
     def __unicode__(self):
         return "{} {}:{} @ {}".format(
             type(self).__name__, self.version, self.name, self.provider.id)
 
 
+@receiver(post_save, sender=Template)
+@receiver(post_delete, sender=Template)
+def templates_changed(sender, **kwargs):
+    Template.changed()
+
+
 class Appliance(MetadataMixin):
     class Meta:
         permissions = (('can_modify_hw', 'Can modify HW configuration'), )
@@ -963,7 +1224,13 @@ class Appliance(MetadataMixin):
         # Then if the appliance is still present in the management system, kill it
         self.logger.info("Deleting from database")
         pool = self.appliance_pool
-        result = super(Appliance, self).delete(*args, **kwargs)
+        with transaction.atomic():
+            if pool is not None:
+                num_counted = pool.num_counted_appliances
+            result = super(Appliance, self).delete(*args, **kwargs)
+            if pool is not None:
+                UserUsage.appliances_changed(
+                    pool.owner, pool.num_counted_appliances - num_counted)
         do_not_touch = kwargs.pop("do_not_touch_ap", False)
         if pool is not None and not do_not_touch:
             if pool.current_count == 0:
@@ -984,6 +1251,12 @@ class Appliance(MetadataMixin):
         else:
             return self.appliance_pool.owner
 
+    @property
+    def capacity_state(self):
+        """What decides whether the appliance takes a provisioning slot or can go to a pool."""
+        return (self.ready, self.ip_address is None, self.marked_for_deletion,
+                self.appliance_pool_id is None)
+
     @property
     def expires_in(self):
         """Minutes"""
@@ -1032,8 +1305,7 @@ class Appliance(MetadataMixin):
 
     @managed_providers.setter
     def managed_providers(self, value):
-        with self.edit_metadata as metadata:
-            metadata["managed_providers"] = value
+        self.set_metadata("managed_providers", value)
 
     @property
     def vnc_link(self):
@@ -1043,6 +1315,27 @@ class Appliance(MetadataMixin):
             return None
 
 
+@receiver(post_init, sender=Provider)
+@receiver(post_init, sender=Appliance)
+def remember_capacity_state(sender, instance, **kwargs):
+    instance._loaded_capacity_state = instance.capacity_state
+
+
+@receiver(post_save, sender=Provider)
+@receiver(post_save, sender=Appliance)
+def wake_if_capacity_changed(sender, instance, **kwargs):
+    """Capacity of a provider changed, or an appliance freed a slot or became free for a pool."""
+    capacity_state = instance.capacity_state
+    if capacity_state != getattr(instance, '_loaded_capacity_state', None):
+        instance._loaded_capacity_state = capacity_state
+        DelayedProvisionTask.wake_on_commit()
+
+
+@receiver(post_delete, sender=Appliance)
+def wake_if_appliance_deleted(sender, **kwargs):
+    DelayedProvisionTask.wake_on_commit()
+
+
 class AppliancePool(MetadataMixin):
     total_count = models.IntegerField(help_text="How many appliances should be in this pool.")
     group = models.ForeignKey(
@@ -1102,12 +1395,16 @@ class AppliancePool(MetadataMixin):
         if self.override_cpu != source_pool.override_cpu:
             raise ValueError('The override_cpu of the pools differ')
 
+        total_count = self.total_count
         with transaction.atomic():
             for appliance in source_pool.appliances:
                 appliance.appliance_pool = self
                 appliance.save()
                 self.total_count += 1
                 self.save()
+            num_moved = self.total_count - total_count
+            UserUsage.appliances_changed(source_pool.owner, -num_moved)
+            UserUsage.appliances_changed(self.owner, num_moved)
             source_pool.delete()
 
         return self
@@ -1133,8 +1430,9 @@ class AppliancePool(MetadataMixin):
             cpu=None):
         container_q = ~Q(container=None) if container else Q(container=None)
         if owner.has_quotas:
-            user_pools_count = cls.objects.filter(owner=owner).count()
-            user_vms_count = Appliance.objects.filter(appliance_pool__owner=owner).count()
+            usage = UserUsage.for_user(owner)
+            user_pools_count = usage.num_pools
+            user_vms_count = usage.num_appliances
             if owner.quotas.total_pool_quota is not None:
                 if owner.quotas.total_pool_quota <= user_pools_count:
                     raise ValueError(
@@ -1190,7 +1488,10 @@ class AppliancePool(MetadataMixin):
         req = cls(**req_params)
         if not req.possible_templates:
             raise Exception("No possible templates! (pool params: {})".format(str(req_params)))
-        req.save()
+        with transaction.atomic():
+            # The pool is counted by a concurrent UserUsage.refresh or added to its result
+            req.save()
+            UserUsage.pool_created(owner, num_appliances)
         cls.class_logger(req.pk).info("Created")
         if num_appliances > 0:
             # Only if we have any appliances to request
@@ -1202,8 +1503,8 @@ class AppliancePool(MetadataMixin):
         with transaction.atomic():
             for task in DelayedProvisionTask.objects.filter(pool=self):
                 task.delete()
-
-        return super(AppliancePool, self).delete(*args, **kwargs)
+            UserUsage.pool_deleted(self.owner, self.num_counted_appliances)
+            return super(AppliancePool, self).delete(*args, **kwargs)
 
     @property
     def container_q(self):
@@ -1247,10 +1548,24 @@ class AppliancePool(MetadataMixin):
 
     @property
     def possible_provisioning_templates(self):
+        return self.get_possible_provisioning_templates()
+
+    def get_possible_provisioning_templates(self, load=None, templates=None):
+        """Templates on free providers, the best match (newest, least loaded provider) first.
+
+        Args:
+            load: :py:class:`ProviderLoad` to rank against, a new one is taken if not passed.
+            templates: :py:attr:`possible_templates` if already loaded
+        """
+        if load is None:
+            load = ProviderLoad()
+        if templates is None:
+            templates = self.possible_templates
         return sorted(
-            filter(lambda tpl: tpl.provider.free, self.possible_templates),
+            [tpl for tpl in templates if load[tpl.provider_id].free],
             # Sort by date and load to pick the best match (least loaded provider)
-            key=lambda tpl: (tpl.date, 1.0 - tpl.provider.appliance_load), reverse=True)
+            key=lambda tpl: (tpl.date, 1.0 - load[tpl.provider_id].appliance_load),
+            reverse=True)
 
     @property
     def possible_providers(self):
@@ -1269,6 +1584,15 @@ class AppliancePool(MetadataMixin):
     def current_count(self):
         return len(self.appliances)
 
+    @property
+    def num_counted_appliances(self):
+        """How many appliances of the pool count in the usage of the owner.
+
+        Until the pool is finished the requested appliances count even if not created yet.
+        """
+        num_appliances = Appliance.objects.filter(appliance_pool=self).count()
+        return num_appliances if self.finished else max(num_appliances, self.total_count)
+
     @property
     def percent_finished(self):
         if self.total_count is None:
@@ -1339,6 +1663,7 @@ class AppliancePool(MetadataMixin):
                             if self.total_count < 0:
                                 self.total_count = 0  # Protection against stupidity
                             self.save()
+                            UserUsage.appliances_changed(self.owner, -1)
                             appliance.set_status(
                                 "The appliance was taken out of dying pool {}".format(self.id))
                         else:
@@ -1391,23 +1716,16 @@ class AppliancePool(MetadataMixin):
 
     @property
     def num_possible_provisioning_slots(self):
-        providers = set([])
-        for template in self.possible_provisioning_templates:
-            providers.add(template.provider)
-        slots = 0
-        for provider in providers:
-            slots += provider.remaining_provisioning_slots
-        return slots
+        load = ProviderLoad()
+        providers = set(
+            tpl.provider_id for tpl in self.get_possible_provisioning_templates(load))
+        return sum(load[provider].remaining_provisioning_slots for provider in providers)
 
     @property
     def num_possible_appliance_slots(self):
-        providers = set([])
-        for template in self.possible_templates:
-            providers.add(template.provider)
-        slots = 0
-        for provider in providers:
-            slots += provider.remaining_appliance_slots
-        return slots
+        load = ProviderLoad()
+        providers = set(tpl.provider_id for tpl in self.possible_templates)
+        return sum(load[provider].remaining_appliance_slots for provider in providers)
 
     @property
     def num_shepherd_appliances(self):
@@ -1440,6 +1758,89 @@ class UserApplianceQuota(models.Model):
     total_vm_quota = models.IntegerField(null=True, blank=True)
 
 
+class UserUsage(models.Model):
+    """Numbers of appliances and pools of a user, read by the quota checks instead of counting.
+
+    All of them are recounted by the ``refresh_user_usage`` task and changed in between by the
+    pools and appliances created, deleted or moved. The appliances of a pool are counted as
+    :py:attr:`AppliancePool.num_counted_appliances`, so the ones requested but still being
+    provisioned count as well.
+    """
+    user = models.OneToOneField(User, related_name="usage", on_delete=models.CASCADE)
+    num_appliances = models.IntegerField(default=0)
+    num_pools = models.IntegerField(default=0)
+    refreshed_on = models.DateTimeField(default=timezone.now)
+
+    @classmethod
+    def count(cls, **filters):
+        """Counts the appliances and pools of the users by one query over the pools.
+
+        Returns: :py:class:`dict` of user id to ``(number of appliances, number of pools)``
+        """
+        pools = AppliancePool.objects.filter(**{
+            'owner__' + key: value for key, value in filters.items()}).annotate(
+                num_appliances=Count('appliance')).values_list(
+                    'owner', 'finished', 'total_count', 'num_appliances').order_by()
+        counts = {}
+        for user_id, finished, total_count, num_appliances in pools:
+            if not finished:
+                # Same as AppliancePool.num_counted_appliances
+                num_appliances = max(num_appliances, total_count)
+            user_appliances, user_pools = counts.get(user_id, (0, 0))
+            counts[user_id] = (user_appliances + num_appliances, user_pools + 1)
+        return counts
+
+    @classmethod
+    def refresh(cls):
+        """Recounts the usage of all users, returns the number of the users with any.
+
+        The rows are locked before counting and updated in place, so a :py:meth:`pool_created`
+        running meanwhile waits for the recount and is added on top of it.
+        """
+        now = timezone.now()
+        with transaction.atomic():
+            usages = {usage.user_id: usage for usage in cls.objects.select_for_update()}
+            counts = cls.count()
+            cls.objects.update(refreshed_on=now)
+            for user_id, (num_appliances, num_pools) in counts.items():
+                usage = usages.get(user_id)
+                if usage is None:
+                    cls.objects.get_or_create(user_id=user_id, defaults={
+                        'num_appliances': num_appliances, 'num_pools': num_pools})
+                elif (usage.num_appliances, usage.num_pools) != (num_appliances, num_pools):
+                    cls.objects.filter(id=usage.id).update(
+                        num_appliances=num_appliances, num_pools=num_pools)
+            cls.objects.exclude(user_id__in=list(counts)).exclude(
+                num_appliances=0, num_pools=0).update(num_appliances=0, num_pools=0)
+        return len(counts)
+
+    @classmethod
+    def for_user(cls, user):
+        """Returns the usage of the user, counted now if there is none yet."""
+        try:
+            return cls.objects.get(user=user)
+        except ObjectDoesNotExist:
+            num_appliances, num_pools = cls.count(id=user.id).get(user.id, (0, 0))
+            usage, _ = cls.objects.get_or_create(
+                user=user, defaults={'num_appliances': num_appliances, 'num_pools': num_pools})
+            return usage
+
+    @classmethod
+    def pool_created(cls, user, num_appliances):
+        cls.objects.filter(user=user).update(
+            num_pools=F('num_pools') + 1, num_appliances=F('num_appliances') + num_appliances)
+
+    @classmethod
+    def pool_deleted(cls, user, num_appliances):
+        cls.objects.filter(user=user).update(
+            num_pools=F('num_pools') - 1, num_appliances=F('num_appliances') - num_appliances)
+
+    @classmethod
+    def appliances_changed(cls, user, difference):
+        if difference:
+            cls.objects.filter(user=user).update(num_appliances=F('num_appliances') + difference)
+
+
 class BugQuery(models.Model):
     EMAIL_PLACEHOLDER = re.compile(r'\{\{EMAIL\}\}')
     CACHE_TIMEOUT = 180
@@ -4,20 +4,23 @@ from __future__ import absolute_import
 import diaper
 import fauxfactory
 import hashlib
+import heapq
 import iso8601
 import random
 import re
+import time
 import command
 import yaml
+from collections import OrderedDict, defaultdict, namedtuple
 from contextlib import closing
-from django.core.cache import cache
 from django.core.exceptions import ObjectDoesNotExist
 from django.core.mail import send_mail
 from django.db import transaction
 from django.db.models import Q
 from django.utils import timezone
-from celery import chain, chord, shared_task
+from celery import Task, chain, chord, shared_task
 from celery.exceptions import MaxRetriesExceededError
+from celery.utils import uuid
 from datetime import datetime, timedelta
 from functools import wraps
 from lxml import etree
@@ -27,10 +30,11 @@ from urllib2 import urlopen, HTTPError
 import socket
 
 from appliances.models import (
-    Provider, Group, Template, Appliance, AppliancePool, DelayedProvisionTask,
-    MismatchVersionMailer, User, GroupShepherd)
-from sprout import settings, redis
+    Provider, ProviderLoad, Group, Template, Appliance, AppliancePool, DelayedProvisionTask,
+    MismatchVersionMailer, User, GroupShepherd, UserUsage)
+from sprout import settings, redis, redis_client
 from sprout.irc_bot import send_message
+from sprout.lease import Lease, delete_if_equal, task_metrics
 from sprout.log import create_logger
 
 from utils import conf
@@ -57,6 +61,8 @@ VERSION_REGEXPS = [
 VERSION_REGEXPS = map(re.compile, VERSION_REGEXPS)
 VERSION_REGEXP_UPSTREAM = re.compile(r'^miq-stable-([^-]+)-')
 TRACKERBOT_PAGINATE = 20
+#: How many times the processing of the delayed provisioning goes again for the wake-ups meanwhile
+DELAYED_PROVISION_ROUNDS = 10
 
 
 def retrieve_cfme_appliance_version(template_name):
@@ -106,8 +112,60 @@ def logged_task(*args, **kwargs):
     return f
 
 
+def task_digest(args, kwargs):
+    """Hash of the task arguments, tells apart the instances of a singleton task."""
+    digest_base = "/".join(str(arg) for arg in args)
+    keys = sorted(kwargs.keys())
+    digest_base += "//" + "/".join("{}={}".format(key, kwargs[key]) for key in keys)
+    return hashlib.sha256(digest_base).hexdigest()
+
+
+#: Options of a publish that is a part of a workflow or a retry, these are never deduplicated
+WORKFLOW_OPTIONS = {'link', 'link_error', 'chord', 'task_id', 'countdown', 'eta'}
+
+
+class SingletonTask(Task):
+    """Base of the singleton tasks, does not publish a task that is already waiting in the queue.
+
+    The id of the queued task is kept in redis until a worker picks it up, publishing the same
+    task with the same arguments meanwhile returns the result of the queued one.
+    """
+    abstract = True
+
+    def queued_key(self, digest):
+        return '{0}-queued-{1}'.format(self.name, digest)
+
+    def apply_async(self, args=None, kwargs=None, **options):
+        queued_key = None
+        if not set(options) & WORKFLOW_OPTIONS:
+            queued_key = self.queued_key(task_digest(args or (), kwargs or {}))
+            options['task_id'] = uuid()
+            if not redis_client.set(queued_key, options['task_id'], nx=True, ex=LOCK_EXPIRE):
+                queued_id = redis_client.get(queued_key)
+                if queued_id is not None:
+                    task_metrics.incr(self.name, 'deduplicated')
+                    return self.AsyncResult(queued_id)
+                redis_client.set(queued_key, options['task_id'], ex=LOCK_EXPIRE)
+        try:
+            result = super(SingletonTask, self).apply_async(args, kwargs, **options)
+        except Exception:
+            if queued_key is not None:
+                delete_if_equal(queued_key, options['task_id'])
+            raise
+        task_metrics.incr(self.name, 'published')
+        return result
+
+
 def singleton_task(*args, **kwargs):
+    """Task that runs only once at a time for the same arguments.
+
+    The running task holds a :py:class:`sprout.lease.Lease`, available as ``self.lease`` for the
+    fencing token. Another instance of the task started meanwhile is skipped, or with ``wait``
+    retried later. Instances already waiting in the queue are not published again, see
+    :py:class:`SingletonTask`.
+    """
     kwargs["bind"] = True
+    kwargs["base"] = SingletonTask
     wait = kwargs.pop('wait', False)
     wait_countdown = kwargs.pop('wait_countdown', 10)
     wait_retries = kwargs.pop('wait_retries', 30)
@@ -116,14 +174,21 @@ def singleton_task(*args, **kwargs):
         @wraps(task)
         def wrapped_task(self, *args, **kwargs):
             self.logger = create_logger(task)
-            # Create hash of all args
-            digest_base = "/".join(str(arg) for arg in args)
-            keys = sorted(kwargs.keys())
-            digest_base += "//" + "/".join("{}={}".format(key, kwargs[key]) for key in keys)
-            digest = hashlib.sha256(digest_base).hexdigest()
-            lock_id = '{0}-lock-{1}'.format(self.name, digest)
-
-            if cache.add(lock_id, 'true', LOCK_EXPIRE):
+            digest = task_digest(args, kwargs)
+            if self.request.id is not None:
+                # Taken from the queue, the same task can be published again
+                task_metrics.incr(self.name, 'started')
+                delete_if_equal(self.queued_key(digest), self.request.id)
+            lease = Lease('{0}-lock-{1}'.format(self.name, digest))
+            wait_key = '{0}-lock-wait-{1}'.format(self.name, self.request.id)
+
+            if lease.acquire():
+                self.lease = lease
+                task_metrics.incr(self.name, 'run')
+                waiting_since = redis_client.get(wait_key) if wait else None
+                if waiting_since is not None:
+                    task_metrics.add_lock_wait(self.name, time.time() - float(waiting_since))
+                    redis_client.delete(wait_key)
                 try:
                     return task(self, *args, **kwargs)
                 except Exception as e:
@@ -133,10 +198,15 @@ def singleton_task(*args, **kwargs):
                     self.logger.exception(e)
                     raise
                 finally:
-                    cache.delete(lock_id)
+                    lease.release()
+                    if lease.lost:
+                        self.logger.warning("The task lost its lease while running.")
             elif wait:
                 self.logger.info("Waiting for another instance of the task to end.")
+                redis_client.set(wait_key, time.time(), nx=True, ex=LOCK_EXPIRE)
                 self.retry(args=args, countdown=wait_countdown, max_retries=wait_retries)
+            else:
+                task_metrics.incr(self.name, 'skipped')
 
         return shared_task(*args, **kwargs)(wrapped_task)
     return f
@@ -597,11 +667,12 @@ def request_appliance_pool(self, appliance_pool_id, time_minutes):
         "Appliance pool {} requested for {} minutes.".format(appliance_pool_id, time_minutes))
     pool = AppliancePool.objects.get(id=appliance_pool_id)
     n = Appliance.give_to_pool(pool)
+    load = ProviderLoad()
     for i in range(pool.total_count - n):
-        tpls = pool.possible_provisioning_templates
+        tpls = pool.get_possible_provisioning_templates(load)
         if tpls:
-            template_id = tpls[0].id
-            clone_template_to_pool(template_id, pool.id, time_minutes)
+            if clone_template_to_pool(tpls[0].id, pool.id, time_minutes) is not None:
+                load.provisioning_started(tpls[0].provider_id)
         else:
             with transaction.atomic():
                 task = DelayedProvisionTask(pool=pool, lease_time=time_minutes)
@@ -643,44 +714,96 @@ def apply_lease_times_after_pool_fulfilled(self, appliance_pool_id, time_minutes
 def process_delayed_provision_tasks(self):
     """This picks up the provisioning tasks that were delayed due to ocncurrency limit of provision.
 
-    Goes one task by one and when some of them can be provisioned, it starts the provisioning and
-    then deletes the task.
+    Woken up by :py:meth:`DelayedProvisionTask.wake` when the capacity of the providers changes,
+    and run periodically in case a wake-up was missed. When woken up again while it runs, it goes
+    again instead of the new wake-up being skipped.
     """
-    for task in DelayedProvisionTask.objects.order_by("id"):
-        if task.pool.not_needed_anymore:
-            task.delete()
-            continue
-        # Try retrieve from shepherd
-        appliances_given = Appliance.give_to_pool(task.pool, 1)
-        if appliances_given == 0:
-            # No free appliance in shepherd, so do it on our own
-            tpls = task.pool.possible_provisioning_templates
-            if task.provider_to_avoid is not None:
-                filtered_tpls = filter(lambda tpl: tpl.provider != task.provider_to_avoid, tpls)
+    for _ in range(DELAYED_PROVISION_ROUNDS):
+        redis_client.delete(DelayedProvisionTask.WAKE_KEY, DelayedProvisionTask.PENDING_KEY)
+        remaining = provision_delayed_tasks(self.logger)
+        if remaining:
+            redis_client.set(DelayedProvisionTask.PENDING_KEY, 1)
+        # Tasks created meanwhile wake it up too, so it goes again even if none were remaining
+        if not redis_client.exists(DelayedProvisionTask.WAKE_KEY):
+            break
+
+
+def provision_delayed_tasks(logger):
+    """Provisions what the delayed tasks wait for, using one snapshot of the providers' load.
+
+    The shepherd is asked first, once per pool for all its tasks. The rest is provisioned from a
+    priority queue of pools, those missing the fewest appliances first and the oldest first among
+    the equal ones, so that the free capacity finishes pools instead of being spread over all of
+    them. A pool leaves the queue when none of its providers has a free slot left, which frees
+    some space in them by killing unused shepherd appliances.
+
+    Returns: Number of the tasks still waiting
+    """
+    load = ProviderLoad()
+    pools = OrderedDict()
+    for task in DelayedProvisionTask.objects.select_related('pool').order_by('id'):
+        pools.setdefault(task.pool_id, []).append(task)
+    done = []
+    queue = []
+    try:
+        for tasks in pools.values():
+            pool = tasks[0].pool
+            if pool.not_needed_anymore:
+                done.extend(tasks)
+                continue
+            # Try retrieve from shepherd
+            appliances_given = Appliance.give_to_pool(pool, len(tasks))
+            done.extend(tasks[:appliances_given])
+            tasks = tasks[appliances_given:]
+            if tasks:
+                heapq.heappush(
+                    queue, (len(tasks), tasks[0].id, pool, tasks, list(pool.possible_templates)))
+
+        while queue:
+            _, _, pool, tasks, templates = heapq.heappop(queue)
+            task = tasks[0]
+            tpls = pool.get_possible_provisioning_templates(load, templates)
+            if not tpls:
+                free_provider_space(logger, pool, templates, len(tasks))
+                continue
+            if task.provider_to_avoid_id is not None:
+                filtered_tpls = filter(
+                    lambda tpl: tpl.provider_id != task.provider_to_avoid_id, tpls)
                 if filtered_tpls:
                     # There are other providers to provision on, so try one of them
                     tpls = filtered_tpls
                 # If there is no other provider to provision on, we will use the original list.
                 # This will cause additional rejects until the provider quota is met
-            if tpls:
-                clone_template_to_pool(tpls[0].id, task.pool.id, task.lease_time)
-                task.delete()
-            else:
-                # Try freeing up some space in provider
-                for provider in task.pool.possible_providers:
-                    appliances = provider.free_shepherd_appliances.exclude(
-                        task.pool.appliance_container_q,
-                        **task.pool.appliance_filter_params)
-                    if appliances:
-                        appl = random.choice(appliances)
-                        self.logger.info(
-                            'Freeing some space in provider by killing appliance {}/{}'
-                            .format(appl.id, appl.name))
-                        Appliance.kill(appl)
-                        break  # Just one
-        else:
-            # There was a free appliance in shepherd, so we took it and we don't need this task more
-            task.delete()
+            if clone_template_to_pool(tpls[0].id, pool.id, task.lease_time) is not None:
+                load.provisioning_started(tpls[0].provider_id)
+            done.append(task)
+            tasks = tasks[1:]
+            if tasks:
+                heapq.heappush(queue, (len(tasks), tasks[0].id, pool, tasks, templates))
+    finally:
+        DelayedProvisionTask.objects.filter(id__in=[task.id for task in done]).delete()
+    return sum(len(tasks) for tasks in pools.values()) - len(done)
+
+
+def free_provider_space(logger, pool, templates, num_appliances):
+    """Kills unused shepherd appliances in the pool's providers to make space for its appliances.
+
+    Shepherd appliances already being killed there count as the space being freed, so waking up
+    more times before they are gone does not kill any more.
+    """
+    shepherd = Appliance.objects.filter(
+        template__provider__in={tpl.provider_id for tpl in templates}, appliance_pool=None)
+    num_appliances -= shepherd.filter(marked_for_deletion=True).count()
+    if num_appliances <= 0:
+        return
+    appliances = list(
+        shepherd.filter(marked_for_deletion=False, ready=True).exclude(
+            pool.appliance_container_q, **pool.appliance_filter_params))
+    random.shuffle(appliances)
+    for appl in appliances[:num_appliances]:
+        logger.info(
+            'Freeing some space in provider by killing appliance {}/{}'.format(appl.id, appl.name))
+        Appliance.kill(appl)
 
 
 @logged_task()
@@ -718,6 +841,7 @@ def clone_template_to_pool(template_id, appliance_pool_id, time_minutes):
         pool.date = template.date
         pool.save()
     clone_template_to_appliance.delay(appliance.id, time_minutes, pool.yum_update)
+    return appliance
 
 
 @logged_task()
@@ -1064,6 +1188,11 @@ def refresh_appliances(self):
         refresh_appliances_provider.delay(provider.id)
 
 
+#: Fields of :py:class:`Appliance` that :py:func:`refresh_appliances_provider` may change
+REFRESHED_APPLIANCE_FIELDS = (
+    'name', 'uuid', 'ip_address', 'power_state', 'power_state_changed', 'swap', 'ssh_failed')
+
+
 @singleton_task(soft_time_limit=180)
 def refresh_appliances_provider(self, provider_id):
     """Downloads the list of VMs from the provider, then matches them by name or UUID with
@@ -1081,7 +1210,14 @@ def refresh_appliances_provider(self, provider_id):
         dict_vms[vm.name] = vm
         if vm.uuid:
             uuid_vms[vm.uuid] = vm
+    # Reconcile in memory, only the appliances that changed get written
+    changed = []
+    changed_fields = set()
+    capacity_changed = False
+    counts = {'renamed': 0, 'uuid': 0, 'ip_address': 0, 'power_state': 0, 'orphaned': 0}
     for appliance in Appliance.objects.filter(template__provider=provider):
+        before = {field: getattr(appliance, field) for field in REFRESHED_APPLIANCE_FIELDS}
+        capacity_before = appliance.capacity_state
         if appliance.uuid is not None and appliance.uuid in uuid_vms:
             vm = uuid_vms[appliance.uuid]
             # Using the UUID and change the name if it changed
@@ -1089,7 +1225,6 @@ def refresh_appliances_provider(self, provider_id):
             appliance.ip_address = vm.ip
             appliance.set_power_state(Appliance.POWER_STATES_MAPPING.get(
                 vm.power_state, Appliance.Power.UNKNOWN))
-            appliance.save()
         elif appliance.name in dict_vms:
             vm = dict_vms[appliance.name]
             # Using the name, and then retrieve uuid
@@ -1097,13 +1232,40 @@ def refresh_appliances_provider(self, provider_id):
             appliance.ip_address = vm.ip
             appliance.set_power_state(Appliance.POWER_STATES_MAPPING.get(
                 vm.power_state, Appliance.Power.UNKNOWN))
-            appliance.save()
-            self.logger.info("Retrieved UUID for appliance {}/{}: {}".format(
-                appliance.id, appliance.name, appliance.uuid))
+            if appliance.uuid != before['uuid']:
+                self.logger.info("Retrieved UUID for appliance {}/{}: {}".format(
+                    appliance.id, appliance.name, appliance.uuid))
         else:
             # Orphaned :(
             appliance.set_power_state(Appliance.Power.ORPHANED)
-            appliance.save()
+        fields = {
+            field for field, value in before.iteritems() if getattr(appliance, field) != value}
+        if not fields:
+            continue
+        changed.append(appliance)
+        changed_fields.update(fields)
+        capacity_changed = capacity_changed or appliance.capacity_state != capacity_before
+        if 'name' in fields:
+            counts['renamed'] += 1
+        if 'uuid' in fields:
+            counts['uuid'] += 1
+        if 'ip_address' in fields:
+            counts['ip_address'] += 1
+        if 'power_state' in fields:
+            if appliance.power_state == Appliance.Power.ORPHANED:
+                counts['orphaned'] += 1
+            else:
+                counts['power_state'] += 1
+    if changed:
+        Appliance.bulk_save(changed, changed_fields)
+    if capacity_changed:
+        # bulk_save sends no post_save, which would wake the delayed tasks up
+        DelayedProvisionTask.wake_on_commit()
+    self.logger.info(
+        "Refreshed appliances in {}: {} changed ({renamed} renamed, {uuid} UUIDs retrieved, "
+        "{ip_address} IP changes, {power_state} power state changes, {orphaned} orphaned)".format(
+            provider_id, len(changed), **counts))
+    return counts
 
 
 @singleton_task()
@@ -1126,38 +1288,38 @@ def check_templates_in_provider(self, provider_id):
     else:
         provider.working = True
         provider.save()
-        with provider.edit_metadata as metadata:
-            metadata["templates"] = templates
+        provider.templates = templates
     if not provider.working:
         return
-    # Check Sprout template existence
-    # expiration_time = (timezone.now() - timedelta(**settings.BROKEN_APPLIANCE_GRACE_TIME))
-    for template in Template.objects.filter(provider=provider):
+    # Check Sprout template existence against the listing, all changes are applied at once
+    templates = set(templates)
+    appear, disappear = [], []
+    for template_id, name, exists in Template.objects.filter(provider=provider).values_list(
+            'id', 'name', 'exists'):
+        if name in templates and not exists:
+            appear.append(template_id)
+        elif name not in templates and exists:
+            disappear.append(template_id)
+    if appear or disappear:
+        now = timezone.now()
         with transaction.atomic():
-            tpl = Template.objects.get(pk=template.pk)
-            exists = tpl.name in templates
-            tpl.exists = exists
-            tpl.save()
-        # if not exists:
-        #     if len(Appliance.objects.filter(template=template).all()) == 0\
-        #             and template.status_changed < expiration_time:
-        #         # No other appliance is made from this template so no need to keep it
-        #         with transaction.atomic():
-        #             tpl = Template.objects.get(pk=template.pk)
-        #             tpl.delete()
+            Template.objects.filter(id__in=appear).update(exists=True, modified_on=now)
+            Template.objects.filter(id__in=disappear).update(exists=False, modified_on=now)
+        Template.changed()
+    self.logger.info("Templates in {}: {} appeared, {} disappeared".format(
+        provider_id, len(appear), len(disappear)))
 
 
 @singleton_task()
 def delete_nonexistent_appliances(self):
     """Goes through orphaned appliances' objects and deletes them from the database."""
     expiration_time = (timezone.now() - timedelta(**settings.ORPHANED_APPLIANCE_GRACE_TIME))
-    for appliance in Appliance.objects.filter(ready=True).all():
-        if appliance.name in redis.renaming_appliances:
-            continue
-        if appliance.power_state == Appliance.Power.ORPHANED:
-            if appliance.power_state_changed > expiration_time:
-                # Ignore it for now
-                continue
+    renaming_appliances = redis.renaming_appliances
+    orphaned = Appliance.objects.filter(
+        ready=True, power_state=Appliance.Power.ORPHANED,
+        power_state_changed__lte=expiration_time).exclude(name__in=renaming_appliances)
+    with transaction.atomic():
+        for appliance in orphaned:
             self.logger.info(
                 "I will delete orphaned appliance {}/{}".format(appliance.id, appliance.name))
             try:
@@ -1174,10 +1336,10 @@ def delete_nonexistent_appliances(self):
     # the garbage. It will be respinned again by shepherd.
     # Grace time is specified in BROKEN_APPLIANCE_GRACE_TIME
     expiration_time = (timezone.now() - timedelta(**settings.BROKEN_APPLIANCE_GRACE_TIME))
-    for appliance in Appliance.objects.filter(ready=False, marked_for_deletion=False).all():
-        if appliance.status_changed < expiration_time:
-            self.logger.info("Killing broken appliance {}/{}".format(appliance.id, appliance.name))
-            Appliance.kill(appliance)  # Use kill because the appliance may still exist
+    for appliance in Appliance.objects.filter(
+            ready=False, marked_for_deletion=False, status_changed__lt=expiration_time):
+        self.logger.info("Killing broken appliance {}/{}".format(appliance.id, appliance.name))
+        Appliance.kill(appliance)  # Use kill because the appliance may still exist
     # And now - if something happened during appliance deletion, call kill again
     for appliance in Appliance.objects.filter(
             marked_for_deletion=True, status_changed__lt=expiration_time).all():
@@ -1186,110 +1348,148 @@ def delete_nonexistent_appliances(self):
         Appliance.kill(appliance, force_delete=True)
 
 
-def generic_shepherd(self, preconfigured):
-    """This task takes care of having the required templates spinned into required number of
-    appliances. For each template group, it keeps the last template's appliances spinned up in
-    required quantity. If new template comes out of the door, it automatically kills the older
-    running template's appliances and spins up new ones. Sorts the groups by the fulfillment."""
-    for gs in sorted(
-            GroupShepherd.objects.all(), key=lambda g: g.get_fulfillment_percentage(preconfigured)):
-        prov_filter = {'provider__user_groups': gs.user_group}
-        group_versions = Template.get_versions(
-            template_group=gs.template_group, ready=True, usable=True, preconfigured=preconfigured,
-            container=None, **prov_filter)
-        group_dates = Template.get_dates(
-            template_group=gs.template_group, ready=True, usable=True, preconfigured=preconfigured,
-            container=None, **prov_filter)
-        if group_versions:
-            # Downstream - by version (downstream releases)
-            version = group_versions[0]
-            # Find the latest date (one version can have new build)
-            dates = Template.get_dates(
-                template_group=gs.template_group, ready=True, usable=True,
-                version=group_versions[0], preconfigured=preconfigured, container=None,
-                **prov_filter)
-            if not dates:
-                # No template yet?
-                continue
-            date = dates[0]
-            filter_keep = {"version": version, "date": date, 'container': None}
-            filters_kill = []
-            for kill_date in dates[1:]:
-                filters_kill.append({"version": version, "date": kill_date})
-            for kill_version in group_versions[1:]:
-                filters_kill.append({"version": kill_version})
-        elif group_dates:
+#: What the shepherd has to do for one group shepherd. ``templates`` are the templates to provision
+#: new appliances from, ``missing`` the number of appliances to add, ``surplus`` the appliances over
+#: the pool size to kill and ``obsolete`` the appliances of older templates to kill.
+ShepherdPlan = namedtuple(
+    'ShepherdPlan', ['shepherd', 'fulfillment', 'templates', 'missing', 'surplus', 'obsolete'])
+
+
+def plan_shepherd(preconfigured):
+    """Plans the work of the shepherd for all group shepherds at once.
+
+    The group shepherds, the templates, the user groups of the providers and the appliances in the
+    shepherds are fetched by one query each and matched in memory, so the number of queries does
+    not grow with the number of groups.
+
+    For each template group, the last template's appliances are kept in the required quantity.
+    Downstream groups are sorted by version (and the date of the build within it), upstream ones
+    by date.
+
+    Returns: A list of :py:class:`ShepherdPlan`, the least fulfilled group shepherd first.
+    """
+    shepherds = list(GroupShepherd.objects.select_related('template_group', 'user_group'))
+    group_ids = {gs.template_group_id for gs in shepherds}
+    provider_groups = defaultdict(set)
+    for provider_id, user_group_id in Provider.user_groups.through.objects.values_list(
+            'provider_id', 'group_id'):
+        provider_groups[provider_id].add(user_group_id)
+    templates = defaultdict(list)
+    for template in Template.objects.filter(
+            template_group__in=group_ids, ready=True, usable=True, preconfigured=preconfigured,
+            container=None):
+        templates[template.template_group_id].append(template)
+    appliances = defaultdict(list)
+    for appliance in Appliance.objects.filter(
+            template__template_group__in=group_ids, template__preconfigured=preconfigured,
+            appliance_pool=None, marked_for_deletion=False).select_related('template'):
+        appliances[appliance.template.template_group_id].append(appliance)
+
+    plans = []
+    for gs in shepherds:
+        group_templates = [
+            tpl for tpl in templates[gs.template_group_id]
+            if gs.user_group_id in provider_groups[tpl.provider_id]]
+        group_appliances = [
+            appliance for appliance in appliances[gs.template_group_id]
+            if gs.user_group_id in provider_groups[appliance.template.provider_id]]
+        fulfillment = gs.get_fulfillment_percentage(preconfigured, len(group_appliances))
+        versions = sorted(
+            {tpl.version for tpl in group_templates if tpl.version is not None},
+            key=Version, reverse=True)
+        if versions:
+            # Downstream - by version (downstream releases), the latest build of the version
+            date = max(tpl.date for tpl in group_templates if tpl.version == versions[0])
+            keep = [
+                tpl for tpl in group_templates if tpl.version == versions[0] and tpl.date == date]
+            kill = [
+                tpl for tpl in group_templates
+                if tpl.version is not None and (tpl.version != versions[0] or tpl.date != date)]
+        elif group_templates:
             # Upstream - by date (upstream nightlies)
-            filter_keep = {"date": group_dates[0], 'container': None}
-            filters_kill = [{"date": v} for v in group_dates[1:]]
+            date = max(tpl.date for tpl in group_templates)
+            keep = [tpl for tpl in group_templates if tpl.date == date]
+            kill = [tpl for tpl in group_templates if tpl.date != date]
         else:
             continue  # Ignore this group, no templates detected yet
-
-        filter_keep.update(prov_filter)
-        for filt in filters_kill:
-            filt.update(prov_filter)
-        # Keeping current appliances
-        # Retrieve list of all templates for given group
-        # I know joins might be a bit better solution but I'll leave that for later.
-        possible_templates = list(
-            Template.objects.filter(
-                usable=True, ready=True, template_group=gs.template_group,
-                preconfigured=preconfigured, **filter_keep).all())
-        # If it can be deployed, it must exist
-        possible_templates_for_provision = filter(lambda tpl: tpl.exists, possible_templates)
-        appliances = []
-        for template in possible_templates:
-            appliances.extend(
-                Appliance.objects.filter(
-                    template=template, appliance_pool=None, marked_for_deletion=False))
+        keep_ids = {tpl.id for tpl in keep}
+        kill_ids = {tpl.id for tpl in kill}
         # If we then want to delete some templates, better kill the eldest. status_changed
         # says which one was provisioned when, because nothing else then touches that field.
-        appliances.sort(key=lambda appliance: appliance.status_changed)
+        kept_appliances = sorted(
+            (appliance for appliance in group_appliances if appliance.template_id in keep_ids),
+            key=lambda appliance: appliance.status_changed)
         pool_size = gs.template_pool_size if preconfigured else gs.unconfigured_template_pool_size
-        if len(appliances) < pool_size and possible_templates_for_provision:
-            # There must be some templates in order to run the provisioning
+        # Only kill those that are visible only for one group. This is necessary so the groups
+        # don't "fight"
+        surplus = [
+            appliance for appliance in kept_appliances[:max(len(kept_appliances) - pool_size, 0)]
+            if provider_groups[appliance.template.provider_id] == {gs.user_group_id}]
+        plans.append(ShepherdPlan(
+            shepherd=gs,
+            fulfillment=fulfillment,
+            # If it can be deployed, it must exist
+            templates=[tpl for tpl in keep if tpl.exists],
+            missing=max(pool_size - len(kept_appliances), 0),
+            surplus=surplus,
+            obsolete=[
+                appliance for appliance in group_appliances if appliance.template_id in kill_ids]))
+    plans.sort(key=lambda plan: plan.fulfillment)
+    return plans
+
+
+def generic_shepherd(self, preconfigured):
+    """This task takes care of having the required templates spinned into required number of
+    appliances. For each template group, it keeps the last template's appliances spinned up in
+    required quantity. If new template comes out of the door, it automatically kills the older
+    running template's appliances and spins up new ones. Sorts the groups by the fulfillment.
+
+    The work is planned for all groups at once by :py:func:`plan_shepherd`, the new appliances are
+    then created in one transaction and their clone tasks submitted after it."""
+    plans = plan_shepherd(preconfigured)
+    load = ProviderLoad()
+    new_appliances = []
+    with transaction.atomic():
+        for plan in plans:
+            if not plan.missing or not plan.templates:
+                continue
             # Provision ONE appliance at time for each group, that way it is possible to maintain
             # reasonable balancing
-            new_appliance_name = settings.APPLIANCE_FORMAT.format(
-                group=template.template_group.id,
-                date=template.date.strftime("%y%m%d"),
-                rnd=fauxfactory.gen_alphanumeric(8))
-            with transaction.atomic():
-                # Now look for templates that are on non-busy providers
-                tpl_free = filter(
-                    lambda t: t.provider.free,
-                    possible_templates_for_provision)
-                if tpl_free:
-                    appliance = Appliance(
-                        template=sorted(tpl_free, key=lambda t: t.provider.appliance_load)[0],
-                        name=new_appliance_name)
-                    appliance.save()
-            if tpl_free:
+            # Now look for templates that are on non-busy providers
+            tpl_free = [tpl for tpl in plan.templates if load[tpl.provider_id].free]
+            if not tpl_free:
+                continue
+            template = min(tpl_free, key=lambda tpl: load[tpl.provider_id].appliance_load)
+            appliance = Appliance(
+                template=template,
+                name=settings.APPLIANCE_FORMAT.format(
+                    group=template.template_group_id,
+                    date=template.date.strftime("%y%m%d"),
+                    rnd=fauxfactory.gen_alphanumeric(8)))
+            appliance.save()
+            load.provisioning_started(template.provider_id)
+            new_appliances.append(appliance)
+    for appliance in new_appliances:
+        self.logger.info(
+            "Adding an appliance to shepherd: {}/{}".format(appliance.id, appliance.name))
+        clone_template_to_appliance.delay(appliance.id, None)
+
+    killed = set()
+    for plan in plans:
+        for appliance in plan.surplus:
+            if appliance.id not in killed:
+                self.logger.info("Killing an extra appliance {}/{} in shepherd".format(
+                    appliance.id, appliance.name))
+                Appliance.kill(appliance)
+                killed.add(appliance.id)
+        # Killing old appliances
+        for appliance in plan.obsolete:
+            if appliance.id not in killed:
                 self.logger.info(
-                    "Adding an appliance to shepherd: {}/{}".format(appliance.id, appliance.name))
-                clone_template_to_appliance.delay(appliance.id, None)
-        elif len(appliances) > pool_size:
-            # Too many appliances, kill the surplus
-            # Only kill those that are visible only for one group. This is necessary so the groups
-            # don't "fight"
-            for appliance in appliances[:len(appliances) - pool_size]:
-                if appliance.is_visible_only_in_group(gs.user_group):
-                    self.logger.info("Killing an extra appliance {}/{} in shepherd".format(
+                    "Killing appliance {}/{} in shepherd because it is obsolete now".format(
                         appliance.id, appliance.name))
-                    Appliance.kill(appliance)
-
-        # Killing old appliances
-        for filter_kill in filters_kill:
-            for template in Template.objects.filter(
-                    ready=True, usable=True, template_group=gs.template_group,
-                    preconfigured=preconfigured, container=None, **filter_kill):
-
-                for a in Appliance.objects.filter(
-                        template=template, appliance_pool=None, marked_for_deletion=False):
-                    self.logger.info(
-                        "Killing appliance {}/{} in shepherd because it is obsolete now".format(
-                            a.id, a.name))
-                    Appliance.kill(a)
+                Appliance.kill(appliance)
+                killed.add(appliance.id)
 
 
 @singleton_task()
@@ -2007,6 +2207,13 @@ def sync_provider_hw(self, provider_id):
     Provider.objects.get(id=provider_id, working=True, disabled=False).perf_sync()
 
 
+@singleton_task()
+def refresh_user_usage(self):
+    """Recounts the appliances and pools of the users which the quota checks read."""
+    num_users = UserUsage.refresh()
+    self.logger.info("Refreshed the usage of {} users".format(num_users))
+
+
 @singleton_task()
 def sync_quotas_perf(self):
     for provider in Provider.objects.all():
@@ -1,4 +1,52 @@
 # -*- coding: utf-8 -*-
-# from django.test import TestCase
+from django.contrib.auth.models import Group as UserGroup
+from django.test import TestCase
+from django.utils import timezone
 
-# Create your tests here.
+from appliances.models import Appliance, Group, GroupShepherd, Provider, Template
+from appliances.tasks import plan_shepherd
+
+
+class PlanShepherdTestCase(TestCase):
+    PROVIDERS = 3
+    VERSIONS = ['5.8.1.0', '5.9.0.1']
+
+    def create_groups(self, num_groups, prefix):
+        user_group = UserGroup.objects.create(name=prefix)
+        providers = []
+        for i in range(self.PROVIDERS):
+            provider = Provider.objects.create(id='{}-provider-{}'.format(prefix, i), working=True)
+            provider.user_groups.add(user_group)
+            providers.append(provider)
+        groups = [Group(id='{}-group-{}'.format(prefix, i)) for i in range(num_groups)]
+        Group.objects.bulk_create(groups)
+        GroupShepherd.objects.bulk_create([
+            GroupShepherd(template_group=group, user_group=user_group, template_pool_size=2)
+            for group in groups])
+        today = timezone.now().date()
+        Template.objects.bulk_create([
+            Template(
+                provider=provider, template_group=group, version=version, date=today,
+                original_name='{}-{}-{}'.format(group.id, version, provider.id),
+                name='{}-{}-{}'.format(group.id, version, provider.id),
+                ready=True, exists=True, usable=True, preconfigured=True)
+            for group in groups for version in self.VERSIONS for provider in providers])
+        appliances = []
+        for template in Template.objects.filter(
+                template_group__in=groups, provider=providers[0]):
+            # One appliance of the obsolete version and one of the current one in every group
+            appliances.append(Appliance(template=template, name='{}-appliance'.format(
+                template.name)))
+        Appliance.objects.bulk_create(appliances)
+
+    def test_queries_do_not_grow_with_groups(self):
+        self.create_groups(10, 'few')
+        with self.assertNumQueries(4):
+            plans = plan_shepherd(True)
+        self.assertEqual(len(plans), 10)
+
+        self.create_groups(300, 'many')
+        with self.assertNumQueries(4):
+            plans = plan_shepherd(True)
+        self.assertEqual(len(plans), 310)
+        self.assertEqual(sum(len(plan.obsolete) for plan in plans), 310)
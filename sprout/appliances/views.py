@@ -11,14 +11,16 @@ from django.contrib.auth import views
 from django.core.exceptions import ObjectDoesNotExist, PermissionDenied
 from django.core.paginator import Paginator, EmptyPage, PageNotAnInteger
 from django.db import transaction
-from django.db.models import Q
+from django.core.cache import cache
+from django.db.models import Case, Count, Q, When
 from django.http import HttpResponse, Http404, HttpResponseForbidden
 from django.shortcuts import render, redirect
+from django.template.loader import render_to_string
 
 from appliances.api import json_response
 from appliances.models import (
     Provider, AppliancePool, Appliance, Group, Template, MismatchVersionMailer, User, BugQuery,
-    GroupShepherd)
+    GroupShepherd, UserUsage)
 from appliances.tasks import (appliance_power_on, appliance_power_off, appliance_suspend,
     anyvm_power_on, anyvm_power_off, anyvm_suspend, anyvm_delete, delete_template_from_provider,
     appliance_rename, wait_appliance_ready, mark_appliance_ready, appliance_reboot)
@@ -97,7 +99,8 @@ def providers(request, provider_id=None):
         except ObjectDoesNotExist:
             messages.warning(request, "Provider '{}' does not exist.".format(provider_id))
             return redirect("providers")
-    providers = Provider.objects.filter(hidden=False, **user_filter).order_by("id").distinct()
+    providers = Provider.prefetch_user_usage(Provider.objects.filter(
+        hidden=False, **user_filter).order_by("id").distinct().with_load())
     return render(request, 'appliances/providers.html', locals())
 
 
@@ -136,44 +139,80 @@ def templates(request, group_id=None, prov_id=None):
         provider = None
     if provider is not None:
         user_filter_2 = {'provider': provider}
-    groups = Group.objects.order_by("id")
+    groups = Group.objects.order_by("id").annotate(num_existing_templates=Count(
+        Case(When(template__exists=True, then='template__id')), distinct=True))
     mismatched_versions = MismatchVersionMailer.objects.order_by("id")
+    if request.user.is_staff or request.user.is_superuser:
+        user_key = 'all'
+    else:
+        user_key = ','.join(
+            str(pk) for pk in sorted(request.user.groups.values_list('id', flat=True)))
+    cache_key = 'templates-table-{}-{}-{}-{}'.format(
+        group.id, provider.id if provider is not None else '', user_key, Template.cache_version())
+    table = cache.get(cache_key)
+    if table is None:
+        table = render_to_string(
+            'appliances/_templates_table.html', template_table(group, user_filter_2), request)
+        cache.set(cache_key, table, TEMPLATES_TABLE_CACHE_TIMEOUT)
+    return render(request, 'appliances/templates.html', locals())
+
+
+#: For how long is the rendered table of templates kept, it is also dropped when a template changes
+TEMPLATES_TABLE_CACHE_TIMEOUT = 60 * 60
+
+
+def template_table(group, template_filter):
+    """Prepares the rows and rowspans of the table of templates of the group.
+
+    The templates are fetched by one query and grouped by stream, version and date in one pass.
+    """
+    templates = list(Template.objects.filter(
+        template_group=group, version__isnull=False, exists=True, ready=True,
+        **template_filter).select_related('provider', 'parent_template').distinct())
+
+    def zstream_of(version):
+        return ".".join(version.split(".")[:3])
+    # Newest stream and version first, then by date (newest first) and provider
+    templates.sort(key=lambda template: template.provider_id)
+    templates.sort(key=lambda template: template.date, reverse=True)
+    templates.sort(
+        key=lambda template: (Version(zstream_of(template.version)), Version(template.version)),
+        reverse=True)
     prepared_table = []
     zstream_rowspans = {}
     version_rowspans = {}
     date_version_rowspans = {}
-    items = group.zstreams_versions.items()
-    items.sort(key=lambda pair: Version(pair[0]), reverse=True)
-    for zstream, versions in items:
-        for version in versions:
-            for template in Template.objects.filter(
-                    template_group=group, version=version, exists=True,
-                    ready=True, **user_filter_2).order_by('-date', 'provider').distinct():
-                if zstream in zstream_rowspans:
-                    zstream_rowspans[zstream] += 1
-                    zstream_append = None
-                else:
-                    zstream_rowspans[zstream] = 1
-                    zstream_append = zstream
+    for template in templates:
+        zstream, version = zstream_of(template.version), template.version
+        if zstream in zstream_rowspans:
+            zstream_rowspans[zstream] += 1
+            zstream_append = None
+        else:
+            zstream_rowspans[zstream] = 1
+            zstream_append = zstream
 
-                if version in version_rowspans:
-                    version_rowspans[version] += 1
-                    version_append = None
-                else:
-                    version_rowspans[version] = 1
-                    version_append = version
+        if version in version_rowspans:
+            version_rowspans[version] += 1
+            version_append = None
+        else:
+            version_rowspans[version] = 1
+            version_append = version
 
-                datetuple = (template.date, version)
-                if datetuple in date_version_rowspans:
-                    date_version_rowspans[datetuple] += 1
-                    date_append = None
-                else:
-                    date_version_rowspans[datetuple] = 1
-                    date_append = template.date
-                prepared_table.append((
-                    zstream_append, version_append, date_append, datetuple, template.provider,
-                    template))
-    return render(request, 'appliances/templates.html', locals())
+        datetuple = (template.date, version)
+        if datetuple in date_version_rowspans:
+            date_version_rowspans[datetuple] += 1
+            date_append = None
+        else:
+            date_version_rowspans[datetuple] = 1
+            date_append = template.date
+        prepared_table.append((
+            zstream_append, version_append, date_append, datetuple, template.provider, template))
+    return {
+        'prepared_table': prepared_table,
+        'zstream_rowspans': zstream_rowspans,
+        'version_rowspans': version_rowspans,
+        'date_version_rowspans': date_version_rowspans,
+    }
 
 
 @only_authenticated
@@ -185,6 +224,38 @@ def shepherd(request):
     return render(request, 'appliances/shepherd.html', locals())
 
 
+class TemplateMatrix(object):
+    """Versions, dates and providers of the templates matching the filters, fetched by one query.
+
+    ``version`` and ``date`` of the methods can be :py:attr:`ANY` to not filter by them.
+    """
+    ANY = object()
+
+    def __init__(self, *filters, **kwfilters):
+        self.rows = list(
+            Template.objects.filter(*filters, **kwfilters)
+            .values_list('version', 'date', 'provider').distinct().order_by())
+
+    def _matching(self, version, date=ANY):
+        return [
+            (row_version, row_date, provider) for row_version, row_date, provider in self.rows
+            if (version is self.ANY or row_version == version) and
+            (date is self.ANY or row_date == date)]
+
+    @property
+    def latest_version(self):
+        versions = sorted(
+            {version for version, _, _ in self.rows if version is not None},
+            key=Version, reverse=True)
+        return versions[0] if versions else self.ANY
+
+    def dates(self, version=ANY):
+        return sorted({date for _, date, _ in self._matching(version)}, reverse=True)
+
+    def providers(self, version=ANY, date=ANY):
+        return sorted({provider for _, _, provider in self._matching(version, date)})
+
+
 @only_authenticated
 def versions_for_group(request):
     if not request.user.is_authenticated():
@@ -203,13 +274,15 @@ def versions_for_group(request):
         except ObjectDoesNotExist:
             versions = []
         else:
-            versions = [
-                (version, Template.ga_version(version))
-                for version in Template.get_versions(
-                    container_q,
-                    template_group=group, ready=True, usable=True, exists=True,
-                    preconfigured=preconfigured, provider__working=True, provider__disabled=False,
-                    provider__user_groups__in=request.user.groups.all())]
+            versions = Template.get_versions(
+                container_q,
+                template_group=group, ready=True, usable=True, exists=True,
+                preconfigured=preconfigured, provider__working=True, provider__disabled=False,
+                provider__user_groups__in=request.user.groups.all())
+            ga_versions = set(
+                Template.objects.filter(version__in=versions, ga_released=True)
+                .values_list('version', flat=True).distinct())
+            versions = [(version, version in ga_versions) for version in versions]
             if versions:
                 if versions[0][1]:
                     latest_version = '{} (GA)'.format(versions[0][0])
@@ -247,15 +320,10 @@ def date_for_group_and_version(request):
                 'provider__disabled': False,
                 "provider__user_groups__in": request.user.groups.all(),
             }
+            matrix = TemplateMatrix(container_q, **filters)
             if version == "latest":
-                try:
-                    versions = Template.get_versions(container_q, **filters)
-                    filters["version"] = versions[0]
-                except IndexError:
-                    pass  # No such thing as version for this template group
-            else:
-                filters["version"] = version
-            dates = Template.get_dates(container_q, **filters)
+                version = matrix.latest_version
+            dates = matrix.dates(version)
             if dates:
                 latest_date = dates[0]
     return render(request, 'appliances/_dates.html', locals())
@@ -296,39 +364,31 @@ def providers_for_date_group_and_version(request):
                 "provider__disabled": False,
                 "provider__user_groups__in": request.user.groups.all(),
             }
+            matrix = TemplateMatrix(container_q, **filters)
             if version == "latest":
-                try:
-                    versions = Template.get_versions(container_q, **filters)
-                    filters["version"] = versions[0]
-                except IndexError:
-                    pass  # No such thing as version for this template group
-            else:
-                filters["version"] = version
+                version = matrix.latest_version
             date = request.POST.get("date")
             if date == "latest":
-                try:
-                    dates = Template.get_dates(container_q, **filters)
-                    filters["date"] = dates[0]
-                except IndexError:
-                    pass  # No such thing as date for this template group
+                dates = matrix.dates(version)
+                date = dates[0] if dates else TemplateMatrix.ANY
             else:
-                filters["date"] = parser.parse(date)
-            providers = Template.objects.filter(
-                container_q, **filters).values("provider").distinct()
-            providers = sorted([p.values()[0] for p in providers])
-            providers = [Provider.objects.get(id=provider) for provider in providers]
+                date = parser.parse(date).date()
+            providers = list(
+                Provider.objects.with_load()
+                .filter(id__in=matrix.providers(version, date)).order_by('id'))
+            appl_filter = dict(
+                appliance_pool=None, ready=True, template__provider__in=providers,
+                template__preconfigured=filters["preconfigured"],
+                template__template_group=filters["template_group"])
+            if date is not TemplateMatrix.ANY:
+                appl_filter["template__date"] = date
+            if version is not TemplateMatrix.ANY:
+                appl_filter["template__version"] = version
+            shepherd_counts = dict(
+                Appliance.objects.filter(appliance_container_q, **appl_filter)
+                .values_list('template__provider').annotate(Count('id')).order_by())
             for provider in providers:
-                appl_filter = dict(
-                    appliance_pool=None, ready=True, template__provider=provider,
-                    template__preconfigured=filters["preconfigured"],
-                    template__template_group=filters["template_group"])
-                if "date" in filters:
-                    appl_filter["template__date"] = filters["date"]
-
-                if "version" in filters:
-                    appl_filter["template__version"] = filters["version"]
-                shepherd_appliances[provider.id] = len(
-                    Appliance.objects.filter(appliance_container_q, **appl_filter))
+                shepherd_appliances[provider.id] = shepherd_counts.get(provider.id, 0)
                 total_shepherd_slots += shepherd_appliances[provider.id]
                 total_appliance_slots += provider.remaining_appliance_slots
                 total_provisioning_slots += provider.remaining_provisioning_slots
@@ -407,8 +467,8 @@ def my_appliances(request, show_user="my"):
             display_legend = True
     per_pool_quota = None
     pools_remaining = None
-    num_user_vms = Appliance.objects.filter(appliance_pool__owner=request.user).count()
     if request.user.has_quotas:
+        num_user_vms = UserUsage.for_user(request.user).num_appliances
         if request.user.quotas.total_pool_quota is not None:
             if request.user.quotas.total_pool_quota <= len(pools):
                 new_pool_possible = False
@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+"""Leases and counters of the singleton tasks, kept in redis.
+
+A lease is a lock with a short expiry that its holder keeps renewing from a heartbeat thread while
+it works. A lock left by a crashed worker is then gone after :py:data:`LEASE_TIME` instead of
+blocking the task until a long expiry. Every acquisition gets a fencing token, a number growing
+with each acquisition of the key, :py:attr:`Lease.held` tells the holder whether its token is
+still the current one (whether nobody else took the key after the lease was lost).
+"""
+from __future__ import absolute_import
+import threading
+
+from sprout import redis_client
+
+#: How long a lease lasts without being renewed, in seconds
+LEASE_TIME = 60
+#: How long the fencing counter of a key is kept after its last acquisition, in seconds
+FENCE_EXPIRE = 24 * 60 * 60
+
+_compare_and_delete = redis_client.register_script("""
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+""")
+
+_compare_and_expire = redis_client.register_script("""
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('pexpire', KEYS[1], ARGV[2])
+end
+return 0
+""")
+
+
+def delete_if_equal(key, value, client=None):
+    """Deletes the key only if it still has the value, returns whether it did."""
+    return bool(_compare_and_delete(keys=[key], args=[value], client=client or redis_client))
+
+
+class Lease(object):
+    """Lease of a redis key, renewed in the background until released.
+
+    Usage:
+
+    .. code-block:: python
+
+        lease = Lease('some-lock')
+        if lease.acquire():
+            try:
+                ...
+            finally:
+                lease.release()
+    """
+    def __init__(self, key, lease_time=LEASE_TIME, client=None):
+        self.key = key
+        self.lease_time = lease_time
+        self.client = client or redis_client
+        self.token = None
+        self.lost = False
+        self._stop = threading.Event()
+        self._heartbeat = None
+
+    def acquire(self):
+        """Tries to acquire the lease without waiting, returns whether it got it."""
+        fence = '{}-fence'.format(self.key)
+        pipe = self.client.pipeline()
+        pipe.incr(fence)
+        pipe.expire(fence, FENCE_EXPIRE)
+        token = pipe.execute()[0]
+        if not self.client.set(self.key, token, nx=True, px=int(self.lease_time * 1000)):
+            return False
+        self.token = token
+        self.lost = False
+        self._stop.clear()
+        self._heartbeat = threading.Thread(
+            target=self._renew_until_released, name='lease-{}'.format(self.key))
+        self._heartbeat.daemon = True
+        self._heartbeat.start()
+        return True
+
+    def renew(self):
+        """Extends the lease, returns ``False`` if it is not ours any more."""
+        return bool(_compare_and_expire(
+            keys=[self.key], args=[self.token, int(self.lease_time * 1000)], client=self.client))
+
+    def _renew_until_released(self):
+        while not self._stop.wait(self.lease_time / 3.0):
+            if not self.renew():
+                self.lost = True
+                return
+
+    @property
+    def held(self):
+        """Whether the key still holds our token."""
+        return self.token is not None and self.client.get(self.key) == str(self.token)
+
+    def release(self):
+        self._stop.set()
+        if self._heartbeat is not None:
+            self._heartbeat.join()
+            self._heartbeat = None
+        if self.token is not None:
+            delete_if_equal(self.key, self.token, self.client)
+            self.token = None
+
+
+class TaskMetrics(object):
+    """Counters of the singleton tasks, a redis hash per task name.
+
+    * ``published`` - tasks sent to the queue
+    * ``deduplicated`` - tasks not sent, because the same task was already waiting in the queue
+    * ``started`` - tasks taken from the queue by a worker
+    * ``run`` - tasks that got the lease and ran
+    * ``skipped`` - tasks that did not run, because another one held the lease
+    * ``lock_waits``, ``lock_wait`` - number of the tasks which waited for the lease (``wait``
+      of ``singleton_task``) and the total seconds they waited
+    """
+    KEY = 'sprout-task-metrics'
+
+    def __init__(self, client=None):
+        self.client = client or redis_client
+
+    def _key(self, task_name):
+        return '{}:{}'.format(self.KEY, task_name)
+
+    def incr(self, task_name, counter, amount=1):
+        pipe = self.client.pipeline()
+        pipe.hincrby(self._key(task_name), counter, amount)
+        pipe.sadd(self.KEY, task_name)
+        pipe.execute()
+
+    def add_lock_wait(self, task_name, seconds):
+        pipe = self.client.pipeline()
+        pipe.hincrbyfloat(self._key(task_name), 'lock_wait', seconds)
+        pipe.hincrby(self._key(task_name), 'lock_waits', 1)
+        pipe.sadd(self.KEY, task_name)
+        pipe.execute()
+
+    def get(self, task_name):
+        """Returns the counters of the task with the derived ``queue_depth`` and ``skip_rate``."""
+        raw = self.client.hgetall(self._key(task_name))
+        result = {
+            counter: int(raw.get(counter, 0))
+            for counter in ['published', 'deduplicated', 'started', 'run', 'skipped', 'lock_waits']}
+        result['lock_wait'] = float(raw.get('lock_wait', 0))
+        result['queue_depth'] = max(result['published'] - result['started'], 0)
+        attempts = result['run'] + result['skipped']
+        result['skip_rate'] = float(result['skipped']) / attempts if attempts else 0.0
+        return result
+
+    def all(self):
+        return {task_name: self.get(task_name) for task_name in self.client.smembers(self.KEY)}
+
+
+task_metrics = TaskMetrics()
@@ -198,7 +198,8 @@ CELERYBEAT_SCHEDULE = {
 
     'process-delayed-provision-tasks': {
         'task': 'appliances.tasks.process_delayed_provision_tasks',
-        'schedule': timedelta(seconds=20),
+        # Only in case a wake-up was missed, the capacity changes wake it up right away
+        'schedule': timedelta(minutes=5),
     },
 
     'scavenge-managed-providers': {
@@ -236,6 +237,11 @@ CELERYBEAT_SCHEDULE = {
         'schedule': timedelta(minutes=45),
     },
 
+    'refresh-user-usage': {
+        'task': 'appliances.tasks.refresh_user_usage',
+        'schedule': timedelta(minutes=1),
+    },
+
     'sync-quotas-perf': {
         'task': 'appliances.tasks.sync_quotas_perf',
         'schedule': timedelta(hours=12),
@@ -31,7 +31,9 @@ from utils.path import data_path, patches_path, scripts_path, conf_path
 from utils.version import Version, get_stream, pick
 from utils.wait import wait_for
 
+from .activity import ApplianceActivity
 from .db import ApplianceDB
+from .readiness import ApplianceReadiness
 from .implementations.ui import ViaUI
 from .implementations.ssui import ViaSSUI
 from .services import SystemdService
@@ -186,6 +188,8 @@ class IPAppliance(object):
 
     evmserverd = SystemdService.declare(unit_name='evmserverd')
     db = ApplianceDB.declare()
+    activity = ApplianceActivity.declare()
+    readiness = ApplianceReadiness.declare()
 
     CONFIG_MAPPING = {
         'base_url': 'address',
@@ -1363,9 +1367,8 @@ class IPAppliance(object):
             timeout: Number of seconds to wait until timeout (default ``900``)
         """
         log_callback('Waiting for evmserverd to be running')
-        result, wait = wait_for(self.is_evm_service_running, num_sec=timeout,
-                                fail_condition=False, delay=10)
-        return result
+        self.readiness.wait_for_ready(layers=('evmserverd',), timeout=timeout)
+        return True
 
     @logger_wrap("Rebooting Appliance: {}")
     def reboot(self, wait_for_web_ui=True, log_callback=None):
@@ -1392,8 +1395,11 @@ class IPAppliance(object):
         """
         prefix = "" if running else "dis"
         (log_callback or self.log.info)('Waiting for web UI to ' + prefix + 'appear')
+        if running:
+            self.readiness.wait_for_ready(layers=('ui',), timeout=timeout)
+            return True
         result, wait = wait_for(self._check_appliance_ui_wait_fn, num_sec=timeout,
-            fail_condition=not running, delay=10)
+            fail_condition=True, delay=5)
         return result
 
     @logger_wrap("Install VDDK: {}")
@@ -1601,28 +1607,16 @@ class IPAppliance(object):
 
     @property
     def is_idle(self):
-        """Return appliance idle state measured by last production.log activity.
-        It runs one liner script, which first gathers current date on appliance and then gathers
-        date of last entry in production.log(which has to be parsed) with /api calls filtered
-        (These calls occur every minute.)
-        Then it deducts that last time in log from current date and if it is lower than idle_time it
-        returns False else True.
+        """Return appliance idle state measured by the queue, worker and request state in the DB.
 
-        Args:
+        See :py:class:`utils.appliance.activity.ApplianceActivity` for the details, the quiet
+        period and the optional production.log check.
 
         Returns:
-            True if appliance is idling for longer or equal to idle_time seconds.
-            False if appliance is not idling for longer or equal to idle_time seconds.
+            True if appliance is idling for longer or equal to the quiet period.
+            False if appliance is not idling for longer or equal to the quiet period.
         """
-        idle_time = 3600
-        ssh_output = self.ssh_client.run_command('if [ $((`date "+%s"` - `date -d "$(egrep -v '
-            '"(Processing by Api::ApiController\#index as JSON|Started GET "/api" for '
-            '127.0.0.1|Completed 200 OK in)" /var/www/miq/vmdb/log/production.log | tail -1 |cut '
-            '-d"[" -f3 | cut -d"]" -f1 | cut -d" " -f1)\" \"+%s\"`)) -lt {} ];'
-            'then echo "False";'
-            'else echo "True";'
-            'fi;'.format(idle_time))
-        return True if 'True' in ssh_output else False
+        return self.activity.is_idle()
 
     @cached_property
     def build_datetime(self):
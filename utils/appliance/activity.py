@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+import time
+
+import attr
+from sqlalchemy import func, or_
+
+from utils.wait import TimedOutError
+from .plugin import AppliancePlugin, AppliancePluginException
+
+
+class ApplianceActivityException(AppliancePluginException):
+    pass
+
+
+@attr.s
+class ActivitySnapshot(object):
+    """One observation of the appliance activity as seen in the database.
+
+    All times are naive UTC datetimes taken from the database server clock.
+    """
+    db_now = attr.ib()
+    dequeued = attr.ib()
+    queued = attr.ib()
+    transitioning_workers = attr.ib()
+    last_request_on = attr.ib()
+    last_task_on = attr.ib()
+
+    @property
+    def last_activity_on(self):
+        """Latest request or request task update, ``None`` if there was none at all."""
+        stamps = [stamp for stamp in (self.last_request_on, self.last_task_on) if stamp]
+        return max(stamps) if stamps else None
+
+    def seconds_since_activity(self):
+        if self.last_activity_on is None:
+            return None
+        return (self.db_now - self.last_activity_on).total_seconds()
+
+    def is_busy(self, max_queued=0):
+        """Whether the queue or the workers are doing something right now."""
+        return bool(self.dequeued or self.queued > max_queued or self.transitioning_workers)
+
+
+@attr.s
+class ApplianceActivity(AppliancePlugin):
+    """Idleness detection based on the ``miq_queue``, worker and request state in the DB.
+
+    The appliance is idle when no queue message is being processed, no more than ``max_queued``
+    messages are due for delivery, no worker is starting or stopping and no request (or request
+    task) has been updated for ``quiet_period`` seconds.
+
+    Usage:
+
+        .. code-block:: python
+
+            appliance.activity.wait_for_idle(quiet_period=60)
+    """
+    quiet_period = attr.ib(default=3600)
+    max_queued = attr.ib(default=0)
+
+    TRANSITIONING_WORKER_STATES = ('creating', 'starting', 'stopping')
+
+    def snapshot(self):
+        """Queries all the activity signals in a single statement.
+
+        Returns: :py:class:`ActivitySnapshot`
+        """
+        db = self.appliance.db.client
+        session = db.session
+        queue = db['miq_queue']
+        workers = db['miq_workers']
+        requests = db['miq_requests']
+        tasks = db['miq_request_tasks']
+        db_now = func.timezone('UTC', func.now())
+        row = session.query(
+            db_now,
+            session.query(func.count(queue.id))
+            .filter(queue.state == 'dequeue').as_scalar(),
+            session.query(func.count(queue.id))
+            .filter(queue.state == 'ready')
+            .filter(or_(queue.deliver_on == None, queue.deliver_on <= db_now))  # noqa
+            .as_scalar(),
+            session.query(func.count(workers.id))
+            .filter(workers.status.in_(self.TRANSITIONING_WORKER_STATES)).as_scalar(),
+            session.query(func.max(requests.updated_on)).as_scalar(),
+            session.query(func.max(tasks.updated_on)).as_scalar(),
+        ).one()
+        return ActivitySnapshot(*row)
+
+    def log_idle_time(self):
+        """Returns seconds since the last non-API entry in production.log.
+
+        This is slow on large logs, so it is only used as an optional secondary signal.
+        """
+        result = self.appliance.ssh_client.run_command(
+            'echo $((`date "+%s"` - `date -d "$(egrep -v '
+            '"(Processing by Api::ApiController#index as JSON|Started GET "/api" for '
+            '127.0.0.1|Completed 200 OK in)" /var/www/miq/vmdb/log/production.log | tail -1 |cut '
+            '-d"[" -f3 | cut -d"]" -f1 | cut -d" " -f1)\" \"+%s\"`))')
+        try:
+            return int(result.output.strip())
+        except ValueError:
+            raise ApplianceActivityException(
+                'Could not parse production.log idle time: {}'.format(result.output))
+
+    def is_idle(self, quiet_period=None, check_log=False):
+        """Checks whether the appliance has been idle for at least ``quiet_period`` seconds.
+
+        Args:
+            quiet_period: Seconds without activity required (default from the plugin)
+            check_log: Also require production.log to be quiet for ``quiet_period``
+        """
+        if quiet_period is None:
+            quiet_period = self.quiet_period
+        snapshot = self.snapshot()
+        if snapshot.is_busy(self.max_queued):
+            return False
+        since = snapshot.seconds_since_activity()
+        if since is not None and since < quiet_period:
+            return False
+        if check_log:
+            return self.log_idle_time() >= quiet_period
+        return True
+
+    def wait_for_idle(self, quiet_period=None, timeout=1800, delay=1, max_delay=15,
+            check_log=False):
+        """Waits until the appliance is idle for ``quiet_period`` seconds.
+
+        The quiet time counts from the later of the last request update and the last poll which
+        saw the queue or workers busy, so an appliance that is already quiet returns on the first
+        poll. The polling interval starts at ``delay`` and doubles up to ``max_delay``, but it never
+        oversleeps the moment the quiet period is expected to end.
+
+        Args:
+            quiet_period: Seconds without activity required (default from the plugin)
+            timeout: Number of seconds to wait until timeout
+            delay: Initial polling interval in seconds
+            max_delay: Maximum polling interval in seconds
+            check_log: Also require production.log to be quiet once the DB says so
+
+        Returns: Number of seconds spent waiting
+        """
+        if quiet_period is None:
+            quiet_period = self.quiet_period
+        start = time.time()
+        last_busy = None
+        while True:
+            snapshot = self.snapshot()
+            if snapshot.is_busy(self.max_queued):
+                last_busy = snapshot.db_now
+                remaining = quiet_period
+            else:
+                stamps = [s for s in (snapshot.last_activity_on, last_busy) if s is not None]
+                quiet_for = (snapshot.db_now - max(stamps)).total_seconds() if stamps else None
+                if quiet_for is None or quiet_for >= quiet_period:
+                    if not check_log or self.log_idle_time() >= quiet_period:
+                        elapsed = time.time() - start
+                        self.logger.info('Appliance idle after waiting %.1fs', elapsed)
+                        return elapsed
+                    remaining = max_delay
+                else:
+                    remaining = quiet_period - quiet_for
+            sleep_for = min(delay, max(remaining, 0.1))
+            if time.time() - start + sleep_for > timeout:
+                raise TimedOutError(
+                    'Appliance did not become idle for {}s within {}s'.format(
+                        quiet_period, timeout))
+            time.sleep(sleep_for)
+            delay = min(delay * 2, max_delay)
@@ -1,8 +1,10 @@
 # -*- coding: utf-8 -*-
 import json
 import time
+from collections import defaultdict
 from jsmin import jsmin
 from inspect import isclass
+from urlparse import urljoin
 
 from utils.log import logger, create_sublogger
 from cfme import exceptions
@@ -21,7 +23,7 @@ from cached_property import cached_property
 from widgetastic.browser import Browser, DefaultPlugin
 from widgetastic.widget import Text, View
 from widgetastic.utils import VersionPick
-from utils.version import Version
+from utils.version import Version, pick
 from utils.wait import wait_for
 
 from . import Implementation
@@ -79,6 +81,58 @@ class MiqBrowserPlugin(DefaultPlugin):
         }
         ''')
 
+    PAGE_HEALTH_CHECK = jsmin('''\
+        function isDisplayed(el) {
+            if(el === null) return false;
+            // Not offsetParent, that is null for <body> and would hide the rails error pages
+            var style = window.getComputedStyle(el);
+            if(style.display === "none" || style.visibility === "hidden") return false;
+            return el.getClientRects().length > 0;
+        }
+
+        function anyDisplayed(xpath) {
+            var nodes = document.evaluate(
+                xpath, document, null, XPathResult.ORDERED_NODE_SNAPSHOT_TYPE, null);
+            for(var i = 0; i < nodes.snapshotLength; i++) {
+                if(isDisplayed(nodes.snapshotItem(i))) return true;
+            }
+            return false;
+        }
+
+        function text(xpath) {
+            var el = document.evaluate(
+                xpath, document, null, XPathResult.FIRST_ORDERED_NODE_TYPE, null).singleNodeValue;
+            return el === null ? null : (el.innerText || el.textContent || "").trim();
+        }
+
+        try {
+            miqSparkleOff();
+        } catch(err) {
+            // miqSparkleOff undefined, so it's definitely off
+        }
+
+        var railsError = null;
+        if(anyDisplayed("//body[./h1 and ./p and ./hr and ./address]")) {
+            railsError = text("//body/h1") + ": " + text("//body/p");
+        } else if(anyDisplayed("//h1[normalize-space(.)='Unexpected error encountered']")) {
+            railsError = text(
+                "//h1[normalize-space(.)='Unexpected error encountered']" +
+                "/following-sibling::h3[not(fieldset)]");
+        }
+
+        return {
+            blocked: (
+                anyDisplayed("//div[@id='blocker_div' or @id='notification']") ||
+                anyDisplayed("//div[contains(@class, 'modal-backdrop') and " +
+                             "contains(@class, 'fade') and contains(@class, 'in')]")),
+            modal: anyDisplayed(
+                "//div[contains(@class, 'modal-dialog') and contains(@class, 'modal-lg')]"),
+            jquery: typeof jQuery !== "undefined",
+            rails_error: railsError,
+            url: window.location.href
+        };
+        ''')
+
     OBSERVED_FIELD_MARKERS = (
         'data-miq_observe',
         'data-miq_observe_date',
@@ -96,6 +150,16 @@ class MiqBrowserPlugin(DefaultPlugin):
 
         wait_for(_check, timeout=timeout, delay=0.2, silent_failure=True, very_quiet=True)
 
+    def page_health(self):
+        """Returns a report of the page state gathered by a single script execution.
+
+        The spinner is turned off on the way. The report is a :py:class:`dict` with keys
+        ``blocked`` (blocker div or modal backdrop displayed), ``modal`` (large modal dialog
+        displayed), ``jquery`` (jQuery present), ``rails_error`` (text of a displayed rails error
+        or ``None``) and ``url``.
+        """
+        return self.browser.execute_script(self.PAGE_HEALTH_CHECK, silent=True)
+
     def after_keyboard_input(self, element, keyboard_input):
         observed_field_attr = None
         for attr in self.OBSERVED_FIELD_MARKERS:
@@ -149,6 +213,45 @@ class MiqBrowser(Browser):
         return self.appliance.version
 
 
+class NavigationStats(object):
+    """Collects per-destination navigation timings.
+
+    Every :py:meth:`CFMENavigateStep.go` records its duration together with the route it took:
+    ``here`` (already on the page), ``url`` (direct URL jump) or ``steps`` (prerequisite chain).
+    """
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        self.stats = defaultdict(lambda: {
+            'count': 0, 'total': 0.0, 'max': 0.0, 'routes': defaultdict(int), 'failed_jumps': 0})
+
+    def record(self, destination, duration, route):
+        stat = self.stats[destination]
+        stat['count'] += 1
+        stat['total'] += duration
+        stat['max'] = max(stat['max'], duration)
+        stat['routes'][route] += 1
+
+    def record_failed_jump(self, destination):
+        self.stats[destination]['failed_jumps'] += 1
+
+    def summary(self, top=None):
+        """Returns lines describing the destinations, the most time consuming first."""
+        lines = []
+        ordered = sorted(self.stats.items(), key=lambda item: item[1]['total'], reverse=True)
+        for destination, stat in ordered[:top]:
+            lines.append(
+                '{}: {} navigations, total {:.1f}s, avg {:.2f}s, max {:.2f}s, routes {}, '
+                'failed jumps {}'.format(
+                    destination, stat['count'], stat['total'], stat['total'] / stat['count'],
+                    stat['max'], dict(stat['routes']), stat['failed_jumps']))
+        return lines
+
+
+navigation_stats = NavigationStats()
+
+
 def can_skip_badness_test(fn):
     """Decorator for setting a noop"""
     fn._can_skip_badness_test = True
@@ -158,6 +261,16 @@ def can_skip_badness_test(fn):
 class CFMENavigateStep(NavigateStep):
     VIEW = None
 
+    # Path relative to the appliance URL which displays the destination directly, for example
+    # ``'ems_infra/show/{id}'``. Can be a version dict for :py:func:`utils.version.pick`.
+    # The placeholders are filled from :py:meth:`url_kwargs`.
+    URL = None
+
+    # Steps which only inspect the page, the page health report stays valid after them
+    PAGE_PRESERVING_STEPS = {'am_i_here'}
+    _page_health = None
+    _id_keys = None
+
     @cached_property
     def view(self):
         if self.VIEW is None:
@@ -177,6 +290,102 @@ class CFMENavigateStep(NavigateStep):
         except (AttributeError, NoSuchElementException):
             return False
 
+    @property
+    def obj_class_name(self):
+        return self.obj.__name__ if isclass(self.obj) else self.obj.__class__.__name__
+
+    @property
+    def destination(self):
+        return '{}/{}'.format(self.obj_class_name, self._name)
+
+    def url_kwargs(self):
+        """Values for the :py:attr:`URL` placeholders, override for URLs with object ids."""
+        return {}
+
+    def cached_id(self, resolver, key=None):
+        """Returns the object id cached for the appliance, calling ``resolver`` on a miss.
+
+        Args:
+            resolver: Callable returning the id
+            key: Cache key, defaults to the class and name of the navigated object
+        """
+        if key is None:
+            key = (self.obj_class_name, getattr(self.obj, 'name', None))
+        if self._id_keys is not None:
+            self._id_keys.append(key)
+        return self.appliance.browser.object_id(key, resolver)
+
+    def direct_url(self):
+        """Returns the URL displaying the destination directly or ``None`` if there is none."""
+        if self.URL is None:
+            return None
+        path = pick(self.URL) if isinstance(self.URL, dict) else self.URL
+        if path is None:
+            return None
+        self._id_keys = []
+        try:
+            return urljoin(self.appliance.url, path.format(**self.url_kwargs()))
+        except Exception as e:
+            self.log_message("Could not resolve the direct URL: {}".format(e), level="warning")
+            return None
+
+    def jump(self):
+        """Tries to reach the destination by its direct URL.
+
+        It is not tried when the browser is not logged in. If the destination is not displayed
+        afterwards, the ids used for the URL are dropped from the cache. In both cases ``False``
+        is returned so the prerequisite chain can be used instead.
+        """
+        url = self.direct_url()
+        if url is None:
+            return False
+        try:
+            logged_in = self.appliance.server.logged_in()
+        except Exception:
+            logged_in = False
+        if not logged_in:
+            # The URL would only show the login screen, the steps log in first
+            self.log_message("Not logged in, not jumping directly")
+            return False
+        self.log_message("Jumping directly to {}".format(url))
+        self._page_health = None
+        try:
+            br = self.appliance.browser.widgetastic
+            br.url = url
+            br.plugin.ensure_page_safe()
+            if self.VIEW:
+                self.view.flush_widget_cache()
+            if self.am_i_here():
+                return True
+        except Exception as e:
+            self.log_message("Direct URL navigation raised {}".format(e), level="warning")
+        self.log_message("Direct URL navigation failed, using the steps", level="warning")
+        navigation_stats.record_failed_jump(self.destination)
+        for key in self._id_keys:
+            self.appliance.browser.forget_object_id(key)
+        return False
+
+    def page_health(self):
+        """Returns the page health report, cached until an action changes the page.
+
+        See :py:meth:`MiqBrowserPlugin.page_health` for the report contents.
+        """
+        if self._page_health is None:
+            br = self.appliance.browser.widgetastic
+            try:
+                self._page_health = br.plugin.page_health()
+            except Exception:
+                # Most likely an alert, dismiss it and try once more
+                br.dismiss_any_alerts()
+                try:
+                    self._page_health = br.plugin.page_health()
+                except Exception as e:
+                    logger.warning("Could not check the page health: %s", str(e))
+                    return {
+                        'blocked': False, 'modal': False, 'jquery': True, 'rails_error': None,
+                        'url': None}
+        return self._page_health
+
     def check_for_badness(self, fn, _tries, nav_args, *args, **kwargs):
         if getattr(fn, '_can_skip_badness_test', False):
             # self.log_message('Op is a Nop! ({})'.format(fn.__name__))
@@ -196,43 +405,24 @@ class CFMENavigateStep(NavigateStep):
             self.go(_tries, *args, **go_kwargs)
 
         br = self.appliance.browser
-
-        try:
-            br.widgetastic.execute_script('miqSparkleOff();', silent=True)
-        except:  # noqa
-            # miqSparkleOff undefined, so it's definitely off.
-            # Or maybe it is alerts? Let's only do this when we get an exception.
-            self.appliance.browser.widgetastic.dismiss_any_alerts()
-            # If we went so far, let's put diapers on one more miqSparkleOff just to be sure
-            # It can be spinning in the back
-            try:
-                br.widgetastic.execute_script('miqSparkleOff();', silent=True)
-            except:  # noqa
-                pass
+        health = self.page_health()
 
         # Check if the page is blocked with blocker_div. If yes, let's headshot the browser right
         # here
-        if (
-                br.widgetastic.is_displayed("//div[@id='blocker_div' or @id='notification']") or
-                br.widgetastic.is_displayed(".modal-backdrop.fade.in")):
+        if health['blocked']:
             logger.warning("Page was blocked with blocker div on start of navigation, recycling.")
             self.appliance.browser.quit_browser()
             self.go(_tries, *args, **go_kwargs)
 
         # Check if modal window is displayed
-        if (br.widgetastic.is_displayed(
-                "//div[contains(@class, 'modal-dialog') and contains(@class, 'modal-lg')]")):
+        if health['modal']:
             logger.warning("Modal window was open; closing the window")
             br.widgetastic.click(
                 "//button[contains(@class, 'close') and contains(@data-dismiss, 'modal')]")
+            self._page_health = None
 
         # Check if jQuery present
-        try:
-            br.widgetastic.execute_script("jQuery", silent=True)
-        except Exception as e:
-            if "jQuery" not in str(e):
-                logger.error("Checked for jQuery but got something different.")
-                logger.exception(e)
+        if not health['jquery']:
             # Restart some workers
             logger.warning("Restarting UI and VimBroker workers!")
             with self.appliance.ssh_client as ssh:
@@ -246,8 +436,7 @@ class CFMENavigateStep(NavigateStep):
             self.go(_tries, *args, **go_kwargs)
 
         # Same with rails errors
-        view = br.widgetastic.create_view(ErrorView)
-        rails_e = view.get_rails_error()
+        rails_e = health['rails_error']
 
         if rails_e is not None:
             logger.warning("Page was blocked by rails error, renavigating.")
@@ -277,7 +466,10 @@ class CFMENavigateStep(NavigateStep):
         try:
             self.log_message(
                 "Invoking {}, with {} and {}".format(fn.func_name, args, kwargs), level="debug")
-            return fn(*args, **kwargs)
+            result = fn(*args, **kwargs)
+            if fn.__name__ not in self.PAGE_PRESERVING_STEPS:
+                self._page_health = None
+            return result
         except (KeyboardInterrupt, ValueError):
             # KeyboardInterrupt: Don't block this while navigating
             raise
@@ -368,7 +560,8 @@ class CFMENavigateStep(NavigateStep):
         if restart_evmserverd:
             logger.info("evmserverd restart requested")
             self.appliance.restart_evm_service()
-            self.appliance.wait_for_web_ui()
+            timings = self.appliance.readiness.wait_for_ready()
+            logger.info("Appliance ready after evmserverd restart: %r", dict(timings))
             self.go(_tries, *args, **go_kwargs)
 
         if recycle or restart_evmserverd:
@@ -390,8 +583,7 @@ class CFMENavigateStep(NavigateStep):
         pass
 
     def log_message(self, msg, level="debug"):
-        class_name = self.obj.__name__ if isclass(self.obj) else self.obj.__class__.__name__
-        str_msg = "[UI-NAV/{}/{}]: {}".format(class_name, self._name, msg)
+        str_msg = "[UI-NAV/{}]: {}".format(self.destination, msg)
         getattr(logger, level)(str_msg)
 
     def construst_message(self, here, resetter, view, duration):
@@ -411,6 +603,7 @@ class CFMENavigateStep(NavigateStep):
             raise exceptions.NavigationError(self._name)
 
         _tries += 1
+        self._page_health = None
         for arg in nav_args:
             if arg in kwargs:
                 nav_args[arg] = kwargs.pop(arg)
@@ -422,16 +615,23 @@ class CFMENavigateStep(NavigateStep):
         except Exception as e:
             self.log_message(
                 "Exception raised [{}] whilst checking if already here".format(e), level="error")
-        if not here:
+        route = 'here'
+        if not here and self.jump():
+            route = 'url'
+        elif not here:
+            route = 'steps'
             self.log_message("Prerequiesite Needed")
             self.prerequisite_view = self.prerequisite()
+            self._page_health = None
             self.check_for_badness(self.step, _tries, nav_args, *args, **kwargs)
         if nav_args['use_resetter']:
             resetter_used = True
             self.check_for_badness(self.resetter, _tries, nav_args, *args, **kwargs)
         self.check_for_badness(self.post_navigate, _tries, nav_args, *args, **kwargs)
         view = self.view if self.VIEW is not None else None
-        duration = int((time.time() - start_time) * 1000)
+        elapsed = time.time() - start_time
+        navigation_stats.record(self.destination, elapsed, route)
+        duration = int(elapsed * 1000)
         self.log_message(self.construst_message(here, resetter_used, view, duration), level="info")
         return view
 
@@ -453,3 +653,16 @@ class ViaUI(Implementation):
         wt = MiqBrowser(browser, self)
         manager.add_cleanup(self._reset_cache)
         return wt
+
+    @cached_property
+    def object_ids(self):
+        """Object ids resolved for direct URL navigation on this appliance"""
+        return {}
+
+    def object_id(self, key, resolver):
+        if key not in self.object_ids:
+            self.object_ids[key] = resolver()
+        return self.object_ids[key]
+
+    def forget_object_id(self, key):
+        self.object_ids.pop(key, None)
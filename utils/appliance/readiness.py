@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+import time
+from collections import OrderedDict
+from concurrent import futures
+
+import attr
+import requests
+from sqlalchemy import func
+
+from utils import conf
+from utils.wait import TimedOutError
+from .plugin import AppliancePlugin
+
+
+@attr.s
+class ApplianceReadiness(AppliancePlugin):
+    """Layered readiness probe checking all configured layers in parallel.
+
+    Layers:
+
+        * ``evmserverd`` - the ``evmserverd`` service is active
+        * ``workers`` - an UI worker is registered and running in the ``miq_workers`` table
+        * ``ui`` - the UI responds with HTTP 200
+        * ``api`` - the REST API entry point responds with HTTP 200
+
+    Per-layer timings of the last :py:meth:`wait_for_ready` call are kept in :py:attr:`timings`.
+
+    Usage:
+
+        .. code-block:: python
+
+            appliance.readiness.wait_for_ready(layers=('evmserverd', 'ui'))
+            appliance.readiness.timings  # {'evmserverd': 12.1, 'ui': 41.7}
+    """
+    LAYERS = ('evmserverd', 'workers', 'ui', 'api')
+    RUNNING_WORKER_STATES = ('started', 'ready', 'working')
+
+    layers = attr.ib(default=LAYERS)
+    http_timeout = attr.ib(default=15)
+    timings = attr.ib(init=False, default=attr.Factory(OrderedDict))
+
+    def check_evmserverd(self):
+        with self.appliance.ssh_client as ssh:
+            return ssh.run_command('systemctl is-active evmserverd').rc == 0
+
+    def check_workers(self):
+        db = self.appliance.db.client
+        workers = db['miq_workers']
+        return db.session.query(func.count(workers.id))\
+            .filter(workers.type.like('%UiWorker'))\
+            .filter(workers.status.in_(self.RUNNING_WORKER_STATES))\
+            .scalar() > 0
+
+    def check_ui(self):
+        response = requests.get(self.appliance.url, timeout=self.http_timeout, verify=False)
+        return response.status_code == 200
+
+    def check_api(self):
+        response = requests.get(
+            '{}://{}:{}/api'.format(
+                self.appliance.scheme, self.appliance.address, self.appliance.ui_port),
+            auth=(conf.credentials['default']['username'],
+                  conf.credentials['default']['password']),
+            timeout=self.http_timeout, verify=False)
+        return response.status_code == 200
+
+    def _check_layer(self, layer):
+        try:
+            return bool(getattr(self, 'check_{}'.format(layer))())
+        except ValueError:
+            # requests exposes invalid URLs as ValueErrors, waiting will not fix them
+            raise
+        except Exception as e:
+            self.logger.debug('Readiness layer %s not ready: %s', layer, str(e))
+            return False
+
+    def check(self, layers=None):
+        """Checks the given layers in parallel.
+
+        Returns: :py:class:`dict` of layer name to bool
+        """
+        layers = tuple(layers or self.layers)
+        for layer in layers:
+            if layer not in self.LAYERS:
+                raise ValueError('Unknown readiness layer {!r}'.format(layer))
+        with futures.ThreadPoolExecutor(max_workers=len(layers)) as executor:
+            results = {layer: executor.submit(self._check_layer, layer) for layer in layers}
+        return {layer: future.result() for layer, future in results.items()}
+
+    def is_ready(self, layers=None):
+        return all(self.check(layers).values())
+
+    def wait_for_ready(self, layers=None, timeout=900, delay=1, max_delay=10):
+        """Waits until all the layers are ready.
+
+        The layers which did not pass yet are checked in parallel on every poll, a passed layer is
+        not checked again. The polling interval starts at ``delay`` and doubles up to
+        ``max_delay``.
+
+        Args:
+            layers: Layers to wait for (default from the plugin)
+            timeout: Number of seconds to wait until timeout
+            delay: Initial polling interval in seconds
+            max_delay: Maximum polling interval in seconds
+
+        Returns: :py:class:`dict` of layer name to seconds it took for it to become ready
+        """
+        pending = list(layers or self.layers)
+        self.timings = OrderedDict()
+        start = time.time()
+        while True:
+            results = self.check(pending)
+            elapsed = time.time() - start
+            for layer in list(pending):
+                if results[layer]:
+                    self.timings[layer] = elapsed
+                    pending.remove(layer)
+                    self.logger.info('Readiness layer %s ready after %.1fs', layer, elapsed)
+            if not pending:
+                return self.timings
+            if elapsed + delay > timeout:
+                raise TimedOutError(
+                    'Appliance layers {} not ready within {}s (ready: {})'.format(
+                        ', '.join(pending), timeout, dict(self.timings)))
+            time.sleep(delay)
+            delay = min(delay * 2, max_delay)
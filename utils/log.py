@@ -132,7 +132,9 @@ Members
 """
 import inspect
 import logging
+import Queue
 import sys
+import threading
 import warnings
 from time import time
 from traceback import extract_tb, format_tb
@@ -429,17 +431,149 @@ def nth_frame_info(n):
 
 
 class ArtifactorHandler(logging.Handler):
-    """Logger handler that hands messages off to the artifactor"""
+    """Logger handler that hands messages off to the artifactor
+
+    Records are queued and shipped by a background thread in batches, one ``log_message`` hook
+    call per batch. A batch is sent when it reaches ``batch_size`` records, ``flush_interval``
+    seconds after its first record, or on :py:meth:`flush`. A single thread ships the records
+    of this process, so they arrive in order.
+
+    At most ``max_queued`` records are buffered. When the buffer is full, the ``overflow`` policy
+    either makes the logging call wait (``'block'``) or drops the record (``'drop'``); the number
+    of dropped records is reported in the next batch. Records logged by the shipping thread itself
+    are never waited for, it would wait for itself.
+
+    :py:meth:`flush` and :py:meth:`close` wait at most ``join_timeout`` seconds for the records to
+    be shipped, so a dead artifactor server does not hang the exit. After :py:meth:`close` the
+    records are ignored.
+    """
 
     slaveid = artifactor = None
 
+    _FLUSH = object()
+    _STOP = object()
+
+    def __init__(self, batch_size=500, flush_interval=1.0, max_queued=20000, overflow='drop',
+                 join_timeout=10):
+        logging.Handler.__init__(self)
+        if overflow not in {'block', 'drop'}:
+            raise ValueError('overflow must be either block or drop, not {!r}'.format(overflow))
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.overflow = overflow
+        self.join_timeout = join_timeout
+        self.dropped = 0
+        self._dropped_lock = threading.Lock()
+        self._queue = Queue.Queue(maxsize=max_queued)
+        self._thread = None
+        self._thread_lock = threading.Lock()
+        self._closed = False
+
+    def _ensure_thread(self):
+        with self._thread_lock:
+            if self._closed:
+                return False
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._ship_loop, name='artifactor-log')
+                self._thread.daemon = True
+                self._thread.start()
+            return True
+
+    def handle(self, record):
+        # The queue is thread safe, the handler lock would only make a blocked logging call hold
+        # up the other threads, the shipping one included
+        rv = self.filter(record)
+        if rv:
+            self.emit(record)
+        return rv
+
     def emit(self, record):
-        if self.artifactor:
-            self.artifactor.fire_hook(
-                'log_message',
-                log_record=record.__dict__,
-                slaveid=self.slaveid,
-            )
+        if not self.artifactor or self._closed:
+            return
+        if not self._ensure_thread():
+            return
+        block = self.overflow == 'block' and threading.current_thread() is not self._thread
+        try:
+            self._queue.put(dict(record.__dict__), block=block)
+        except Queue.Full:
+            with self._dropped_lock:
+                self.dropped += 1
+
+    def _next_batch(self):
+        batch = []
+        item = self._queue.get()
+        deadline = time() + self.flush_interval
+        while True:
+            if item is self._FLUSH or item is self._STOP:
+                return batch, item
+            batch.append(item)
+            timeout = deadline - time()
+            if len(batch) >= self.batch_size or timeout <= 0:
+                return batch, None
+            try:
+                item = self._queue.get(timeout=timeout)
+            except Queue.Empty:
+                return batch, None
+
+    def _ship_loop(self):
+        while True:
+            batch, control = self._next_batch()
+            taken = len(batch) + (control is not None)
+            try:
+                with self._dropped_lock:
+                    dropped, self.dropped = self.dropped, 0
+                if dropped:
+                    batch.append(logging.makeLogRecord({
+                        'name': 'cfme', 'levelno': logging.WARNING, 'levelname': 'WARNING',
+                        'msg': '{} log records dropped, the artifactor log queue was full'.format(
+                            dropped)}).__dict__)
+                if batch:
+                    self.artifactor.fire_hook(
+                        'log_message', log_records=batch, slaveid=self.slaveid)
+            except Exception as e:
+                sys.stderr.write('Could not ship log records to artifactor: {}\n'.format(e))
+            finally:
+                for _ in range(taken):
+                    self._queue.task_done()
+            if control is self._STOP:
+                return
+
+    def _join(self):
+        """Waits until the queued records are shipped, returns whether they were in time."""
+        deadline = time() + self.join_timeout
+        with self._queue.all_tasks_done:
+            while self._queue.unfinished_tasks:
+                remaining = deadline - time()
+                if remaining <= 0:
+                    return False
+                self._queue.all_tasks_done.wait(remaining)
+        return True
+
+    def _send_control(self, control):
+        """Queues the control item and waits for it, returns whether it was done in time."""
+        if threading.current_thread() is self._thread:
+            # Everything queued before was already taken by this thread
+            return True
+        try:
+            self._queue.put(control, timeout=self.join_timeout)
+        except Queue.Full:
+            return False
+        return self._join()
+
+    def flush(self):
+        """Waits until all the queued records are shipped, at most ``join_timeout`` seconds"""
+        if not self._closed and self._thread is not None and self._thread.is_alive():
+            if not self._send_control(self._FLUSH):
+                sys.stderr.write('Timed out shipping log records to artifactor\n')
+
+    def close(self):
+        with self._thread_lock:
+            was_closed, self._closed = self._closed, True
+            thread = None if was_closed else self._thread
+        if thread is not None and thread.is_alive():
+            if not self._send_control(self._STOP):
+                sys.stderr.write('Timed out shipping log records to artifactor\n')
+        logging.Handler.close(self)
 
 
 logger = setup_logger(logging.getLogger('cfme'))
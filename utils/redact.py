@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+"""Single pass masking of secret words in text.
+
+All the words are compiled into one Aho-Corasick automaton, so the text is scanned once no matter
+how many words there are. Every character covered by an occurrence of any of the words is replaced
+by the mask character.
+
+Usage:
+
+.. code-block:: python
+
+    redactor = Redactor(['secret', 'password'])
+    redactor.redact('my secret password')  # u'my ****** ********'
+
+    stream = redactor.stream()
+    for chunk in chunks:
+        output.write(stream.feed(chunk))
+    output.write(stream.close())
+"""
+import codecs
+from collections import deque
+
+
+def _to_unicode(text):
+    if isinstance(text, unicode):
+        return text
+    if not isinstance(text, str):
+        text = str(text)
+    return text.decode('utf-8', 'replace')
+
+
+class Redactor(object):
+    """Aho-Corasick automaton over the secret words.
+
+    Args:
+        words: Iterable of the words to mask, non-string values are converted with ``str``
+        mask: Character which replaces the characters of the words
+    """
+    def __init__(self, words, mask=u'*'):
+        self.words = frozenset(_to_unicode(word) for word in words if word not in (None, ''))
+        self.mask = mask
+        # Node 0 is the root, every node has its transitions, fail link and the length of the
+        # longest word ending in it (following the fail links)
+        self._goto = [{}]
+        self._fail = [0]
+        self._longest = [0]
+        for word in self.words:
+            self._add(word)
+        self._build_fail_links()
+        self.max_len = max([len(word) for word in self.words] or [0])
+
+    def _add(self, word):
+        node = 0
+        for char in word:
+            if char not in self._goto[node]:
+                self._goto.append({})
+                self._fail.append(0)
+                self._longest.append(0)
+                self._goto[node][char] = len(self._goto) - 1
+            node = self._goto[node][char]
+        self._longest[node] = max(self._longest[node], len(word))
+
+    def _build_fail_links(self):
+        queue = deque(self._goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for char, child in self._goto[node].iteritems():
+                queue.append(child)
+                fail = self._fail[node]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[child] = self._goto[fail].get(char, 0)
+                self._longest[child] = max(self._longest[child], self._longest[self._fail[child]])
+
+    def _step(self, node, char):
+        while node and char not in self._goto[node]:
+            node = self._fail[node]
+        return self._goto[node].get(char, 0)
+
+    def stream(self):
+        """Returns a :py:class:`RedactingStream` for masking text coming in chunks."""
+        return RedactingStream(self)
+
+    def redact(self, text):
+        """Returns the text with all the words masked."""
+        stream = self.stream()
+        return stream.feed(text) + stream.close()
+
+
+class RedactingStream(object):
+    """Masks the words in text fed in chunks, matches spanning chunk borders included.
+
+    Up to ``max_len - 1`` characters are held back until it is known whether they are a part of a
+    word, :py:meth:`close` returns the rest. Byte chunks are decoded as UTF-8 incrementally, so a
+    character split between two chunks is decoded whole.
+    """
+    def __init__(self, redactor):
+        self.redactor = redactor
+        self._node = 0
+        self._chars = deque()
+        self._masked = deque()
+        self._decoder = codecs.getincrementaldecoder('utf-8')('replace')
+
+    def _decode(self, text):
+        if isinstance(text, str):
+            return self._decoder.decode(text)
+        return _to_unicode(text)
+
+    def feed(self, text):
+        redactor = self.redactor
+        text = self._decode(text)
+        if not redactor.words:
+            return text
+        chars, masked = self._chars, self._masked
+        keep = redactor.max_len - 1
+        output = []
+        node = self._node
+        for char in text:
+            node = redactor._step(node, char)
+            chars.append(char)
+            masked.append(False)
+            length = redactor._longest[node]
+            # The longest word ending here covers all the shorter ones ending here as well
+            for index in xrange(len(chars) - length, len(chars)):
+                masked[index] = True
+            while len(chars) > keep:
+                char = chars.popleft()
+                output.append(redactor.mask if masked.popleft() else char)
+        self._node = node
+        return u''.join(output)
+
+    def close(self):
+        """Returns the characters held back, masked where needed."""
+        # Bytes of an incomplete character at the end are decoded as the replacement character
+        output = [self.feed(self._decoder.decode('', final=True))]
+        output.extend(
+            self.redactor.mask if is_masked else char
+            for char, is_masked in zip(self._chars, self._masked))
+        self._chars.clear()
+        self._masked.clear()
+        self._node = 0
+        self._decoder.reset()
+        return u''.join(output)
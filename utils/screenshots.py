@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+"""Screenshot storage off the test thread.
+
+The test thread only takes the screenshot from WebDriver and hands the base64 data to
+:py:meth:`ScreenshotPipeline.submit`. Decoding, hashing, writing and the optional thumbnails are
+done by a background thread. Pages already captured are looked up in a set by their name (URL),
+screenshots with the same content as an already stored one are hard linked to it instead of being
+written again.
+
+Usage:
+
+.. code-block:: python
+
+    pipeline = ScreenshotPipeline(log_path.join('page_screenshots'), thumbnail_size=(320, 200))
+    if pipeline.mark_seen(url):
+        pipeline.submit(url, browser().get_screenshot_as_base64())
+    ...
+    pipeline.flush()
+"""
+import base64
+import hashlib
+import os
+import shutil
+from concurrent import futures
+from threading import Lock
+
+from py.path import local
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+from utils.log import logger
+
+
+def make_thumbnail(png_file, thumbnail_file, size):
+    """Writes a downscaled copy of the PNG keeping its aspect ratio, needs PIL.
+
+    Returns: ``True`` if the thumbnail was written
+    """
+    if Image is None:
+        return False
+    image = Image.open(png_file)
+    image.thumbnail(size, Image.ANTIALIAS)
+    image.save(thumbnail_file, 'PNG')
+    return True
+
+
+class ScreenshotPipeline(object):
+    """Stores screenshots into a directory in a background thread.
+
+    Args:
+        directory: Directory for the screenshots, created when the first one is stored
+        thumbnail_size: ``(width, height)`` of the thumbnails, no thumbnails when ``None``
+    """
+    def __init__(self, directory, thumbnail_size=None):
+        self.directory = local(directory)
+        self.thumbnail_size = thumbnail_size
+        self.names = set()
+        # sha1 of the PNG: path of the file with that content
+        self.hashes = {}
+        self.pending = set()
+        self._lock = Lock()
+        self._executor = futures.ThreadPoolExecutor(max_workers=1)
+
+    def seen(self, name):
+        return name in self.names
+
+    def mark_seen(self, name):
+        """Records the name before its screenshot is taken, so a failing one is not retried.
+
+        Returns: ``False`` if the name was already recorded
+        """
+        if name in self.names:
+            return False
+        self.names.add(name)
+        return True
+
+    def submit(self, name, screenshot):
+        """Queues the base64 encoded PNG to be stored as ``<name>.png``.
+
+        Returns: :py:class:`concurrent.futures.Future` of the stored file path
+        """
+        self.names.add(name)
+        future = self._executor.submit(self._store, name, screenshot)
+        with self._lock:
+            self.pending.add(future)
+        future.add_done_callback(self._done)
+        return future
+
+    def _done(self, future):
+        with self._lock:
+            self.pending.discard(future)
+        if future.exception() is not None:
+            logger.warning('Could not store a screenshot: %s', future.exception())
+
+    def _store(self, name, screenshot):
+        png = base64.b64decode(screenshot)
+        digest = hashlib.sha1(png).hexdigest()
+        self.directory.ensure(dir=True)
+        path = self.directory.join('{}.png'.format(name)).strpath
+        thumbnail = self.directory.join('{}.thumb.png'.format(name)).strpath
+        original = self.hashes.get(digest)
+        if original is not None and os.path.exists(original):
+            self._link(original, path)
+            if self.thumbnail_size and os.path.exists(self._thumbnail_of(original)):
+                self._link(self._thumbnail_of(original), thumbnail)
+            return path
+        with open(path, 'wb') as f:
+            f.write(png)
+        self.hashes[digest] = path
+        if self.thumbnail_size:
+            make_thumbnail(path, thumbnail, self.thumbnail_size)
+        return path
+
+    @staticmethod
+    def _thumbnail_of(path):
+        return '{}.thumb.png'.format(path[:-len('.png')])
+
+    @staticmethod
+    def _link(source, target):
+        if os.path.exists(target):
+            os.remove(target)
+        try:
+            os.link(source, target)
+        except OSError:
+            shutil.copyfile(source, target)
+
+    def flush(self):
+        """Waits until all the queued screenshots are stored."""
+        with self._lock:
+            pending = list(self.pending)
+        futures.wait(pending)
@@ -0,0 +1,153 @@
+"""Merging of simplecov results without ruby on the appliance
+
+simplecov writes one ``.resultset.json`` per process, in the form::
+
+    {"<command name>": {"coverage": {"<file name>": [null, 1, 0, ...]}, "timestamp": 1234}}
+
+where every line of a file has its hit count, or ``null`` if the line is not relevant. Merging
+two results of a file sums the hit counts line by line, a line stays ``null`` only if it is
+``null`` in both of them (same as simplecov does it).
+
+The results are merged as sorted streams of ``(file name, lines)`` pairs, so a merge only needs to
+hold one file per input in memory. :py:func:`write_partial` stores such a stream as JSON lines,
+which lets partially merged results (e.g. one per appliance) be merged again later with
+:py:func:`merge_streams` as they come in. :py:func:`merge_archive` merges the resultsets of an
+archive this way, with only one of them loaded at a time.
+"""
+import heapq
+import json
+import os
+import shutil
+import tarfile
+import tempfile
+import time
+from itertools import groupby
+
+
+def merge_lines(*line_lists):
+    """Sums the hit counts of the coverage line lists of one file."""
+    merged = []
+    for line_list in line_lists:
+        if len(line_list) > len(merged):
+            merged.extend([None] * (len(line_list) - len(merged)))
+        for i, hits in enumerate(line_list):
+            if hits is None:
+                continue
+            merged[i] = (merged[i] or 0) + hits
+    return merged
+
+
+def iter_resultset(resultset):
+    """Yields ``(file name, lines)`` of a loaded resultset dict sorted by the file name.
+
+    Files present in more commands of the resultset are yielded once, already merged.
+    """
+    streams = [
+        sorted(result.get('coverage', {}).iteritems())
+        for result in resultset.itervalues()]
+    return merge_streams(*streams)
+
+
+def merge_streams(*streams):
+    """k-way merge of sorted ``(file name, lines)`` streams, yields merged sorted pairs."""
+    # Decorate with the stream index so that the line lists never get compared by heapq
+    decorated = [
+        ((filename, index, lines) for filename, lines in stream)
+        for index, stream in enumerate(streams)]
+    for filename, group in groupby(heapq.merge(*decorated), key=lambda item: item[0]):
+        yield filename, merge_lines(*[lines for _, _, lines in group])
+
+
+def iter_archive_resultsets(archive):
+    """Yields the resultset dicts of all ``.resultset.json`` files in a tar archive.
+
+    The archive is read as a stream, so it does not have to be extracted first.
+    Files which are not valid JSON (e.g. a process killed while writing) are skipped.
+    """
+    with tarfile.open(archive, mode='r|*') as tar:
+        for member in tar:
+            if not member.isfile() or not member.name.endswith('.resultset.json'):
+                continue
+            try:
+                yield json.load(tar.extractfile(member))
+            except ValueError:
+                continue
+
+
+def write_partial(path, stream):
+    """Writes a sorted ``(file name, lines)`` stream as JSON lines, returns the number of files."""
+    count = 0
+    with open(path, 'w') as f:
+        for filename, lines in stream:
+            f.write(json.dumps([filename, lines]))
+            f.write('\n')
+            count += 1
+    return count
+
+
+def read_partial(path):
+    """Yields the ``(file name, lines)`` pairs of a file written by :py:func:`write_partial`."""
+    with open(path) as f:
+        for line in f:
+            if line.strip():
+                filename, lines = json.loads(line)
+                yield filename, lines
+
+
+def merge_partials(paths, path, max_open=64):
+    """Merges the partials into one written to ``path``, returns the number of files.
+
+    At most ``max_open`` partials are read at once, more are merged in batches first.
+    """
+    work_dir = tempfile.mkdtemp(dir=os.path.dirname(os.path.abspath(path)))
+    try:
+        paths = list(paths)
+        round_ = 0
+        while len(paths) > max_open:
+            merged = []
+            for i in range(0, len(paths), max_open):
+                batch_path = os.path.join(work_dir, '{}-{}.jsonl'.format(round_, i))
+                write_partial(batch_path, merge_streams(
+                    *[read_partial(partial) for partial in paths[i:i + max_open]]))
+                merged.append(batch_path)
+            paths = merged
+            round_ += 1
+        return write_partial(path, merge_streams(*[read_partial(partial) for partial in paths]))
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def merge_archive(archive, path, max_open=64):
+    """Merges all the resultsets in the archive into a partial written to ``path``.
+
+    Every resultset is loaded alone and written out as a partial, the partials are then merged
+    with :py:func:`merge_partials`.
+
+    Returns: ``(number of resultsets, number of files)``
+    """
+    work_dir = tempfile.mkdtemp(dir=os.path.dirname(os.path.abspath(path)))
+    try:
+        partials = []
+        for resultset in iter_archive_resultsets(archive):
+            partial = os.path.join(work_dir, '{}.jsonl'.format(len(partials)))
+            write_partial(partial, iter_resultset(resultset))
+            partials.append(partial)
+        return len(partials), merge_partials(partials, path, max_open)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def write_resultset(path, stream, command_name, timestamp=None):
+    """Writes a ``(file name, lines)`` stream as a simplecov ``.resultset.json``.
+
+    The file is written as the stream goes, the result is never held in memory as a whole.
+    """
+    if timestamp is None:
+        timestamp = int(time.time())
+    with open(path, 'w') as f:
+        f.write('{{{}: {{"coverage": {{'.format(json.dumps(command_name)))
+        for i, (filename, lines) in enumerate(stream):
+            if i:
+                f.write(', ')
+            f.write('{}: {}'.format(json.dumps(filename), json.dumps(lines)))
+        f.write('}}, "timestamp": {}}}}}'.format(timestamp))
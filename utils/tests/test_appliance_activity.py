@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+from datetime import datetime, timedelta
+
+import pytest
+
+from utils.appliance import IPAppliance
+from utils.appliance.activity import ActivitySnapshot
+from utils.wait import TimedOutError
+
+NOW = datetime(2017, 6, 1, 12, 0, 0)
+
+
+def snapshot(dequeued=0, queued=0, transitioning=0, request_age=None, now=NOW):
+    last_request = now - timedelta(seconds=request_age) if request_age is not None else None
+    return ActivitySnapshot(now, dequeued, queued, transitioning, last_request, None)
+
+
+@pytest.fixture
+def activity(monkeypatch):
+    monkeypatch.setattr('time.sleep', lambda seconds: None)
+    return IPAppliance.from_url('http://127.0.0.2/').activity
+
+
+@pytest.mark.parametrize(('kwargs', 'busy'), [
+    ({}, False),
+    ({'dequeued': 1}, True),
+    ({'queued': 1}, True),
+    ({'transitioning': 2}, True),
+])
+def test_snapshot_busy(kwargs, busy):
+    assert snapshot(**kwargs).is_busy() is busy
+
+
+def test_is_idle_respects_quiet_period(activity, monkeypatch):
+    monkeypatch.setattr(activity, 'snapshot', lambda: snapshot(request_age=30))
+    assert activity.is_idle(quiet_period=20)
+    assert not activity.is_idle(quiet_period=60)
+
+
+def test_wait_for_idle_counts_from_last_busy_poll(activity, monkeypatch):
+    polls = iter([
+        snapshot(dequeued=1),
+        snapshot(now=NOW + timedelta(seconds=5)),
+        snapshot(now=NOW + timedelta(seconds=10)),
+    ])
+    monkeypatch.setattr(activity, 'snapshot', lambda: next(polls))
+    activity.wait_for_idle(quiet_period=10)
+    with pytest.raises(StopIteration):
+        next(polls)
+
+
+def test_wait_for_idle_timeout(activity, monkeypatch):
+    monkeypatch.setattr(activity, 'snapshot', lambda: snapshot(queued=5))
+    with pytest.raises(TimedOutError):
+        activity.wait_for_idle(quiet_period=10, timeout=0)
@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+import pytest
+
+from utils.appliance import IPAppliance
+from utils.wait import TimedOutError
+
+
+@pytest.fixture
+def readiness(monkeypatch):
+    monkeypatch.setattr('time.sleep', lambda seconds: None)
+    return IPAppliance.from_url('http://127.0.0.2/').readiness
+
+
+def test_unknown_layer(readiness):
+    with pytest.raises(ValueError):
+        readiness.check(['foo'])
+
+
+def test_wait_for_ready_records_timings(readiness, monkeypatch):
+    ui_polls = iter([False, RuntimeError('connection refused'), True])
+
+    def check_ui():
+        result = next(ui_polls)
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    monkeypatch.setattr(readiness, 'check_evmserverd', lambda: True)
+    monkeypatch.setattr(readiness, 'check_ui', check_ui)
+    timings = readiness.wait_for_ready(layers=('evmserverd', 'ui'))
+    assert list(timings) == ['evmserverd', 'ui']
+    assert timings['evmserverd'] <= timings['ui']
+
+
+def test_wait_for_ready_timeout(readiness, monkeypatch):
+    monkeypatch.setattr(readiness, 'check_api', lambda: False)
+    with pytest.raises(TimedOutError):
+        readiness.wait_for_ready(layers=('api',), timeout=0)
+
+
+def test_invalid_url_is_raised(readiness, monkeypatch):
+    def check_ui():
+        raise ValueError('Invalid URL')
+
+    monkeypatch.setattr(readiness, 'check_ui', check_ui)
+    with pytest.raises(ValueError):
+        readiness.check(['ui'])
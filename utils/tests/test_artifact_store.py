@@ -0,0 +1,33 @@
+# -*- coding: utf-8 -*-
+import pytest
+from riggerlib.tools import recursive_update
+
+from artifactor.store import MemoryStore, SqliteStore
+
+
+@pytest.fixture(params=['memory', 'sqlite'])
+def stores(request, tmpdir):
+    if request.param == 'memory':
+        return MemoryStore(), MemoryStore()
+    artifacts = SqliteStore(tmpdir.join('artifacts.sqlite').strpath, cache_size=1)
+    return artifacts, artifacts.share('old_artifacts')
+
+
+def test_store_merges_updates_and_queries(stores):
+    artifacts, old_artifacts = stores
+    recursive_update(artifacts, {'a/test_1': {'slaveid': 'gw0', 'files': [1]}})
+    recursive_update(artifacts, {'a/test_2': {'slaveid': 'gw1'}})
+    recursive_update(artifacts, {'a/test_1': {'files': [2], 'statuses': {'overall': 'failed'}}})
+    recursive_update(artifacts, {'a/test_2': {'statuses': {'overall': 'passed'}}})
+
+    assert artifacts['a/test_1'] == {
+        'slaveid': 'gw0', 'files': [1, 2], 'statuses': {'overall': 'failed'}}
+    assert len(artifacts) == 2 and 'a/test_2' in artifacts and 'a/test_3' not in artifacts
+    assert [ident for ident, _ in artifacts.query(slaveid='gw1')] == ['a/test_2']
+    assert [ident for ident, _ in artifacts.query(status='failed')] == ['a/test_1']
+    assert list(artifacts.query(slaveid='gw1', status='failed')) == []
+    assert artifacts.counts() == {'failed': 1, 'passed': 1}
+
+    old_artifacts.update(artifacts)
+    assert sorted(old_artifacts) == ['a/test_1', 'a/test_2']
+    assert dict(old_artifacts.iteritems()) == dict(artifacts.iteritems())
@@ -0,0 +1,23 @@
+import pytest
+
+from utils.appliance.implementations.ui import MiqBrowserPlugin
+
+
+def page_health(datafile, filename):
+    page_html = datafile(filename).read()
+    pytest.sel.get('data:text/html;base64,{}'.format(page_html.encode('base64')))
+    return pytest.sel.execute_script(MiqBrowserPlugin.PAGE_HEALTH_CHECK)
+
+
+@pytest.mark.usefixtures('browser')
+def test_rails_error_page(datafile):
+    health = page_health(datafile, 'rails_error.html')
+    assert health['rails_error'] == (
+        'Internal Server Error: The server encountered an internal error or misconfiguration and '
+        'was unable to complete your request.')
+    assert not health['blocked']
+
+
+@pytest.mark.usefixtures('browser')
+def test_hidden_error_is_not_reported(datafile):
+    assert page_health(datafile, 'hidden_error.html')['rails_error'] is None
@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+import pytest
+
+from utils.redact import Redactor
+
+
+@pytest.mark.parametrize(('words', 'text', 'expected'), [
+    (['secret', 'password'], 'my secret password', u'my ****** ********'),
+    (['abc', 'bcd'], 'xabcdx', u'x****x'),
+    (['aa'], 'aaa', u'***'),
+    (['he', 'she', 'hers'], 'ushers', u'u*****'),
+    ([1234, None, ''], 'pin 1234', u'pin ****'),
+    ([], 'nothing to hide', u'nothing to hide'),
+])
+def test_redact(words, text, expected):
+    assert Redactor(words).redact(text) == expected
+
+
+@pytest.mark.parametrize('chunk_size', [1, 2, 3, 7])
+def test_redact_stream_across_chunks(chunk_size):
+    text = 'password=hunter2 and again hunter2, token=s3cr3t'
+    stream = Redactor(['hunter2', 's3cr3t']).stream()
+    output = u''.join(
+        stream.feed(text[i:i + chunk_size]) for i in range(0, len(text), chunk_size))
+    output += stream.close()
+    assert output == u'password=******* and again *******, token=******'
+
+
+@pytest.mark.parametrize('words', [['hunter2'], []])
+@pytest.mark.parametrize('chunk_size', [1, 2, 4])
+def test_redact_stream_multibyte_across_chunks(words, chunk_size):
+    text = u'aaaž pw=hunter2'.encode('utf-8')
+    stream = Redactor(words).stream()
+    output = u''.join(
+        stream.feed(text[i:i + chunk_size]) for i in range(0, len(text), chunk_size))
+    output += stream.close()
+    assert output == (u'aaaž pw=*******' if words else u'aaaž pw=hunter2')
+
+
+def test_redact_stream_incomplete_character_at_close():
+    stream = Redactor(['x']).stream()
+    assert stream.feed(u'abž'.encode('utf-8')[:-1]) + stream.close() == u'ab\ufffd'
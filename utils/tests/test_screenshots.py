@@ -0,0 +1,33 @@
+# -*- coding: utf-8 -*-
+import base64
+import os
+
+from utils.screenshots import ScreenshotPipeline
+
+PNG_A = base64.b64encode(b'\x89PNG\r\n\x1a\nA')
+PNG_B = base64.b64encode(b'\x89PNG\r\n\x1a\nB')
+
+
+def test_pipeline_dedups_by_name_and_content(tmpdir):
+    pipeline = ScreenshotPipeline(tmpdir.join('shots'))
+    assert not pipeline.seen('page_one')
+    pipeline.submit('page_one', PNG_A)
+    pipeline.submit('error_page', PNG_A)
+    pipeline.submit('page_two', PNG_B)
+    assert pipeline.seen('page_one')
+    pipeline.flush()
+
+    shots = tmpdir.join('shots')
+    assert shots.join('page_one.png').read_binary() == base64.b64decode(PNG_A)
+    assert shots.join('page_two.png').read_binary() == base64.b64decode(PNG_B)
+    # The same content is linked to the first file, not written again
+    assert os.path.samefile(shots.join('page_one.png').strpath,
+                            shots.join('error_page.png').strpath)
+
+
+def test_pipeline_mark_seen_once(tmpdir):
+    pipeline = ScreenshotPipeline(tmpdir.join('shots'))
+    assert pipeline.mark_seen('page_one')
+    # Recorded even though no screenshot was submitted, e.g. when taking it failed
+    assert pipeline.seen('page_one')
+    assert not pipeline.mark_seen('page_one')
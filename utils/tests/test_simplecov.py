@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+import json
+import tarfile
+
+from utils.simplecov import (
+    iter_archive_resultsets, iter_resultset, merge_archive, merge_lines, merge_streams,
+    read_partial, write_partial, write_resultset)
+
+
+def test_merge_lines():
+    assert merge_lines([None, 1, 0], [None, 2, None, 3], [None, None, 0]) == [None, 3, 0, 3]
+
+
+def test_merge_partials_and_write_resultset(tmpdir):
+    first = iter_resultset({
+        'a-1': {'coverage': {'/b.rb': [1, None], '/a.rb': [0]}, 'timestamp': 1},
+        'a-2': {'coverage': {'/a.rb': [2]}, 'timestamp': 2}})
+    second = iter_resultset({'b-1': {'coverage': {'/c.rb': [None, 4], '/b.rb': [1, None]}}})
+    partials = []
+    for i, stream in enumerate([first, second]):
+        partial = tmpdir.join('{}.jsonl'.format(i)).strpath
+        write_partial(partial, stream)
+        partials.append(read_partial(partial))
+
+    resultset = tmpdir.join('.resultset.json')
+    write_resultset(resultset.strpath, merge_streams(*partials), 'CFME', timestamp=3)
+    assert json.loads(resultset.read()) == {'CFME': {
+        'coverage': {'/a.rb': [2], '/b.rb': [2, None], '/c.rb': [None, 4]},
+        'timestamp': 3}}
+
+
+def test_iter_archive_resultsets_skips_broken(tmpdir):
+    coverage = tmpdir.mkdir('coverage')
+    coverage.ensure('10.0.0.1', '1', '.resultset.json').write('{"a": {"coverage": {}}}')
+    coverage.ensure('10.0.0.1', '2', '.resultset.json').write('{"a": {"cove')
+    archive = tmpdir.join('raw.tgz').strpath
+    with tarfile.open(archive, 'w:gz') as tar:
+        tar.add(coverage.strpath, arcname='coverage')
+    assert list(iter_archive_resultsets(archive)) == [{'a': {'coverage': {}}}]
+
+
+def test_merge_archive_in_batches(tmpdir):
+    coverage = tmpdir.mkdir('coverage')
+    for pid in range(5):
+        coverage.ensure('10.0.0.1', str(pid), '.resultset.json').write(json.dumps(
+            {'a': {'coverage': {'/a.rb': [pid, None], '/{}.rb'.format(pid): [1]}}}))
+    archive = tmpdir.join('raw.tgz').strpath
+    with tarfile.open(archive, 'w:gz') as tar:
+        tar.add(coverage.strpath, arcname='coverage')
+    partial = tmpdir.join('10.0.0.1.jsonl').strpath
+    assert merge_archive(archive, partial, max_open=2) == (5, 6)
+    assert list(read_partial(partial)) == [('/0.rb', [1]), ('/1.rb', [1]), ('/2.rb', [1]),
+        ('/3.rb', [1]), ('/4.rb', [1]), ('/a.rb', [10, None])]
+    # Only the merged partial is left
+    assert tmpdir.listdir(lambda p: p.check(file=True), sort=True) == [
+        tmpdir.join('10.0.0.1.jsonl'), tmpdir.join('raw.tgz')]
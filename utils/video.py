@@ -9,11 +9,21 @@ Configuration for this module + fixture:
           dir: video
           display: ":99"
           quality: 10
+          # Session long segmented recording
+          segment_time: 10
+          segments: 90
+          keep: failed  # or all
 
+:py:class:`Recorder` records one file per use with recordmydesktop. :py:class:`SegmentedRecorder`
+records the whole session with ffmpeg into a ring buffer of short segments and cuts clips of
+a time window out of it without re-encoding.
 """
 
+import csv
 import os
 import subprocess
+import tempfile
+import time
 
 from signal import SIGINT
 
@@ -96,3 +106,155 @@ class Recorder(object):
     def __del__(self):
         """If the reference is lost and the object is destroyed ..."""
         self.stop()
+
+
+class SegmentedRecorder(object):
+    """Session long recorder writing the screen into a ring buffer of fixed length segments.
+
+    ffmpeg grabs the display and writes ``segments`` MPEG-TS files of ``segment_time`` seconds,
+    reusing the oldest one when it runs out. The finished segments are listed with their times
+    in a CSV file, :py:meth:`clip` joins the ones covering a time window into a single file.
+    Clips can only reach ``segment_time * (segments - 1)`` seconds back.
+
+    Usage:
+
+        recorder = SegmentedRecorder(directory)
+        recorder.start()
+        start = time.time()
+        # do something
+        recorder.clip(start, time.time(), 'clip.mp4')
+        recorder.stop()
+
+    Args:
+        directory: Directory for the segments
+        display: X display to record
+        segment_time: Length of a segment in seconds
+        segments: Number of segments in the ring buffer
+        framerate: Frames per second
+        crf: x264 constant rate factor, higher is smaller and worse
+    """
+    SEGMENT_LIST = 'segments.csv'
+    #: ffmpeg errors go there, a pipe nobody reads would block ffmpeg once full
+    LOG_FILE = 'ffmpeg.log'
+
+    def __init__(self, directory, display=None, segment_time=10, segments=90, framerate=10,
+                 crf=30):
+        self.directory = directory
+        self.display = display or vid_options["display"]
+        self.segment_time = segment_time
+        self.segments = max(int(segments), 2)
+        self.framerate = framerate
+        self.crf = crf
+        self.proc = None
+        self.started_at = None
+        self._log = None
+
+    @property
+    def segment_list(self):
+        return os.path.join(self.directory, self.SEGMENT_LIST)
+
+    def start(self):
+        if self.running:
+            return
+        try:
+            os.makedirs(self.directory)
+        except OSError:
+            pass
+        cmd_line = [
+            'ffmpeg', '-nostdin', '-loglevel', 'error', '-y',
+            '-f', 'x11grab', '-framerate', str(self.framerate), '-i', str(self.display),
+            '-c:v', 'libx264', '-preset', 'ultrafast', '-crf', str(self.crf),
+            '-pix_fmt', 'yuv420p',
+            # Every segment has to start with a key frame to be joined without re-encoding
+            '-force_key_frames', 'expr:gte(t,n_forced*{})'.format(self.segment_time),
+            '-f', 'segment', '-segment_time', str(self.segment_time),
+            '-segment_wrap', str(self.segments),
+            # The segment being written over is never listed
+            '-segment_list', self.segment_list, '-segment_list_type', 'csv',
+            '-segment_list_size', str(self.segments - 1),
+            '-reset_timestamps', '1',
+            os.path.join(self.directory, 'segment%03d.ts')]
+        self._close_log()
+        self._log = open(os.path.join(self.directory, self.LOG_FILE), 'a')
+        try:
+            with open(os.devnull, 'w') as devnull:
+                self.proc = subprocess.Popen(cmd_line, stdout=devnull, stderr=self._log)
+            self.started_at = time.time()
+        except OSError:
+            # Had to disable for artifactor
+            # logger.exception("Couldn't initialize videoer! Is ffmpeg installed?")
+            self.proc = None
+            self._close_log()
+
+    def _close_log(self):
+        if self._log is not None:
+            self._log.close()
+            self._log = None
+
+    @property
+    def running(self):
+        return self.proc is not None and self.proc.poll() is None
+
+    def stop(self):
+        if self.running:
+            # ffmpeg finishes the segment and the segment list on SIGINT
+            self.proc.send_signal(SIGINT)
+            self.proc.wait()
+        self.proc = None
+        self._close_log()
+
+    def list_segments(self):
+        """Returns list of ``(filename, start, end)`` of the finished segments, in wall clock."""
+        if self.started_at is None or not os.path.exists(self.segment_list):
+            return []
+        segments = []
+        with open(self.segment_list, 'rb') as f:
+            for row in csv.reader(f):
+                try:
+                    name, start, end = row[0], float(row[1]), float(row[2])
+                except (IndexError, ValueError):
+                    continue
+                segments.append(
+                    (os.path.join(self.directory, name),
+                     self.started_at + start, self.started_at + end))
+        return segments
+
+    def clip(self, start, end, filename, timeout=None):
+        """Joins the segments covering the time window into filename, without re-encoding.
+
+        Waits until the segment covering ``end`` is finished, up to ``timeout`` seconds (two
+        segment lengths by default).
+
+        Returns: ``True`` if the clip was written
+        """
+        timeout = self.segment_time * 2 if timeout is None else timeout
+        deadline = time.time() + timeout
+        while True:
+            segments = self.list_segments()
+            if (segments and segments[-1][2] >= end) or not self.running or \
+                    time.time() >= deadline:
+                break
+            time.sleep(min(1, self.segment_time))
+        segments = [
+            segment for segment in segments if segment[2] >= start and segment[1] <= end]
+        if not segments:
+            return False
+        fd, concat_list = tempfile.mkstemp(suffix='.txt', dir=self.directory)
+        try:
+            with os.fdopen(fd, 'w') as f:
+                for segment_file, _, _ in segments:
+                    f.write("file '{}'\n".format(segment_file.replace("'", "'\\''")))
+            with open(os.devnull, 'w') as devnull:
+                return subprocess.call(
+                    ['ffmpeg', '-nostdin', '-loglevel', 'error', '-y', '-f', 'concat', '-safe',
+                     '0', '-i', concat_list, '-c', 'copy', filename],
+                    stdout=devnull, stderr=devnull) == 0
+        finally:
+            os.remove(concat_list)
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, t, v, tb):
+        self.stop()